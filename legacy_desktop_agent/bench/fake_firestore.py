@@ -0,0 +1,245 @@
+"""In-memory stand-in for the Firestore client, covering what the agent uses.
+
+Documents, queries (where/stream/on_snapshot), batches and document watches
+behave like the real client closely enough for the agent's code paths.
+Transactions are not supported, so lease claims need the emulator. Every
+call can be given a fixed `latency` to mimic a network round trip.
+"""
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from firebase_admin import firestore
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _resolve(value):
+    """Replaces write sentinels the way the server would."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    return value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeWatch:
+    def __init__(self, store, key, callback):
+        self._store, self._key, self.callback = store, key, callback
+
+    def unsubscribe(self):
+        with self._store.lock:
+            watches = self._store.watches.get(self._key, [])
+            if self in watches:
+                watches.remove(self)
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.docs = {}      # document path -> data
+        self.watches = {}   # document path or query key -> [FakeWatch]
+        self.lock = threading.RLock()
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self, **kwargs):
+        raise NotImplementedError("FakeFirestore has no transactions; use the emulator for lease tests")
+
+    # --- writes (all go through here so watches fire) ---
+
+    def _write(self, path, mutate):
+        with self.lock:
+            before = self.docs.get(path)
+            after = mutate(copy.deepcopy(before))
+            if after is None:
+                self.docs.pop(path, None)
+            else:
+                self.docs[path] = after
+            parent = path.rsplit('/', 1)[0]
+            watches = list(self.watches.get(path, [])) + [w for key, ws in self.watches.items()
+                                                          if isinstance(key, FakeQuery) and key._path == parent
+                                                          for w in ws]
+        for watch in watches:
+            self._notify(watch)
+
+    def _notify(self, watch):
+        key = watch._key
+        if isinstance(key, FakeQuery):
+            snapshots = key._matching()
+        else:
+            snapshots = [FakeDocument(self, key).get(_count=False)]
+        # The real client calls back from its own thread, never from the writer
+        threading.Thread(target=watch.callback, args=(snapshots, [], datetime.now(timezone.utc)),
+                         daemon=True).start()
+
+    def _watch(self, key, callback):
+        watch = FakeWatch(self, key, callback)
+        with self.lock:
+            self.watches.setdefault(key, []).append(watch)
+        self._notify(watch)
+        return watch
+
+
+class FakeDocument:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self._store, f"{self.path}/{name}")
+
+    def get(self, transaction=None, _count=True):
+        if _count:
+            self._store._call()
+        with self._store.lock:
+            return FakeSnapshot(self, copy.deepcopy(self._store.docs.get(self.path)))
+
+    def set(self, data, merge=False):
+        self._store._call()
+        self._apply_set(data, merge)
+
+    def update(self, fields):
+        self._store._call()
+        self._apply_update(fields)
+
+    def delete(self):
+        self._store._call()
+        self._store._write(self.path, lambda before: None)
+
+    def on_snapshot(self, callback):
+        return self._store._watch(self.path, callback)
+
+    def _apply_set(self, data, merge):
+        def mutate(before):
+            if merge and before:
+                before.update(_resolve(data))
+                return before
+            return _resolve(dict(data))
+        self._store._write(self.path, mutate)
+
+    def _apply_update(self, fields):
+        def mutate(before):
+            if before is None:
+                raise KeyError(f"No document to update: {self.path}")
+            for key, value in fields.items():
+                if value is firestore.DELETE_FIELD:
+                    before.pop(key, None)
+                else:
+                    before[key] = _resolve(value)
+            return before
+        self._store._write(self.path, mutate)
+
+
+class FakeQuery:
+    def __init__(self, store, collection_path, filters=()):
+        self._store = store
+        self._path = collection_path
+        self._filters = tuple(filters)
+        self._limit = None
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:  # FieldFilter keyword form
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return FakeQuery(self._store, self._path, self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        query = FakeQuery(self._store, self._path, self._filters)
+        query._limit = count
+        return query
+
+    def _matching(self):
+        prefix = self._path + '/'
+        with self._store.lock:
+            items = [(path, copy.deepcopy(data)) for path, data in self._store.docs.items()
+                     if path.startswith(prefix) and '/' not in path[len(prefix):]]
+        matches = [FakeSnapshot(FakeDocument(self._store, path), data) for path, data in items
+                   if all(_OPS[op](data.get(field), value) for field, op, value in self._filters)]
+        return matches[:self._limit] if self._limit else matches
+
+    def stream(self, transaction=None):
+        self._store._call()
+        return iter(self._matching())
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._store._watch(self, callback)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocument(self._store, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(lambda: ref._apply_set(data, merge))
+
+    def update(self, ref, fields):
+        self._writes.append(lambda: ref._apply_update(fields))
+
+    def delete(self, ref):
+        self._writes.append(lambda: self._store._write(ref.path, lambda before: None))
+
+    def commit(self):
+        self._store._call()
+        for write in self._writes:
+            write()
+        self._writes = []
@@ -0,0 +1,57 @@
+"""Local HTTP server for the bench fixtures (Flow-like page plus downloadable scene videos)."""
+import hashlib
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+VIDEO_BYTES = 256 * 1024       # Size of each fake scene download (above the download minBytes check)
+
+
+def fake_video(number, size=VIDEO_BYTES):
+    """Deterministic, distinct bytes per scene (downloads are checked for duplicates by hash)."""
+    seed = hashlib.sha256(f"scene-{number}".encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES_DIR, **kwargs)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/video/'):
+            name = os.path.basename(path)
+            number = int(''.join(ch for ch in name if ch.isdigit()) or 0)
+            body = fake_video(number)
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Serves bench/fixtures on 127.0.0.1 from a daemon thread (port 0 = any free port)."""
+
+    def __init__(self, port=0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+        self.port = self._server.server_address[1]
+
+    def url(self, page='flow.html', **params):
+        query = '&'.join(f"{key}={value}" for key, value in params.items())
+        return f"http://127.0.0.1:{self.port}/{page}" + (f"?{query}" if query else '')
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, name='bench-fixtures', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
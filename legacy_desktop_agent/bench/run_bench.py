@@ -0,0 +1,378 @@
+"""Offline benchmark of the agent against local fixture pages and an in-memory Firestore.
+
+Runs recipe (play_recipe), CMD_PLAY (execute_playback_session) and
+CMD_STITCH_VIDEO (stitch_videos) jobs through the real executor and writes
+jobs/min, time to first step, per-step latency and peak memory to JSON.
+
+Usage (from legacy_desktop_agent/):
+    python -m bench.run_bench --jobs 10
+    python -m bench.run_bench --scenarios stitch --compare bench/results/<earlier>.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from bench.fake_firestore import FakeFirestore
+from bench.fixture_server import FixtureServer
+from main import ContentAutoPostAgent
+from tracing import TRACE_FILE
+
+# --- CONFIGURATION ---
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ('recipe', 'playback', 'stitch')
+FINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED')
+MEMORY_SAMPLE_INTERVAL = 0.2   # Seconds between RSS samples
+REGRESSION_THRESHOLD = 0.10    # Relative change flagged by --compare
+BENCH_PROJECT = 'bench-project'
+BENCH_RECIPE = 'bench_recipe'
+# Metrics compared between runs: (path in the scenario result, True if higher is better)
+COMPARED = (
+    ('jobsPerMinute', True),
+    ('firstStepSeconds.p50', False),
+    ('jobSeconds.p50', False),
+    ('jobSeconds.p95', False),
+    ('peakRssMB', False),
+)
+
+
+class MemorySampler:
+    """Peak RSS of the agent and its children (Chromium, ffmpeg) while a scenario runs.
+
+    Uses psutil when installed; otherwise falls back to getrusage, which only
+    sees this process and children that have already exited.
+    """
+
+    def __init__(self):
+        self.peak_mb = 0.0
+        self.source = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try:
+            import psutil
+        except ImportError:
+            return None
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / 1024 ** 2
+
+    def _run(self):
+        while not self._stop.is_set():
+            sample = self._sample()
+            if sample is None:
+                return
+            self.source = 'psutil'
+            self.peak_mb = max(self.peak_mb, sample)
+            self._stop.wait(MEMORY_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self.source is None:
+            try:
+                import resource
+                scale = 1024 ** 2 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+                self.peak_mb = sum(resource.getrusage(who).ru_maxrss for who in
+                                   (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) / scale
+                self.source = 'getrusage'
+            except ImportError:
+                self.source = 'unavailable'
+
+
+def distribution(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': round(statistics.fmean(values), 3),
+        'p50': round(values[len(values) // 2], 3),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def _steps(node):
+    if node.get('name') == 'step':
+        yield node
+    for child in node.get('children', []):
+        yield from _steps(child)
+
+
+def read_trace(traces_dir, job_id):
+    path = os.path.join(traces_dir, job_id, TRACE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_agent(args, work_dir, db):
+    config = {
+        'uid': 'bench-user',
+        'project_id': BENCH_PROJECT,
+        'agentId': 'bench-agent',
+        'profilesDir': os.path.join(work_dir, 'profiles'),
+        'pacing': args.pacing,
+        'concurrency': {'browser': args.browser_slots, 'cpu': args.cpu_slots},
+        'tracing': {'dir': os.path.join(work_dir, 'traces'), 'keep': 100000},
+        'downloads': {'dir': os.path.join(work_dir, 'downloads')},
+        'stitchCache': {'enabled': not args.no_stitch_cache, 'dir': os.path.join(work_dir, 'stitch-cache')},
+        'browserPool': {'headless': args.headless},
+        'network': {'cacheDir': os.path.join(work_dir, 'http-cache')},
+        'journal': {'path': os.path.join(work_dir, 'journal.db')},
+        'locators': {'path': os.path.join(work_dir, 'locators.json')},
+        'memory': {'timelinePath': os.path.join(work_dir, 'memory.json')},
+        'quotas': {'path': os.path.join(work_dir, 'quotas.json')},
+    }
+    agent = ContentAutoPostAgent(config['uid'], config['project_id'], config, db=db)
+    agent.executor.start()
+    return agent
+
+
+def run_jobs(agent, db, jobs, timeout):
+    """Submits (job_id, job_data) pairs as claimed jobs and waits until all have a final status."""
+    for job_id, job_data in jobs:
+        db.collection('agent_jobs').document(job_id).set({
+            **job_data,
+            'projectId': BENCH_PROJECT,
+            'status': 'CLAIMED',
+            'leaseOwner': agent.agent_id,
+            'createdAt': datetime.now(timezone.utc),
+        })
+    started = time.monotonic()
+    for job_id, job_data in jobs:
+        agent.executor.submit(job_id, {**job_data, 'projectId': BENCH_PROJECT})
+
+    pending = {job_id for job_id, _ in jobs}
+    while pending and time.monotonic() - started < timeout:
+        for job_id in list(pending):
+            if (db.docs.get(f"agent_jobs/{job_id}") or {}).get('status') in FINAL_STATUSES:
+                pending.discard(job_id)
+        time.sleep(0.05)
+    return time.monotonic() - started, pending
+
+
+def summarize(agent, db, jobs, wall, timed_out, memory):
+    traces_dir = agent.config['tracing']['dir']
+    statuses, job_seconds, first_step, per_action = {}, [], [], {}
+    page_load_ms, bytes_saved = [], 0
+    for job_id, _ in jobs:
+        doc = db.docs.get(f"agent_jobs/{job_id}") or {}
+        statuses[doc.get('status', 'TIMEOUT')] = statuses.get(doc.get('status', 'TIMEOUT'), 0) + 1
+        network = doc.get('network') or {}
+        bytes_saved += network.get('bytesSaved', 0)
+        if network.get('pageLoadMs'):
+            page_load_ms.append(network['pageLoadMs']['avg'] / 1000)
+        trace = read_trace(traces_dir, job_id)
+        if not trace:
+            continue
+        job_seconds.append(trace['totalSeconds'])
+        steps = sorted(_steps(trace['spans']), key=lambda s: s['start'])
+        if steps:
+            first_step.append(steps[0]['start'] + steps[0]['seconds'])
+        for step in steps:
+            per_action.setdefault(step.get('attrs', {}).get('action'), []).append(step['seconds'])
+
+    return {
+        'jobs': len(jobs),
+        'statuses': statuses,
+        'timedOut': len(timed_out),
+        'wallSeconds': round(wall, 3),
+        'jobsPerMinute': round(len(jobs) / wall * 60, 2) if wall else None,
+        'jobSeconds': distribution(job_seconds),
+        'firstStepSeconds': distribution(first_step),
+        'stepSeconds': {str(action): distribution(values) for action, values in sorted(per_action.items(), key=str)},
+        'pageLoadSeconds': distribution(page_load_ms),
+        'bytesSavedMB': round(bytes_saved / 1024 ** 2, 2),
+        'peakRssMB': round(memory.peak_mb, 1),
+        'memorySource': memory.source,
+    }
+
+
+def recipe_jobs(args, server, db):
+    page = server.url(gen=args.gen_ms, jitter=args.jitter_ms)
+    db.collection('automation_recipes').document(BENCH_RECIPE).set({
+        'name': 'Bench: generate one scene',
+        'updatedAt': 1,
+        'steps': [
+            {'order': 1, 'type': 'GOTO', 'value': page},
+            {'order': 2, 'type': 'CLICK_SELECTOR', 'value': '#prompt'},
+            {'order': 3, 'type': 'TYPE', 'value': '{{prompt}}'},
+            {'order': 4, 'type': 'CLICK_SELECTOR', 'value': '#generate'},
+            {'order': 5, 'type': 'WAIT_UNTIL', 'value': '.scene-card.done .download-btn'},
+            {'order': 6, 'type': 'CLICK_SELECTOR', 'value': '.scene-card.done .download-btn'},
+        ],
+    })
+    return [(f"bench-recipe-{i:03d}", {'recipeId': BENCH_RECIPE, 'trace': True,
+                                       'variables': {'prompt': f"A lighthouse at dusk, take {i}"}})
+            for i in range(args.jobs)]
+
+
+def playback_jobs(args, server, db):
+    page = server.url(gen=args.gen_ms, jitter=args.jitter_ms)
+    steps = [
+        {'action': 'navigate', 'value': page},
+        {'action': 'type', 'selector': '#prompt', 'value': 'A fox running through snow'},
+        {'action': 'click', 'selector': '#generate'},
+        {'action': 'click', 'selector': '.scene-card.done .download-btn', 'timeout': args.gen_ms + args.jitter_ms + 10000},
+    ]
+    return [(f"bench-play-{i:03d}", {'recipeId': 'CMD_PLAY', 'trace': True, 'steps': steps})
+            for i in range(args.jobs)]
+
+
+def make_scenes(work_dir, count, seconds, ffmpeg='ffmpeg'):
+    """Synthetic scene files; the last one has another size so the stitch has to normalize it."""
+    scenes_dir = os.path.join(work_dir, 'scenes')
+    os.makedirs(scenes_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        size = '1280x720' if i < count - 1 else '960x540'
+        path = os.path.join(scenes_dir, f"scene_{i + 1:03d}.mp4")
+        subprocess.run([ffmpeg, '-y', '-v', 'error',
+                        '-f', 'lavfi', '-i', f"testsrc=size={size}:rate=30:duration={seconds}",
+                        '-f', 'lavfi', '-i', f"sine=frequency={440 + 110 * i}:duration={seconds}",
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', path],
+                       check=True, capture_output=True)
+        paths.append(path)
+    return paths
+
+
+def stitch_jobs(args, work_dir):
+    scenes = make_scenes(work_dir, args.scenes, args.scene_seconds)
+    outputs = os.path.join(work_dir, 'outputs')
+    os.makedirs(outputs, exist_ok=True)
+    return [(f"bench-stitch-{i:03d}", {'recipeId': 'CMD_STITCH_VIDEO', 'trace': True, 'sceneFiles': scenes,
+                                       'outputPath': os.path.join(outputs, f"final_{i:03d}.mp4")})
+            for i in range(args.jobs)]
+
+
+def get_path(result, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part)
+    return result
+
+
+def compare(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Prints per-metric changes against an earlier result file. Returns the number of regressions."""
+    regressions = 0
+    print(f"\n📊 Compared with {previous.get('commit') or previous.get('startedAt') or 'earlier run'}")
+    for scenario, result in current['scenarios'].items():
+        old = previous.get('scenarios', {}).get(scenario)
+        if not old or 'skipped' in result or 'skipped' in old:
+            continue
+        for path, higher_is_better in COMPARED:
+            before, after = get_path(old, path), get_path(result, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change < -threshold if higher_is_better else change > threshold
+            regressions += worse
+            print(f"  {'❌' if worse else '  '} {scenario:<9} {path:<22} {before:>10} → {after:<10} ({change:+.1%})")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated: recipe,playback,stitch")
+    parser.add_argument('--jobs', type=int, default=6, help="Jobs per scenario")
+    parser.add_argument('--gen-ms', type=int, default=3000, help="Simulated generation time per scene (fixture)")
+    parser.add_argument('--jitter-ms', type=int, default=0, help="Random extra generation time per scene")
+    parser.add_argument('--pacing', default='fast', help="Pacing profile (fast, human, legacy)")
+    parser.add_argument('--browser-slots', type=int, default=3)
+    parser.add_argument('--headless', action='store_true', help="Production launch mode (routing and resource blocking on)")
+    parser.add_argument('--cpu-slots', type=int, default=2)
+    parser.add_argument('--scenes', type=int, default=4, help="Scene files per stitch job")
+    parser.add_argument('--scene-seconds', type=float, default=2)
+    parser.add_argument('--no-stitch-cache', action='store_true', help="Every stitch job does the full pipeline")
+    parser.add_argument('--firestore-latency', type=float, default=0.0, help="Seconds added to every fake Firestore call")
+    parser.add_argument('--timeout', type=float, default=600, help="Max seconds per scenario")
+    parser.add_argument('--output', help="Result file (default bench/results/<time>-<commit>.json)")
+    parser.add_argument('--compare', help="Earlier result file to compare against")
+    parser.add_argument('--keep-work-dir', action='store_true')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix='agent-bench-')
+    db = FakeFirestore(latency=args.firestore_latency)
+    results = {
+        'startedAt': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'scenarios': {},
+    }
+    agent = build_agent(args, work_dir, db)
+    try:
+        with FixtureServer() as server:
+            for scenario in scenarios:
+                print(f"\n🏁 Scenario: {scenario} ({args.jobs} jobs)")
+                if scenario == 'stitch' and not shutil.which('ffmpeg'):
+                    results['scenarios'][scenario] = {'skipped': 'ffmpeg not found'}
+                    print("⚠️ Skipped: ffmpeg not found")
+                    continue
+                if scenario == 'recipe':
+                    jobs = recipe_jobs(args, server, db)
+                elif scenario == 'playback':
+                    jobs = playback_jobs(args, server, db)
+                else:
+                    jobs = stitch_jobs(args, work_dir)
+                with MemorySampler() as memory:
+                    wall, timed_out = run_jobs(agent, db, jobs, args.timeout)
+                results['scenarios'][scenario] = summarize(agent, db, jobs, wall, timed_out, memory)
+                print(json.dumps(results['scenarios'][scenario], indent=1))
+    finally:
+        agent.shutdown()
+        if not args.keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{results['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            if compare(json.load(f), results):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
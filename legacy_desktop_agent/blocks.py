@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import re
+import time
+from metrics import STEP_FAILURES, STEP_SECONDS
+from network import download_step
+from observer import PageObserver
+from tracing import span
+from recipe_cache import parse_template, render_template, Slot
+
+# --- CONFIGURATION ---
+BLOCKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blocks")
+DEFAULT_PARALLEL_TABS = 4      # Tabs a block job may fan its scenes out over
+PROGRESS_POLL_INTERVAL = 1.0   # Seconds between progress reads when the page observer can't be used
+DEFAULT_PROGRESS_TIMEOUT = 600000  # ms
+PERCENT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+
+
+class BlockError(Exception):
+    """A block step failed; the message names the tab and step."""
+
+
+def load_block_file(name, blocks_dir=BLOCKS_DIR):
+    """Loads blocks/<name>.json. Only bare names are accepted (no paths)."""
+    name = os.path.basename(name)
+    if not name.endswith('.json'):
+        name += '.json'
+    with open(os.path.join(blocks_dir, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def normalize_scenes(scenes):
+    """Scenes may be prompt strings or dicts; each gets its episode-wide index and 1-based number."""
+    normalized = []
+    for index, scene in enumerate(scenes or []):
+        scene = dict(scene) if isinstance(scene, dict) else {'prompt': str(scene)}
+        scene['index'] = index
+        scene['number'] = index + 1
+        normalized.append(scene)
+    return normalized
+
+
+def shard_scenes(scenes, width):
+    """Splits scenes into at most `width` contiguous shards of near-equal size."""
+    width = max(1, min(width, len(scenes)))
+    size, extra = divmod(len(scenes), width)
+    shards, start = [], 0
+    for i in range(width):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(scenes[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+
+def scene_variables(variables, scene):
+    """Job variables plus scene fields flattened as 'scene.<field>' for {{scene.*}} templates."""
+    scoped = dict(variables)
+    for key, value in scene.items():
+        scoped[f'scene.{key}'] = value
+    return scoped
+
+
+class BlockRunner:
+    """Interprets a block file (steps, loop_* actions with nested loopSteps) on one tab.
+
+    Each tab runs the whole block for its own shard of scenes, so the
+    caller can run several runners side by side in one browser context.
+    """
+
+    def __init__(self, block, pacer, log=print, tab=0, downloads=None, on_progress=None, before_scene=None):
+        self.block = block
+        self.pacer = pacer
+        self.log = log
+        self.tab = tab
+        self.downloads = downloads  # DownloadCollector shared by the job's tabs
+        self.on_progress = on_progress  # (tab, percent values): streams progress to the job document
+        self.before_scene = before_scene  # async (): waits for the site's rate limits before each scene
+        self._metered = set()  # Scenes charged to before_scene (a block loops over them more than once)
+        self._observer = None
+        self._templates = {}
+        self._scene_started = {}
+        self._scene_done = {}
+
+    def _render(self, value, variables):
+        """Renders a step value; a lone {{name}} returns the raw variable (e.g. the scenes list)."""
+        template = self._templates.get(value)
+        if template is None:
+            template = self._templates[value] = parse_template(value)
+        if len(template) == 1 and isinstance(template[0], Slot) and template[0].name in variables:
+            return variables[template[0].name]
+        return render_template(template, variables)
+
+    async def run(self, page, scenes, variables):
+        """Runs the block for `scenes`. Returns {scene index: seconds} of finished scenes."""
+        self.pacer.attach(page)
+        self._observer = PageObserver(page)
+        variables = {**variables, 'scenes': scenes}
+
+        start_url = self.block.get('startUrl')
+        if start_url:
+            await page.goto(start_url)
+            await self.pacer.after_step(page, 'navigate')
+
+        await self._run_steps(page, self.block.get('steps', []), variables, scenes)
+        return self._scene_done
+
+    async def _run_steps(self, page, steps, variables, scenes):
+        for step in steps:
+            action = step.get('action', '')
+            if action.startswith('loop_'):
+                await self._run_loop(page, step, variables, scenes)
+            else:
+                await self._run_step(page, step, variables)
+
+    async def _run_loop(self, page, step, variables, scenes):
+        """loop_*: runs loopSteps once per item; items are the value's list, else this tab's scenes."""
+        items = self._render(step.get('value', ''), variables) if step.get('value') else None
+        if not isinstance(items, list):
+            items = scenes
+
+        for local_index, scene in enumerate(items):
+            scene = dict(scene) if isinstance(scene, dict) else {'prompt': str(scene)}
+            if step.get('selector') and 'videoElement' not in scene:
+                # Per-item element of the loop's selector, in this tab's order
+                scene['videoElement'] = f"{step['selector']} >> nth={local_index}"
+            scoped = scene_variables(variables, scene)
+            index = scene.get('index', local_index)
+            if self.before_scene and 'index' in scene and index not in self._metered:
+                # Charged on the scene's first loop (generation), not again for e.g. its download loop
+                try:
+                    await self.before_scene()
+                except Exception as e:
+                    raise BlockError(f"[tab {self.tab}] Scene {index + 1}: {e}") from e
+                self._metered.add(index)
+            self._scene_started.setdefault(index, time.monotonic())
+
+            await self._run_steps(page, step.get('loopSteps', []), scoped, scenes)
+            self._scene_done[index] = round(time.monotonic() - self._scene_started[index], 2)
+
+        await self.pacer.after_step(page, step.get('action'), legacy_delay=step.get('delay', 0) / 1000)
+
+    async def _run_step(self, page, step, variables):
+        started = time.monotonic()
+        try:
+            with span('step', action=step.get('action'), tab=self.tab, label=step.get('comment'),
+                      selector=self._render(step.get('selector', ''), variables)):
+                await self._perform_step(page, step, variables)
+        except BlockError:
+            STEP_FAILURES.inc(action=step.get('action'))
+            raise
+        finally:
+            STEP_SECONDS.observe(time.monotonic() - started, action=step.get('action'))
+
+    async def _perform_step(self, page, step, variables):
+        action = step.get('action')
+        selector = self._render(step.get('selector', ''), variables)
+        value = self._render(step.get('value', ''), variables)
+        candidates = [self._render(candidate, variables) for candidate in step.get('candidates', [])]
+        timeout = step.get('timeout')
+        legacy_delay = step.get('delay', 1000) / 1000
+        label = step.get('comment') or f"{action} {selector}"
+        print(f"🧱 [tab {self.tab}] {label}")
+
+        try:
+            if action == 'click':
+                is_download = step.get('download', 'download' in selector.lower())
+                selector = await self.pacer.wait_actionable(page, selector, timeout, candidates)
+                if self.downloads and 'scene.index' in variables and is_download:
+                    # Bind the file to this scene and keep going; saving finishes in the background
+                    scene = {'index': variables['scene.index'], 'number': variables.get('scene.number')}
+                    with download_step():
+                        await self.downloads.capture(page, scene, lambda: page.click(selector))
+                else:
+                    await page.click(selector)
+
+            elif action == 'type':
+                selector = await self.pacer.wait_actionable(page, selector, timeout, candidates)
+                await page.fill(selector, str(value))
+
+            elif action == 'press':
+                await page.keyboard.press(str(value))
+
+            elif action in ('navigate', 'goto'):
+                await page.goto(str(value or selector))
+                action = 'navigate'
+
+            elif action == 'wait':
+                if selector:
+                    await self.pacer.wait_actionable(page, selector, timeout, candidates)
+                else:
+                    # Explicit pause with nothing to observe: honour it in every profile
+                    await asyncio.sleep(legacy_delay)
+                    return
+
+            elif action == 'wait_for_progress':
+                await self._wait_for_progress(page, selector, float(value or 100), timeout or DEFAULT_PROGRESS_TIMEOUT)
+                legacy_delay = 0  # The old fixed delay *was* the progress wait
+
+            else:
+                raise BlockError(f"Unknown block action '{action}'")
+
+            await self.pacer.after_step(page, action, legacy_delay=legacy_delay)
+
+        except BlockError:
+            raise
+        except Exception as e:
+            raise BlockError(f"[tab {self.tab}] {label}: {e}") from e
+
+    def _report_progress(self, values):
+        self.log(f"[tab {self.tab}] Progress {min(values):.0f}% ({len(values)} item(s))")
+        if self.on_progress:
+            self.on_progress(self.tab, values)
+
+    async def _wait_for_progress(self, page, selector, target, timeout_ms):
+        """Waits until the progress elements all read >= target%, or they disappear after showing up.
+
+        The page observer pushes changes as they happen; polling is only the
+        fallback for selectors it can't watch (Playwright-only syntax) or a
+        page it couldn't be injected into.
+        """
+        try:
+            if await self._observer.wait_for_progress(selector, target, timeout_ms, self._report_progress):
+                return
+        except TimeoutError:
+            raise
+        except Exception as e:
+            print(f"⚠️ [tab {self.tab}] Page observer unavailable, polling progress instead: {e}")
+        await self._poll_progress(page, selector, target, timeout_ms)
+
+    async def _poll_progress(self, page, selector, target, timeout_ms):
+        deadline = time.monotonic() + timeout_ms / 1000
+        seen = False
+        last_report = None
+        while time.monotonic() < deadline:
+            texts = await page.locator(selector).all_inner_texts()
+            values = [float(m.group(1)) for m in map(PERCENT_RE.search, texts) if m]
+            if values:
+                seen = True
+                lowest = min(values)
+                if lowest != last_report:
+                    last_report = lowest
+                    self._report_progress(values)
+                if lowest >= target:
+                    return
+            elif seen and not texts:
+                return  # Progress indicators are removed once generation finishes
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+        raise TimeoutError(f"Progress did not reach {target:.0f}% within {timeout_ms / 1000:.0f}s")
@@ -0,0 +1,350 @@
+import asyncio
+import contextlib
+import os
+import time
+from memory import MemoryPressureError
+from metrics import BROWSER_LAUNCH_SECONDS
+from network import attach_page
+from tracing import attach_context, span
+
+# --- CONFIGURATION ---
+DEFAULT_MAX_CONTEXTS = 3       # Open persistent contexts (one Chromium per profile)
+DEFAULT_IDLE_TIMEOUT = 600     # Seconds an unused context stays warm
+REAPER_INTERVAL = 30           # Seconds between idle eviction passes
+HEALTH_CHECK_TIMEOUT = 5       # Seconds before a context is declared dead
+DEFAULT_LAUNCH_ARGS = ["--start-maximized", "--disable-blink-features=AutomationControlled"]
+HEADLESS_LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled", "--mute-audio"]
+HEADLESS_VIEWPORT = {'width': 1920, 'height': 1080}  # No window to maximize: lay pages out like a desktop
+
+
+class BrowserPool:
+    """Warm persistent Chromium contexts keyed by profile directory.
+
+    Must only be used from the browser lane event loop. Jobs lease a fresh tab
+    in the warm context of their profile; the tab is closed on release and
+    the context stays open until it has been idle for `idle_timeout` seconds.
+    With a memory `watchdog`, contexts are recycled (closed once their last
+    lease returns) after too many jobs or when they grow too large, and new
+    leases wait while the machine is under memory pressure.
+    """
+
+    def __init__(self, max_contexts=DEFAULT_MAX_CONTEXTS, idle_timeout=DEFAULT_IDLE_TIMEOUT, headless=False):
+        self.max_contexts = max_contexts
+        self.idle_timeout = idle_timeout
+        self.headless = headless  # Production mode: no windows (manual sessions still open headed)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'unhealthy': 0, 'recycled': 0, 'leasesDelayed': 0}
+
+        self._playwright = None
+        self._entries = {}  # profile_path -> {'context', 'leases', 'last_used', 'closed', 'headless', 'jobs', 'recycle', 'launching', 'ready'}
+        self._closing = {}  # profile_path -> Event set once its popped context has closed
+        self._cond = None
+        self._reaper = None
+        self._watcher = None
+        self._start_lock = None
+        self.prepare_profile = None  # Optional sync hook(profile_path) run off-loop before each launch
+        self.watchdog = None  # Optional MemoryWatchdog: sampled from the pool's loop, gates leases
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a pool from the 'browserPool' section of agent_config.json."""
+        pool_config = config.get('browserPool', {})
+        return cls(
+            max_contexts=pool_config.get('maxContexts', DEFAULT_MAX_CONTEXTS),
+            idle_timeout=pool_config.get('idleTimeout', DEFAULT_IDLE_TIMEOUT),
+            headless=pool_config.get('headless', False),
+        )
+
+    async def start(self):
+        """Starts the Playwright driver (idempotent; concurrent callers share one start)."""
+        if self._playwright is not None:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._playwright is None:
+                # Imported here: Playwright is heavy and not needed until the first browser job
+                from playwright.async_api import async_playwright
+                self._cond = asyncio.Condition()
+                self._playwright = await async_playwright().start()
+                self._reaper = asyncio.create_task(self._reap_idle())
+                if self.watchdog:
+                    self._watcher = asyncio.create_task(self._watch_memory())
+                print("🏊 Browser pool started.")
+
+    async def prewarm(self, profile_path):
+        """Opens the context for `profile_path` ahead of the first job; it then idles warm in the pool."""
+        entry = await self._acquire(profile_path)
+        await self._release(entry)
+
+    async def launch(self, profile_path, args=None, headless=None):
+        """Launches a persistent context on the shared driver (not pooled; caller closes it)."""
+        headless = self.headless if headless is None else headless
+        await self.start()
+        if self.prepare_profile:
+            await asyncio.to_thread(self.prepare_profile, profile_path)  # Clone from template / prune caches
+        os.makedirs(profile_path, exist_ok=True)
+        with BROWSER_LAUNCH_SECONDS.time(), span('launch', profile=os.path.basename(profile_path)):
+            return await self._playwright.chromium.launch_persistent_context(
+                user_data_dir=profile_path,
+                headless=headless,
+                args=args or (HEADLESS_LAUNCH_ARGS if headless else DEFAULT_LAUNCH_ARGS),
+                viewport=HEADLESS_VIEWPORT if headless else None
+            )
+
+    @contextlib.asynccontextmanager
+    async def lease(self, profile_path, headed=False):
+        """Borrows a clean page in the warm context for `profile_path` (`headed`: needs a visible window)."""
+        with span('lease', profile=os.path.basename(profile_path)):
+            entry = await self._acquire(profile_path, headed)
+        page = None
+        try:
+            await attach_context(entry['context'])  # Playwright trace, if the job asked for one
+            page = await entry['context'].new_page()
+            await attach_page(page)  # Resource blocking and shared cache, if the job routes its requests
+            yield page
+        finally:
+            if page is not None and not page.is_closed():
+                with contextlib.suppress(Exception):
+                    await page.close()
+            await self._release(entry)
+
+    async def job_finished(self, profile_path):
+        """Counts a finished job on the profile's context; recycles it after `recycleAfterJobs`."""
+        if not self.watchdog or not self.watchdog.recycle_after_jobs or self._cond is None:
+            return
+        closing = None
+        async with self._cond:
+            entry = self._entries.get(profile_path)
+            if entry and not entry['launching']:
+                entry['jobs'] += 1
+                if entry['jobs'] >= self.watchdog.recycle_after_jobs:
+                    closing = self._recycle(profile_path, f"served {entry['jobs']} jobs")
+        await self._close_context(closing)
+
+    async def _release(self, entry):
+        closing = None
+        async with self._cond:
+            entry['leases'] -= 1
+            entry['last_used'] = time.monotonic()
+            if entry['leases'] == 0 and entry['recycle'] and self._entries.get(entry['profile']) is entry:
+                closing = self._recycle(entry['profile'], entry['recycle'])
+            self._cond.notify_all()
+        await self._close_context(closing)
+
+    def _recycle(self, profile_path, reason):
+        """Marks the context to close when its last lease returns. Returns it (removed) if it is idle now.
+
+        Call with `_cond` held; close the returned entry after releasing it.
+        """
+        entry = self._entries[profile_path]
+        entry['recycle'] = reason
+        if entry['leases'] == 0:
+            print(f"♻️ Recycling context {os.path.basename(profile_path)} ({reason})")
+            self.stats['recycled'] += 1
+            return self._pop_entry(profile_path)
+        return None
+
+    async def _acquire(self, profile_path, headed=False):
+        """Leases the profile's context, launching it if needed.
+
+        `_cond` is only held to read and update the entries: Chromium
+        launches, health checks and closes run without it, so leases on
+        other (warm) profiles and returning leases never wait for them. A
+        launching profile has a placeholder entry; other callers for it wait
+        on its `ready` event instead of launching it a second time. A context
+        flagged for recycling takes no new leases: callers wait until its
+        last lease returns and it closes, then relaunch it.
+        """
+        await self.start()
+        await self._wait_for_memory(profile_path)
+        while True:
+            closing = []
+            async with self._cond:
+                entry = self._entries.get(profile_path)
+                if entry and not entry['launching'] and headed and entry['headless']:
+                    # Manual session on a headless profile: relaunch it headed once its jobs are done
+                    if entry['leases']:
+                        await self._cond.wait()
+                        continue
+                    closing.append(self._pop_entry(profile_path))
+                    entry = None
+                if entry and not entry['launching'] and entry['recycle']:
+                    await self._cond.wait()  # Closes when its last lease returns; then it is relaunched below
+                    continue
+                if entry is None:
+                    if len(self._entries) >= self.max_contexts:
+                        victim = self._pop_lru_idle()
+                        if victim is None:
+                            # Every context is busy: wait for a lease to come back
+                            await self._cond.wait()
+                            continue
+                        closing.append(victim)
+                    entry = self._entries[profile_path] = self._placeholder(profile_path, self.headless and not headed)
+                    launching = True
+                else:
+                    launching = False
+                    if not entry['launching']:
+                        entry['leases'] += 1  # Held during the health check, so the context can't be evicted meanwhile
+
+            for stale in closing:
+                await self._close_context(stale)  # Before relaunching: a profile directory can only be open once
+            if launching:
+                if profile_path in self._closing:
+                    await self._closing[profile_path].wait()  # A profile directory can only be open once
+                return await self._launch_entry(entry)
+            if entry['launching']:
+                await entry['ready'].wait()  # Launched by another caller (or failed): look again
+                continue
+            if await self._is_healthy(entry):
+                self.stats['hits'] += 1
+                return entry
+
+            print(f"🩺 Pooled context for {os.path.basename(profile_path)} is dead. Relaunching...")
+            dead = None
+            async with self._cond:
+                entry['leases'] -= 1
+                if self._entries.get(profile_path) is entry:
+                    self.stats['unhealthy'] += 1
+                    dead = self._pop_entry(profile_path)
+                self._cond.notify_all()
+            await self._close_context(dead)
+
+    async def _wait_for_memory(self, profile_path):
+        """Holds a new lease while the watchdog reports memory pressure, for at most `maxLeaseWait` seconds."""
+        if not self.watchdog or not self.watchdog.pressure:
+            return
+        self.stats['leasesDelayed'] += 1
+        print(f"🧠 Lease for {os.path.basename(profile_path)} waits for memory to recover...")
+        deadline = time.monotonic() + self.watchdog.max_lease_wait
+        async with self._cond:
+            while self.watchdog.pressure:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.watchdog.stats['leasesRefused'] += 1
+                    latest = self.watchdog.latest()
+                    raise MemoryPressureError(
+                        f"No browser lease after waiting {self.watchdog.max_lease_wait}s for memory to recover "
+                        f"(agent tree {latest.get('totalMB', '?')} MB, {latest.get('availableMB', '?')} MB free)")
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._cond.wait(), remaining)  # Woken after every memory sample
+
+    def _placeholder(self, profile_path, headless):
+        return {'context': None, 'leases': 1, 'last_used': time.monotonic(), 'closed': False,
+                'headless': headless, 'profile': profile_path, 'jobs': 0, 'recycle': None,
+                'launching': True, 'ready': asyncio.Event()}
+
+    async def _launch_entry(self, entry):
+        """Launches the context of a placeholder entry and publishes it (or drops the entry on failure)."""
+        profile_path = entry['profile']
+        self.stats['misses'] += 1
+        print(f"🖥️  Launching Chrome Profile: {os.path.basename(profile_path)} (pool miss)")
+        try:
+            context = await self.launch(profile_path, headless=entry['headless'])
+        except BaseException:
+            async with self._cond:
+                if self._entries.get(profile_path) is entry:
+                    del self._entries[profile_path]
+                self._cond.notify_all()
+            entry['ready'].set()
+            raise
+        context.on('close', lambda _: entry.update(closed=True))
+        async with self._cond:
+            entry.update(context=context, launching=False)
+            self._cond.notify_all()
+        entry['ready'].set()
+        return entry
+
+    async def _is_healthy(self, entry):
+        if entry['closed']:
+            return False
+        try:
+            await asyncio.wait_for(entry['context'].cookies('about:blank'), HEALTH_CHECK_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    def _pop_lru_idle(self):
+        idle = [(e['last_used'], path) for path, e in self._entries.items() if e['leases'] == 0]
+        if not idle:
+            return None
+        _, path = min(idle)
+        self.stats['evictions'] += 1
+        return self._pop_entry(path)
+
+    def _pop_entry(self, profile_path):
+        """Removes a context to close it; relaunches of the profile wait until it has closed.
+
+        Call with `_cond` held, then pass the entry to `_close_context`.
+        """
+        entry = self._entries.pop(profile_path)
+        entry['closing'] = self._closing[profile_path] = asyncio.Event()
+        return entry
+
+    async def _close_context(self, entry):
+        """Closes a context removed by `_pop_entry` (call without `_cond` held)."""
+        if not entry:
+            return
+        try:
+            if entry['context'] is not None and not entry['closed']:
+                with contextlib.suppress(Exception):
+                    await entry['context'].close()
+        finally:
+            entry['closing'].set()
+            if self._closing.get(entry['profile']) is entry['closing']:
+                del self._closing[entry['profile']]
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            now = time.monotonic()
+            closing = []
+            async with self._cond:
+                for path, entry in list(self._entries.items()):
+                    if entry['leases'] == 0 and now - entry['last_used'] > self.idle_timeout:
+                        print(f"💤 Closing idle context: {os.path.basename(path)}")
+                        closing.append(self._pop_entry(path))
+                        self.stats['evictions'] += 1
+                self._cond.notify_all()
+            for entry in closing:
+                await self._close_context(entry)
+
+    async def _watch_memory(self):
+        while True:
+            await asyncio.sleep(self.watchdog.interval)
+            try:
+                sample = await asyncio.to_thread(self.watchdog.sample, list(self._entries))
+                closing = []
+                async with self._cond:
+                    for path in self.watchdog.oversized(sample):
+                        if path in self._entries:
+                            closing.append(self._recycle(path, f"{sample['contexts'][path]} MB"))
+                    if self.watchdog.pressure:
+                        # Idle contexts close now, busy ones as soon as their job is done
+                        for path in list(self._entries):
+                            closing.append(self._recycle(path, "memory pressure"))
+                    self._cond.notify_all()
+                for entry in closing:
+                    await self._close_context(entry)
+            except Exception as e:
+                print(f"⚠️ Memory watchdog sample failed: {e}")
+
+    def snapshot(self):
+        """Pool counters for the heartbeat document."""
+        return {
+            **self.stats,
+            'open': len(self._entries),
+            'leased': sum(e['leases'] for e in self._entries.values()),
+            'headless': self.headless,
+        }
+
+    async def close(self):
+        """Closes every context and the shared driver."""
+        if self._reaper:
+            self._reaper.cancel()
+        if self._watcher:
+            self._watcher.cancel()
+        for path in list(self._entries):
+            await self._close_context(self._pop_entry(path))
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import os
+from tracing import span
+
+# --- CONFIGURATION ---
+DEFAULT_DOWNLOAD_TIMEOUT = 120000  # ms between the click and the download starting
+DEFAULT_MIN_BYTES = 1024           # Anything smaller is an error page, not a video
+HASH_CHUNK = 1024 * 1024
+
+
+class DownloadError(Exception):
+    """A scene download failed, is missing or did not pass its checks."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadCollector:
+    """Captures Playwright downloads of one job into its own directory, tagged by scene.
+
+    `capture()` binds the download to the scene whose click triggered it
+    (via `expect_download`), so overlapping downloads can never swap scenes.
+    Saving and checking run in the background; `finish()` waits for the last
+    one and returns the files in scene order.
+    """
+
+    def __init__(self, job_dir, min_bytes=DEFAULT_MIN_BYTES, timeout=DEFAULT_DOWNLOAD_TIMEOUT, on_saved=None):
+        self.job_dir = job_dir
+        self.min_bytes = min_bytes
+        self.timeout = timeout
+        self.on_saved = on_saved  # async (scene index, file info): e.g. the job journal's checkpoint
+        self.files = {}    # scene index -> {'path', 'size', 'sha256', 'suggested'}
+        self.errors = {}   # scene index -> error message
+        self.captured = 0
+        self._tasks = []
+
+    async def capture(self, page, scene, trigger):
+        """Runs `trigger()` (the Download click) and starts saving the download it causes."""
+        os.makedirs(self.job_dir, exist_ok=True)
+        async with page.expect_download(timeout=self.timeout) as download_info:
+            await trigger()
+        download = await download_info.value
+        self.captured += 1
+        self._tasks.append(asyncio.create_task(self._save(download, scene)))
+
+    async def _save(self, download, scene):
+        index = scene['index']
+        suggested = download.suggested_filename or 'scene.mp4'
+        extension = os.path.splitext(suggested)[1] or '.mp4'
+        path = os.path.join(self.job_dir, f"scene_{scene.get('number') or index + 1:03d}{extension}")
+        try:
+            with span('download', scene=index, file=os.path.basename(path)):
+                # save_as waits for the transfer to finish, then copies it out of Playwright's temp dir
+                await download.save_as(path)
+                failure = await download.failure()
+                if failure:
+                    raise DownloadError(failure)
+                size = os.path.getsize(path)
+                if size < self.min_bytes:
+                    raise DownloadError(f"only {size} bytes")
+                sha256 = await asyncio.to_thread(file_sha256, path)
+            self.files[index] = {'path': path, 'size': size, 'sha256': sha256, 'suggested': suggested}
+            print(f"📥 Scene {index + 1}: {suggested} ({size / 1e6:.1f} MB)")
+            if self.on_saved:
+                try:
+                    await self.on_saved(index, self.files[index])
+                except Exception as e:
+                    print(f"⚠️ Scene {index + 1} checkpoint failed (a restart would download it again): {e}")
+        except Exception as e:
+            self.errors[index] = f"Scene {index + 1} download failed: {e}"
+
+    def restore(self, files):
+        """Takes over files saved before a restart ({scene index: file info}). Returns the indices still on disk."""
+        restored = set()
+        for index, info in files.items():
+            try:
+                if os.path.getsize(info['path']) == info['size']:
+                    self.files[index] = info
+                    restored.add(index)
+            except (OSError, KeyError):
+                pass
+        return restored
+
+    async def finish(self, scenes):
+        """Waits for every pending save and returns the ordered file paths of `scenes`.
+
+        Raises DownloadError if a scene has no valid file, or if two scenes
+        received the same file (a double click or a mis-bound download).
+        """
+        await asyncio.gather(*self._tasks)
+        problems = [self.errors[i] for i in sorted(self.errors)]
+        for scene in scenes:
+            if scene['index'] not in self.files and scene['index'] not in self.errors:
+                problems.append(f"Scene {scene['index'] + 1} was never downloaded")
+
+        seen = {}
+        for index in sorted(self.files):
+            digest = self.files[index]['sha256']
+            if digest in seen:
+                problems.append(f"Scenes {seen[digest] + 1} and {index + 1} have identical files")
+            seen.setdefault(digest, index)
+
+        if problems:
+            raise DownloadError('; '.join(problems))
+        return [self.files[scene['index']]['path'] for scene in sorted(scenes, key=lambda s: s['index'])]
+
+    def report(self):
+        """Per-scene file details for the job document."""
+        return [{'index': index, **{k: v for k, v in info.items() if k != 'path'}, 'file': os.path.basename(info['path'])}
+                for index, info in sorted(self.files.items())]
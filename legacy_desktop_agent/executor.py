@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from job_queue import JobQueue
+from metrics import JOB_QUEUE_SECONDS, JOB_SECONDS, JOBS_FINISHED, METRICS
+
+# --- CONFIGURATION ---
+# How many jobs may run at once in each lane.
+DEFAULT_LANE_LIMITS = {
+    'browser': 3,
+    'cpu': 2,
+}
+# Optional per job type caps (job type = 'CMD_*' command or 'RECIPE').
+DEFAULT_TYPE_LIMITS = {
+    'CMD_OPEN_BROWSER': 1,
+    'CMD_RECORD': 1,
+    'CMD_RUN_BLOCK': 1,    # Each block job already fans out over several tabs
+}
+# Commands that never touch the browser
+CPU_COMMANDS = {'CMD_STITCH_VIDEO', 'CMD_SLEEP'}
+
+
+def job_type(job_data):
+    """Returns the concurrency key of a job: the command name or 'RECIPE'."""
+    recipe_id = job_data.get('recipeId') or ''
+    return recipe_id if recipe_id.startswith('CMD_') else 'RECIPE'
+
+
+def job_lane(job_data):
+    """Returns 'cpu' for jobs that need no browser, 'browser' otherwise."""
+    return 'cpu' if job_type(job_data) in CPU_COMMANDS else 'browser'
+
+
+class JobExecutor:
+    """Runs agent jobs concurrently in two lanes.
+
+    Browser jobs are coroutines on a dedicated asyncio thread that owns all
+    Playwright objects. CPU jobs (FFmpeg) run on a plain thread pool so they
+    never wait behind browser work.
+    """
+
+    def __init__(self, agent, lane_limits=None, type_limits=None, type_priorities=None):
+        self.agent = agent
+        self.lane_limits = {**DEFAULT_LANE_LIMITS, **(lane_limits or {})}
+        self.type_limits = {**DEFAULT_TYPE_LIMITS, **(type_limits or {})}
+        self.loop = None
+        self.on_slot_free = None  # Called (no args) whenever a running job finishes
+
+        self._lock = threading.Lock()
+        self._pending = JobQueue(type_priorities)  # Claimed jobs waiting for a free slot
+        self._running = {}  # job_id -> job
+        self._lane_counts = {lane: 0 for lane in self.lane_limits}
+        self._type_counts = {}
+        self._loop_thread = None
+        self._cpu_pool = ThreadPoolExecutor(
+            max_workers=self.lane_limits['cpu'], thread_name_prefix='cpu-lane'
+        )
+
+    @classmethod
+    def from_config(cls, agent, config):
+        """Builds an executor from the 'concurrency' section of agent_config.json."""
+        concurrency = config.get('concurrency', {})
+        lane_limits = {lane: concurrency[lane] for lane in ('browser', 'cpu') if lane in concurrency}
+        return cls(agent, lane_limits, concurrency.get('jobTypes'), config.get('jobPriorities'))
+
+    def start(self):
+        """Starts the browser lane event loop thread."""
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        self._loop_thread = threading.Thread(target=run_loop, name='browser-lane', daemon=True)
+        self._loop_thread.start()
+        ready.wait()
+        print(f"🚦 Executor started (browser: {self.lane_limits['browser']}, cpu: {self.lane_limits['cpu']})")
+
+    def submit(self, job_id, job_data):
+        """Queues a claimed job; it starts as soon as its lane and type have a free slot.
+
+        Returns the id of an identical queued job this one was coalesced into, or None.
+        """
+        job = {
+            'job_id': job_id,
+            'data': job_data,
+            'lane': job_lane(job_data),
+            'type': job_type(job_data),
+            'queued_at': time.monotonic(),
+        }
+        with self._lock:
+            if job_id in self._running:
+                return None
+            coalesced_into = self._pending.push(job)
+        self._pump()
+        return coalesced_into
+
+    def free_slots(self, lane):
+        """Slots in `lane` not taken by running or queued jobs."""
+        with self._lock:
+            taken = self._lane_counts[lane] + self._pending.lane_depth(lane)
+            return max(0, self.lane_limits[lane] - taken)
+
+    def held_job_ids(self):
+        """Ids of every job this executor holds (running, queued or coalesced)."""
+        with self._lock:
+            ids = self._pending.job_ids()
+            for job in self._running.values():
+                ids.append(job['job_id'])
+                ids.extend(job.get('duplicates', []))
+            return ids
+
+    def cancel(self, job_id):
+        """Drops a queued job or cancels a running one.
+
+        Running browser jobs are cancelled through their future; running CPU
+        jobs get their cancel event set and stop at the next check (FFmpeg is
+        killed). Returns 'queued', 'running' or None if the job is unknown.
+        """
+        with self._lock:
+            if self._pending.remove(job_id):
+                return 'queued'
+            job = self._running.get(job_id)
+        if not job:
+            return None
+        if job['lane'] == 'cpu':
+            job['cancel_event'].set()
+            return 'running'
+        if job.get('future') and job['future'].cancel():
+            return 'running'
+        return None
+
+    def run_cpu(self, fn, *args):
+        """Runs `fn` on the CPU lane pool from browser-lane code; returns an awaitable.
+
+        `fn` sees the caller's context variables (job project, trace span).
+        """
+        context = contextvars.copy_context()
+        return asyncio.wrap_future(self._cpu_pool.submit(context.run, fn, *args))
+
+    def run(self, coro, timeout=None):
+        """Runs a coroutine on the browser lane loop and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stats(self):
+        """Snapshot of queue depth and running jobs per lane."""
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'running': dict(self._lane_counts),
+                'runningByType': dict(self._type_counts),
+            }
+
+    def _has_capacity(self, job):
+        if self._lane_counts[job['lane']] >= self.lane_limits[job['lane']]:
+            return False
+        limit = self.type_limits.get(job['type'])
+        return limit is None or self._type_counts.get(job['type'], 0) < limit
+
+    def _pump(self):
+        """Starts queued jobs in priority order, skipping over blocked job types."""
+        to_start = []
+        with self._lock:
+            while True:
+                job = self._pending.pop_ready(self._has_capacity)
+                if job is None:
+                    break
+                self._running[job['job_id']] = job
+                self._lane_counts[job['lane']] += 1
+                self._type_counts[job['type']] = self._type_counts.get(job['type'], 0) + 1
+                to_start.append(job)
+
+        for job in to_start:
+            self._start(job)
+
+    def _start(self, job):
+        print(f"🚀 [{job['lane'].upper()}] Starting job {job['job_id']} ({job['type']})")
+        job['started_at'] = time.monotonic()
+        JOB_QUEUE_SECONDS.observe(job['started_at'] - job['queued_at'], lane=job['lane'])
+        if job['lane'] == 'cpu':
+            job['cancel_event'] = threading.Event()
+            future = self._cpu_pool.submit(self.agent.execute_cpu_job, job['job_id'], job['data'], job['cancel_event'])
+        else:
+            future = asyncio.run_coroutine_threadsafe(
+                self.agent.execute_job(job['job_id'], job['data']), self.loop
+            )
+        job['future'] = future
+        future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+
+    def _on_done(self, job, future):
+        outcome = 'done'
+        if future.cancelled():
+            outcome = 'cancelled'
+            print(f"🚫 Job {job['job_id']} cancelled.")
+        elif future.exception():
+            outcome = 'crashed'
+            error = future.exception()
+            print(f"❌ Job {job['job_id']} crashed: {error}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+        JOB_SECONDS.observe(time.monotonic() - job['started_at'], type=job['type'], lane=job['lane'])
+        JOBS_FINISHED.inc(type=job['type'], outcome=outcome)
+        METRICS.job_finished()
+
+        with self._lock:
+            self._running.pop(job['job_id'], None)
+            self._lane_counts[job['lane']] -= 1
+            self._type_counts[job['type']] -= 1
+        self._pump()
+        if self.on_slot_free:
+            self.on_slot_free()
+
+        cancelled = future.cancelled() or (job.get('cancel_event') and job['cancel_event'].is_set())
+        if job.get('duplicates') and not cancelled:
+            # Mirror the result onto coalesced duplicates (Firestore I/O, keep it off the lanes)
+            threading.Thread(
+                target=self.agent.settle_duplicates,
+                args=(job['job_id'], job['duplicates']),
+                daemon=True
+            ).start()
+
+    def shutdown(self):
+        """Stops accepting work and tears down both lanes."""
+        with self._lock:
+            self._pending.clear()
+        self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        print("🛑 Executor stopped.")
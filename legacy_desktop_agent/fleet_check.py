@@ -0,0 +1,73 @@
+"""Seeds CMD_SLEEP jobs into the Firestore emulator and reports how the fleet shared them.
+
+Usage (each agent in its own terminal, all with FIRESTORE_EMULATOR_HOST set):
+    firebase emulators:start --only firestore
+    python main.py --agent-id agent-a
+    python main.py --agent-id agent-b
+    python fleet_check.py --jobs 40 --seconds 3
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from google.cloud import firestore
+
+EMULATOR_PROJECT = "demo-content-auto-post"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--project-id', default=None, help="agent_jobs projectId (defaults to agent_config.json)")
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        print("❌ FIRESTORE_EMULATOR_HOST is not set. This script only talks to the emulator.")
+        sys.exit(1)
+
+    project_id = args.project_id
+    if not project_id:
+        import json
+        with open("agent_config.json", 'r') as f:
+            project_id = json.load(f).get('project_id')
+
+    db = firestore.Client(project=os.environ.get('GCLOUD_PROJECT', EMULATOR_PROJECT))
+    batch = db.batch()
+    job_ids = []
+    for i in range(args.jobs):
+        ref = db.collection('agent_jobs').document()
+        batch.set(ref, {
+            'projectId': project_id,
+            'recipeId': 'CMD_SLEEP',
+            'seconds': args.seconds,
+            'dedupeKey': ref.id,
+            'status': 'PENDING',
+            'createdAt': datetime.now(timezone.utc)
+        })
+        job_ids.append(ref.id)
+    batch.commit()
+    print(f"🌱 Seeded {args.jobs} CMD_SLEEP jobs ({args.seconds}s each) for project {project_id}")
+
+    start = time.time()
+    while time.time() - start < args.timeout:
+        docs = [db.collection('agent_jobs').document(job_id).get().to_dict() for job_id in job_ids]
+        done = [d for d in docs if d.get('status') in ('COMPLETED', 'FAILED')]
+        print(f"⏳ {len(done)}/{len(docs)} finished")
+        if len(done) == len(docs):
+            break
+        time.sleep(2)
+
+    by_agent = collections.Counter(d.get('completedBy', '?') for d in docs if d.get('status') == 'COMPLETED')
+    retried = sum(1 for d in docs if d.get('attempts'))
+    failed = sum(1 for d in docs if d.get('status') == 'FAILED')
+    print(f"\n📊 Finished in {time.time() - start:.1f}s | retried: {retried} | failed: {failed}")
+    for agent_id, count in by_agent.most_common():
+        print(f"   {agent_id}: {count} job(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import bisect
+import hashlib
+import itertools
+import json
+import time
+from datetime import datetime
+
+# --- CONFIGURATION ---
+# Lower runs first. Interactive commands jump the queue because a user is waiting on them.
+DEFAULT_TYPE_PRIORITIES = {
+    'CMD_OPEN_BROWSER': 0,
+    'CMD_RECORD': 0,
+    'CMD_PLAY': 1,
+    'RECIPE': 2,
+    'CMD_RUN_BLOCK': 2,
+    'CMD_STITCH_VIDEO': 2,
+}
+FALLBACK_PRIORITY = 5
+# Fields that say when and by whom a job runs, not what it does: ignored when comparing payloads
+VOLATILE_FIELDS = frozenset((
+    'status', 'priority', 'createdAt', 'updatedAt', 'claimedAt', 'startTime', 'endTime',
+    'leaseOwner', 'leaseExpiresAt', 'lastLeaseOwner', 'attempts', 'coalescedInto', 'completedBy',
+    'error', 'progress', 'cancelRequested',
+))
+
+
+def created_at_seconds(job_data):
+    """Epoch seconds of the job's createdAt (Firestore timestamp or ISO string), now if unset."""
+    created = job_data.get('createdAt')
+    if hasattr(created, 'timestamp'):
+        return created.timestamp()
+    if isinstance(created, str):
+        try:
+            return datetime.fromisoformat(created.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def dedupe_key(job_data):
+    """Key under which identical pending jobs are coalesced into one run.
+
+    Without an explicit `dedupeKey`, jobs are identical when their whole
+    payload is, apart from `VOLATILE_FIELDS`: two block jobs with another
+    `blockFile` or two browser jobs for another `profile` never coalesce.
+    """
+    if job_data.get('dedupeKey'):
+        return str(job_data['dedupeKey'])
+    payload = {field: value for field, value in job_data.items() if field not in VOLATILE_FIELDS}
+    raw = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    """Local priority queue of claimed jobs, ordered by (type priority, createdAt).
+
+    Not thread-safe on its own; the executor guards it with its lock.
+    """
+
+    def __init__(self, type_priorities=None):
+        self.type_priorities = {**DEFAULT_TYPE_PRIORITIES, **(type_priorities or {})}
+        self._entries = []  # Sorted list of (sort_key, job)
+        self._by_id = {}
+        self._by_dedupe = {}
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job_id):
+        return job_id in self._by_id
+
+    def _sort_key(self, job):
+        data = job['data']
+        priority = data.get('priority', self.type_priorities.get(job['type'], FALLBACK_PRIORITY))
+        return (priority, created_at_seconds(data), next(self._seq))
+
+    def push(self, job):
+        """Adds a job. Returns the id of the queued job it was coalesced into, or None."""
+        if job['job_id'] in self._by_id:
+            return None
+
+        key = dedupe_key(job['data'])
+        primary = self._by_dedupe.get(key)
+        if primary is not None:
+            primary.setdefault('duplicates', []).append(job['job_id'])
+            return primary['job_id']
+
+        job['dedupe_key'] = key
+        entry = (self._sort_key(job), job)
+        bisect.insort(self._entries, entry, key=lambda e: e[0])
+        self._by_id[job['job_id']] = job
+        self._by_dedupe[key] = job
+        return None
+
+    def lane_depth(self, lane):
+        """Number of queued jobs waiting for `lane`."""
+        return sum(1 for _, job in self._entries if job['lane'] == lane)
+
+    def job_ids(self):
+        """Ids of queued jobs, including duplicates coalesced into them."""
+        ids = []
+        for _, job in self._entries:
+            ids.append(job['job_id'])
+            ids.extend(job.get('duplicates', []))
+        return ids
+
+    def remove(self, job_id):
+        """Drops a queued job. Returns it, or None if it is not queued."""
+        return self.pop_ready(lambda job: job['job_id'] == job_id)
+
+    def pop_ready(self, can_start):
+        """Removes and returns the first job (in priority order) for which can_start(job) is true."""
+        for index, (_, job) in enumerate(self._entries):
+            if can_start(job):
+                del self._entries[index]
+                self._by_id.pop(job['job_id'], None)
+                self._by_dedupe.pop(job['dedupe_key'], None)
+                return job
+        return None
+
+    def clear(self):
+        self._entries.clear()
+        self._by_id.clear()
+        self._by_dedupe.clear()
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# --- CONFIGURATION ---
+DEFAULT_JOURNAL_PATH = os.path.join(os.getcwd(), "state", "journal.db")
+DEFAULT_KEEP_DAYS = 7          # Finished jobs (and their checkpoints) kept this long
+DEFAULT_MAX_ATTEMPTS = 50      # Failed sends of one update before it is dropped, unblocking its job's later updates
+SENTINEL_KEY = '__firestore__'
+FLUSH_LOCKS = 16               # Striped locks: one flusher per job at a time keeps its updates in order
+# Job fields that decide what a job does: checkpoints only apply to a job with the same ones
+FINGERPRINT_FIELDS = ('recipeId', 'variables', 'steps', 'scenes', 'block', 'blockId', 'blockFile')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    variables TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checkpoints_job ON checkpoints (job_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+"""
+
+
+def _firestore():
+    # Imported on first use: the journal itself runs (and is tested) without firebase_admin
+    from firebase_admin import firestore
+    return firestore
+
+
+def _encode(value):
+    """JSON for Firestore update values (sentinels and datetimes survive a restart)."""
+    if isinstance(value, datetime):
+        return {SENTINEL_KEY: 'datetime', 'iso': value.isoformat()}
+    firestore = _firestore()
+    if value is firestore.SERVER_TIMESTAMP:
+        return {SENTINEL_KEY: 'SERVER_TIMESTAMP'}
+    if value is firestore.DELETE_FIELD:
+        return {SENTINEL_KEY: 'DELETE_FIELD'}
+    return str(value)
+
+
+def _decode(obj):
+    kind = obj.get(SENTINEL_KEY)
+    if kind in ('SERVER_TIMESTAMP', 'DELETE_FIELD'):
+        return getattr(_firestore(), kind)
+    if kind == 'datetime':
+        return datetime.fromisoformat(obj['iso'])
+    return obj
+
+
+def resume_point(steps, checkpoints, is_entry):
+    """Index to restart a step list from after a crash.
+
+    Steps are checkpointed as "step:<index>". The browser state of a dead
+    process is gone, so the job restarts at the last re-entry step (a
+    navigation) at or before the first step that never completed.
+    """
+    first_pending = 0
+    while f"step:{first_pending}" in checkpoints:
+        first_pending += 1
+    if first_pending >= len(steps):
+        return len(steps)
+    for index in range(first_pending, -1, -1):
+        if is_entry(steps[index]):
+            return index
+    return 0
+
+
+def job_fingerprint(job_data):
+    relevant = {field: job_data.get(field) for field in FINGERPRINT_FIELDS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class JobJournal:
+    """Crash-safe local record of running jobs, their checkpoints and their pending status updates.
+
+    A SQLite file (WAL mode) on the agent machine. `begin()` records a job
+    with a fingerprint of what it does, `checkpoint()` appends one completed
+    unit of work (a recipe step, a downloaded scene), and `finish()` closes
+    the job. A job still open after a restart is resumed from its
+    checkpoints. Job status updates go to the outbox first and are removed
+    once Firestore has them, so a network blip delays an update instead of
+    failing the job.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, keep_days=DEFAULT_KEEP_DAYS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.keep_days = keep_days
+        self.max_attempts = max_attempts
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')  # Durable across process crashes, cheap commits
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._flush_locks = [threading.Lock() for _ in range(FLUSH_LOCKS)]
+        self.stats = {'checkpoints': 0, 'synced': 0, 'syncFailures': 0, 'dropped': 0, 'resumed': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a journal from the 'journal' section of agent_config.json."""
+        journal_config = config.get('journal', {})
+        return cls(
+            path=journal_config.get('path', DEFAULT_JOURNAL_PATH),
+            keep_days=journal_config.get('keepDays', DEFAULT_KEEP_DAYS),
+            max_attempts=journal_config.get('maxAttempts', DEFAULT_MAX_ATTEMPTS),
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- Jobs and checkpoints ---
+
+    def begin(self, job_id, job_data):
+        """Opens (or re-opens) a job. Returns its checkpoints {key: data}, empty unless this is a resume."""
+        fingerprint = job_fingerprint(job_data)
+        variables = json.dumps(job_data.get('variables', {}), default=str)
+        with self._lock:
+            row = self._conn.execute('SELECT fingerprint, finished_at FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row and (row[0] != fingerprint or row[1] is not None):
+                # Edited since, or finished and now re-run on purpose: the old checkpoints don't apply
+                self._conn.execute('DELETE FROM checkpoints WHERE job_id = ?', (job_id,))
+            self._conn.execute(
+                'INSERT INTO jobs (job_id, fingerprint, variables, started_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(job_id) DO UPDATE SET fingerprint = excluded.fingerprint, '
+                'variables = excluded.variables, finished_at = NULL',
+                (job_id, fingerprint, variables, time.time()))
+        checkpoints = self.checkpoints(job_id)
+        if checkpoints:
+            with self._lock:
+                self.stats['resumed'] += 1
+        return checkpoints
+
+    def checkpoint(self, job_id, key, data=None):
+        """Appends a completed unit of work. The latest entry per key wins."""
+        self._execute('INSERT INTO checkpoints (job_id, key, data, at) VALUES (?, ?, ?, ?)',
+                      (job_id, key, json.dumps(data, default=str), time.time()))
+        with self._lock:
+            self.stats['checkpoints'] += 1
+
+    def checkpoints(self, job_id):
+        rows = self._execute('SELECT key, data FROM checkpoints WHERE job_id = ? ORDER BY id', (job_id,))
+        return {key: json.loads(data) for key, data in rows}
+
+    def finish(self, job_id):
+        """Closes a job: it will not be resumed. Its checkpoints stay until `prune()`."""
+        self._execute('UPDATE jobs SET finished_at = ? WHERE job_id = ?', (time.time(), job_id))
+
+    def is_finished(self, job_id):
+        rows = self._execute('SELECT finished_at FROM jobs WHERE job_id = ?', (job_id,))
+        return bool(rows) and rows[0][0] is not None
+
+    def unfinished(self):
+        """Ids of jobs that were begun but never finished (the process died mid-job)."""
+        return [row[0] for row in self._execute('SELECT job_id FROM jobs WHERE finished_at IS NULL ORDER BY started_at')]
+
+    def prune(self):
+        """Forgets jobs finished (or abandoned to another agent) more than `keep_days` ago."""
+        cutoff = time.time() - self.keep_days * 86400
+        with self._lock:
+            old = [row[0] for row in self._conn.execute(
+                'SELECT job_id FROM jobs WHERE COALESCE(finished_at, started_at) < ?', (cutoff,))]
+            for job_id in old:
+                self._conn.execute('DELETE FROM checkpoints WHERE job_id = ?', (job_id,))
+                self._conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        return len(old)
+
+    # --- Status outbox ---
+
+    def enqueue(self, job_id, fields):
+        """Records a job document update locally, before it is sent."""
+        self._execute('INSERT INTO outbox (job_id, fields, created_at) VALUES (?, ?, ?)',
+                      (job_id, json.dumps(fields, default=_encode), time.time()))
+
+    def _flush_lock(self, job_id):
+        return self._flush_locks[int(hashlib.md5(job_id.encode()).hexdigest(), 16) % FLUSH_LOCKS]
+
+    def flush(self, apply, job_id=None):
+        """Sends queued updates in order with `apply(job_id, fields)`. Returns the number still queued.
+
+        A failed update stops that job's queue (later updates must not
+        overtake it) and is retried on the next flush, up to `max_attempts`
+        times; then it is dropped so the job's later updates can go out. An
+        update for a document that no longer exists is dropped at once.
+        """
+        if job_id is None:
+            job_ids = [row[0] for row in self._execute('SELECT DISTINCT job_id FROM outbox')]
+        else:
+            job_ids = [job_id]
+        for current in job_ids:
+            with self._flush_lock(current):
+                rows = self._execute('SELECT id, fields, attempts FROM outbox WHERE job_id = ? ORDER BY id',
+                                     (current,))
+                for row_id, fields, attempts in rows:
+                    try:
+                        apply(current, json.loads(fields, object_hook=_decode))
+                    except Exception as e:
+                        if type(e).__name__ == 'NotFound':
+                            print(f"🗑️ Dropping update for deleted job {current}")
+                            self._execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                            with self._lock:
+                                self.stats['dropped'] += 1
+                            continue
+                        with self._lock:
+                            self.stats['syncFailures'] += 1
+                        if self.max_attempts and attempts + 1 >= self.max_attempts:
+                            print(f"🗑️ Dropping update for job {current} after {attempts + 1} failed attempts: {e}")
+                            self._execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                            with self._lock:
+                                self.stats['dropped'] += 1
+                            continue
+                        self._execute('UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                                      (str(e)[:500], row_id))
+                        print(f"⚠️ Job {current} update kept in the local outbox (will retry): {e}")
+                        break
+                    self._execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                    with self._lock:
+                        self.stats['synced'] += 1
+        return self._execute('SELECT COUNT(*) FROM outbox')[0][0]
+
+    def snapshot(self):
+        unfinished = self._execute('SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL')[0][0]
+        queued = self._execute('SELECT COUNT(*) FROM outbox')[0][0]
+        with self._lock:
+            return {**self.stats, 'openJobs': unfinished, 'outbox': queued}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
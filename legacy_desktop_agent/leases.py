@@ -0,0 +1,172 @@
+from datetime import datetime, timezone, timedelta
+from firebase_admin import firestore
+from metrics import firestore_call
+
+# --- CONFIGURATION ---
+DEFAULT_LEASE_SECONDS = 120    # Renewed with every heartbeat, so a dead agent's jobs free up quickly
+DEFAULT_MAX_ATTEMPTS = 3       # Lease expiries before a job is marked FAILED
+LEASED_STATUSES = ('CLAIMED', 'RUNNING')
+FIRESTORE_IN_LIMIT = 30        # Max values in one 'in' filter
+
+
+class LeaseManager:
+    """Job leases on agent_jobs documents.
+
+    A lease is (leaseOwner, leaseExpiresAt). The owner renews it with every
+    heartbeat; any agent may return a job whose lease has expired to PENDING,
+    bumping its `attempts` counter, so work left behind by a dead agent is
+    picked up by the rest of the fleet.
+    """
+
+    def __init__(self, db, agent_id, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db = db
+        self.agent_id = agent_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stats = {'claimed': 0, 'lostRaces': 0, 'renewed': 0, 'lost': 0, 'reaped': 0}
+
+    @classmethod
+    def from_config(cls, db, agent_id, config):
+        return cls(
+            db, agent_id,
+            lease_seconds=config.get('leaseSeconds', DEFAULT_LEASE_SECONDS),
+            max_attempts=config.get('maxAttempts', DEFAULT_MAX_ATTEMPTS),
+        )
+
+    def expiry(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+
+    def _jobs(self):
+        return self.db.collection('agent_jobs')
+
+    def claim(self, job_ref):
+        """Atomically moves a PENDING job to CLAIMED under our lease.
+
+        Returns the job data, or None if another agent got there first.
+        """
+        @firestore.transactional
+        def claim_in(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            job_data = snapshot.to_dict() if snapshot.exists else None
+            if not job_data or job_data.get('status') != 'PENDING':
+                return None
+            transaction.update(job_ref, {
+                'status': 'CLAIMED',
+                'leaseOwner': self.agent_id,
+                'leaseExpiresAt': self.expiry(),
+                'claimedAt': firestore.SERVER_TIMESTAMP
+            })
+            return job_data
+
+        try:
+            with firestore_call('claim'):
+                job_data = claim_in(self.db.transaction())
+        except Exception as e:
+            print(f"⚠️ Claim failed for {job_ref.id}: {e}")
+            return None
+        self.stats['claimed' if job_data else 'lostRaces'] += 1
+        return job_data
+
+    def start(self, job_ref):
+        """Atomically moves a claimed job to RUNNING and refreshes our lease.
+
+        Returns False without writing if the job was cancelled (or deleted)
+        while it waited in the queue.
+        """
+        @firestore.transactional
+        def start_in(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            job_data = snapshot.to_dict() if snapshot.exists else None
+            if not job_data or job_data.get('cancelRequested') or job_data.get('status') == 'CANCELLED':
+                return False
+            transaction.update(job_ref, {
+                'status': 'RUNNING',
+                'startTime': firestore.SERVER_TIMESTAMP,
+                'leaseOwner': self.agent_id,
+                'leaseExpiresAt': self.expiry()
+            })
+            return True
+
+        with firestore_call('start'):
+            return start_in(self.db.transaction())
+
+    def renew(self, job_ids):
+        """Extends our leases. Returns the ids of jobs whose lease we no longer hold."""
+        lost = []
+        for job_id in job_ids:
+            job_ref = self._jobs().document(job_id)
+
+            @firestore.transactional
+            def renew_in(transaction):
+                snapshot = job_ref.get(transaction=transaction)
+                job_data = snapshot.to_dict() if snapshot.exists else {}
+                if job_data.get('leaseOwner') != self.agent_id or job_data.get('status') not in LEASED_STATUSES:
+                    return False
+                transaction.update(job_ref, {'leaseExpiresAt': self.expiry()})
+                return True
+
+            try:
+                with firestore_call('renew'):
+                    renewed = renew_in(self.db.transaction())
+                if renewed:
+                    self.stats['renewed'] += 1
+                else:
+                    lost.append(job_id)
+                    self.stats['lost'] += 1
+            except Exception as e:
+                # Network blip: keep the job, try again on the next heartbeat
+                print(f"⚠️ Lease renewal failed for {job_id}: {e}")
+        return lost
+
+    def reap_expired(self, project_ids):
+        """Returns jobs with an expired lease to PENDING (or FAILED after max attempts)."""
+        now = datetime.now(timezone.utc)
+        project_ids = list(project_ids)
+        reaped = 0
+        for i in range(0, len(project_ids), FIRESTORE_IN_LIMIT):
+            chunk = project_ids[i:i + FIRESTORE_IN_LIMIT]
+            for status in LEASED_STATUSES:
+                query = self._jobs()\
+                            .where('projectId', 'in', chunk)\
+                            .where('status', '==', status)\
+                            .where('leaseExpiresAt', '<', now)
+                for job_doc in query.stream():
+                    if self._reap(job_doc.reference, now):
+                        reaped += 1
+        self.stats['reaped'] += reaped
+        return reaped
+
+    def _reap(self, job_ref, now):
+        @firestore.transactional
+        def reap_in(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            job_data = snapshot.to_dict() if snapshot.exists else {}
+            expires = job_data.get('leaseExpiresAt')
+            if job_data.get('status') not in LEASED_STATUSES or not expires or expires >= now:
+                return False
+
+            attempts = job_data.get('attempts', 0) + 1
+            update = {
+                'attempts': attempts,
+                'leaseOwner': firestore.DELETE_FIELD,
+                'leaseExpiresAt': firestore.DELETE_FIELD,
+                'lastLeaseOwner': job_data.get('leaseOwner'),
+            }
+            if attempts >= self.max_attempts:
+                update.update({
+                    'status': 'FAILED',
+                    'error': f"Lease expired {attempts} times (last owner: {job_data.get('leaseOwner')})",
+                    'endTime': firestore.SERVER_TIMESTAMP
+                })
+            else:
+                update['status'] = 'PENDING'
+            transaction.update(job_ref, update)
+            print(f"♻️ Reclaimed job {job_ref.id} from {job_data.get('leaseOwner')} → {update['status']} (attempt {attempts})")
+            return True
+
+        try:
+            with firestore_call('reap'):
+                return reap_in(self.db.transaction())
+        except Exception as e:
+            print(f"⚠️ Reap failed for {job_ref.id}: {e}")
+            return False
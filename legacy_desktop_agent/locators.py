@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# --- CONFIGURATION ---
+DEFAULT_WINNERS_PATH = os.path.join(os.getcwd(), "state", "locators.json")
+MAX_WINNERS = 5000             # Candidate sets remembered (least recently used are dropped)
+TIE_GRACE = 0.05               # Seconds a preferred candidate gets to catch up with a lower-ranked one that matched first
+SLOW_FALLBACK_MS = 1000        # Fallback wins slower than this are listed in the job report
+MAX_REPORTED = 10              # Slow fallbacks and misses listed per job
+# The old recorder wrote `tag (text="first 20 chars...")`, which is not a valid selector
+LEGACY_TEXT_RE = re.compile(r'^(?P<base>.*?)\s*\(text="(?P<text>.*?)(?:\.\.\.)?"\)$')
+
+
+def legacy_rewrites(selector):
+    """Valid selectors for an old recorder selector (none if it is not one)."""
+    match = LEGACY_TEXT_RE.match(selector or '')
+    if not match:
+        return []
+    text = match.group('text').strip()
+    base = match.group('base').strip() or '*'
+    return [f"{base}:has-text({json.dumps(text)})", f"text={json.dumps(text)}"] if text else [base]
+
+
+def candidate_list(selector, candidates=None):
+    """The step's selector followed by its recorded alternatives, deduplicated, legacy forms rewritten."""
+    ordered = []
+    for option in [selector, *(candidates or [])]:
+        for rewritten in legacy_rewrites(option) or [option]:
+            if rewritten and rewritten not in ordered:
+                ordered.append(rewritten)
+    return ordered
+
+
+class LocatorCache:
+    """Remembers which candidate locator found each step's element last time.
+
+    Keyed by the candidate set itself, so it works for recipes, playback
+    payloads and block steps alike. The winner is tried with top priority
+    on the next run; the file is saved by the heartbeat and at shutdown.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_WINNERS):
+        self.path = path
+        self.max_entries = max_entries
+        self._winners = collections.OrderedDict()  # key -> winning selector
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.stats = {'raced': 0, 'cachedWins': 0, 'fallbacks': 0, 'misses': 0}
+
+    def load(self, path):
+        """Switches to `path` and reads the winners saved there by a previous run."""
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                winners = json.load(f)
+        except (OSError, ValueError):
+            winners = {}
+        with self._lock:
+            self._winners = collections.OrderedDict(winners)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            winners = dict(self._winners)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        partial = self.path + '.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(winners, f)
+        os.replace(partial, self.path)
+
+    @staticmethod
+    def key(candidates):
+        return hashlib.sha1('\n'.join(sorted(candidates)).encode()).hexdigest()[:16]
+
+    def order(self, candidates):
+        """Candidates with last run's winner first. Returns (ordered, cached winner or None)."""
+        with self._lock:
+            winner = self._winners.get(self.key(candidates))
+        if winner not in candidates:
+            return list(candidates), None
+        return [winner] + [c for c in candidates if c != winner], winner
+
+    def record(self, candidates, winner, cached):
+        key = self.key(candidates)
+        with self._lock:
+            self.stats['raced'] += 1
+            if cached == winner:
+                self.stats['cachedWins'] += 1
+            elif winner != candidates[0]:
+                self.stats['fallbacks'] += 1
+            if self._winners.get(key) != winner:
+                self._winners[key] = winner
+                self._dirty = True
+            self._winners.move_to_end(key)
+            while len(self._winners) > self.max_entries:
+                self._winners.popitem(last=False)
+
+    def record_miss(self):
+        with self._lock:
+            self.stats['misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'known': len(self._winners)}
+
+
+LOCATORS = LocatorCache()
+
+
+async def resolve(page, candidates, timeout_ms, state='visible', cache=LOCATORS):
+    """Waits for whichever candidate locator matches first and returns (selector, info).
+
+    All candidates are waited on in parallel, so a stale selector costs
+    nothing while another one matches, and a miss costs one timeout instead
+    of one per candidate. When several match at once the best-ranked wins.
+    `info` is None when there was only one candidate (nothing raced).
+    """
+    if len(candidates) == 1:
+        await page.wait_for_selector(candidates[0], state=state, timeout=timeout_ms)
+        return candidates[0], None
+
+    ordered, cached = cache.order(candidates)
+    started = time.monotonic()
+    tasks = {asyncio.create_task(page.wait_for_selector(c, state=state, timeout=timeout_ms)): c for c in ordered}
+    pending = set(tasks)
+    found = []
+    last_error = None
+    try:
+        while pending and not found:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    found.append(task)
+                else:
+                    last_error = task.exception()
+            if found and pending and tasks[found[0]] != ordered[0]:
+                more, pending = await asyncio.wait(pending, timeout=TIE_GRACE)
+                found += [task for task in more if task.exception() is None]
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if not found:
+        cache.record_miss()
+        raise last_error or TimeoutError(f"No candidate matched: {ordered}")
+    winner = min((tasks[task] for task in found), key=ordered.index)
+    cache.record(candidates, winner, cached)
+    return winner, {'recorded': candidates[0], 'winner': winner, 'rank': candidates.index(winner),
+                    'ms': round((time.monotonic() - started) * 1000)}
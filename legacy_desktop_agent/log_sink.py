@@ -0,0 +1,139 @@
+import collections
+import threading
+import time
+from metrics import firestore_call
+
+# --- CONFIGURATION ---
+DEFAULT_MAX_QUEUE = 2000       # Entries held in memory before the drop policy kicks in
+DEFAULT_BATCH_SIZE = 200       # Entries per WriteBatch (Firestore allows 500 writes)
+DEFAULT_FLUSH_INTERVAL = 2.0   # Seconds between flushes when the batch is not full
+DEFAULT_BLOCK_TIMEOUT = 0.05   # Max wait for the 'block' policy before dropping
+MAX_COMMIT_ATTEMPTS = 3
+POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class FirestoreLogSink:
+    """Bounded in-memory log queue flushed to Firestore by a background thread.
+
+    Callers never wait on the network: `put` only appends to the queue. When
+    the queue is full the policy decides what is lost:
+
+    * drop_oldest – evict the oldest queued entry (default)
+    * drop_newest – reject the incoming entry
+    * block       – wait up to `block_timeout` for room, then reject
+    """
+
+    def __init__(self, db, max_queue=DEFAULT_MAX_QUEUE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, policy='drop_oldest',
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown log drop policy '{policy}' (expected one of {POLICIES})")
+        self.db = db
+        self.max_queue = max_queue
+        self.batch_size = min(batch_size, 500)
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats = {'enqueued': 0, 'flushed': 0, 'dropped': 0, 'batches': 0, 'failedCommits': 0}
+
+        self._entries = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, db, config):
+        """Builds a sink from the 'logSink' section of agent_config.json."""
+        sink_config = config.get('logSink', {})
+        return cls(
+            db,
+            max_queue=sink_config.get('maxQueue', DEFAULT_MAX_QUEUE),
+            batch_size=sink_config.get('batchSize', DEFAULT_BATCH_SIZE),
+            flush_interval=sink_config.get('flushInterval', DEFAULT_FLUSH_INTERVAL),
+            policy=sink_config.get('policy', 'drop_oldest'),
+        )
+
+    def put(self, collection_ref, data):
+        """Queues one document for `collection_ref`. Returns False if it was dropped."""
+        with self._cond:
+            if self._closed:
+                self.stats['dropped'] += 1
+                return False
+
+            if len(self._entries) >= self.max_queue:
+                if self.policy == 'drop_oldest':
+                    self._entries.popleft()
+                    self.stats['dropped'] += 1
+                elif self.policy == 'block':
+                    self._cond.notify_all()
+                    self._cond.wait_for(lambda: len(self._entries) < self.max_queue, self.block_timeout)
+                if len(self._entries) >= self.max_queue:
+                    self.stats['dropped'] += 1
+                    return False
+
+            self._entries.append((collection_ref, data))
+            self.stats['enqueued'] += 1
+            if len(self._entries) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def _take_batch(self):
+        batch = []
+        while self._entries and len(batch) < self.batch_size:
+            batch.append(self._entries.popleft())
+        self._cond.notify_all()  # Wake writers blocked on a full queue
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._entries) >= self.batch_size,
+                    self.flush_interval
+                )
+                entries = self._take_batch()
+                closing = self._closed
+
+            if entries:
+                self._commit(entries)
+            if closing:
+                with self._cond:
+                    if not self._entries:
+                        return
+
+    def _commit(self, entries):
+        for attempt in range(1, MAX_COMMIT_ATTEMPTS + 1):
+            try:
+                batch = self.db.batch()
+                for collection_ref, data in entries:
+                    batch.set(collection_ref.document(), data)
+                with firestore_call('log_batch'):
+                    batch.commit()
+                with self._cond:
+                    self.stats['flushed'] += len(entries)
+                    self.stats['batches'] += 1
+                return
+            except Exception as e:
+                with self._cond:
+                    self.stats['failedCommits'] += 1
+                print(f"⚠️ Log batch commit failed (attempt {attempt}/{MAX_COMMIT_ATTEMPTS}): {e}")
+                time.sleep(attempt)
+
+        with self._cond:
+            self.stats['dropped'] += len(entries)
+        print(f"❌ Dropped {len(entries)} log entries after {MAX_COMMIT_ATTEMPTS} failed commits")
+
+    def snapshot(self):
+        """Counters plus current queue depth, for the heartbeat document."""
+        with self._cond:
+            return {**self.stats, 'queued': len(self._entries)}
+
+    def close(self, timeout=10):
+        """Flushes everything still queued and stops the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"⚠️ Log sink did not finish flushing within {timeout}s")
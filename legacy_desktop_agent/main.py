@@ -1,28 +1,121 @@
+from startup import STARTUP # First: phase timings count from process start
 import os
 import sys
 import time
 import re
 import random
+import socket
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime
-import queue
-from playwright.sync_api import sync_playwright
+from datetime import datetime, timezone
+from executor import JobExecutor, job_lane, job_type
+from job_queue import created_at_seconds, DEFAULT_TYPE_PRIORITIES
+from leases import LeaseManager, LEASED_STATUSES, FIRESTORE_IN_LIMIT
+from journal import JobJournal, resume_point
+from locators import LOCATORS, DEFAULT_WINNERS_PATH
+from browser_pool import BrowserPool
+from memory import MemoryWatchdog
+from network import NetworkManager, download_step, use_policy
+from profiles import ProfileManager
+from quotas import QuotaScheduler, site_of
+from log_sink import FirestoreLogSink
+from recorder import RecipeRecorder, RECORDER_JS
+from pacing import StepPacer, merge_reports
+from blocks import BlockRunner, DEFAULT_PARALLEL_TABS, load_block_file, normalize_scenes, shard_scenes
+from downloads import DownloadCollector, DownloadError
+from stitcher import Stitcher, StitchError, StitchCancelled
+from recipe_cache import RecipeCache, render_template
+from tracing import JobTrace, mark_error, span
+from metrics import METRICS, DEFAULT_PORT, DEFAULT_HOST, JOB_STATUS, STEP_FAILURES, STEP_SECONDS, firestore_call
+
+STARTUP.mark('imports') # Playwright is imported lazily by the browser pool
 
 # --- CONFIGURATION ---
 SERVICE_ACCOUNT_KEY_PATH = "serviceAccountKey.json"
+HEARTBEAT_INTERVAL = 30 # Seconds; leases are renewed and expired ones reaped on the same tick
+CLAIM_POLL_INTERVAL = 5 # Seconds between claim passes when nothing wakes the claimer
+DEFAULT_CLAIM_DELAY = 0.5 # Max head start a fully idle agent gets over a busy one when claiming
+STITCH_PROGRESS_INTERVAL = 3 # Min seconds between progress writes to a stitch job document
+BLOCK_PROGRESS_INTERVAL = 3 # Min seconds between progress writes to a block job document
+EMULATOR_PROJECT = "demo-content-auto-post"
+FIRESTORE_BATCH_LIMIT = 500 # Max writes in one WriteBatch
+FINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED') # Counted in agent_job_status_total
+
+# Project of the job running in the current task/thread (scopes logs and profiles)
+_current_project = contextvars.ContextVar('current_project', default=None)
+
+
+def load_projects(config):
+    """Returns {project_id: uid} for every project this agent serves.
+
+    Single-project configs use 'uid'/'project_id'; multi-project configs add a
+    'projects' list of {"uid", "project_id"} objects (or bare project ids that
+    share the top-level uid).
+    """
+    projects = {}
+    if config.get('project_id'):
+        projects[config['project_id']] = config.get('uid')
+    for entry in config.get('projects', []):
+        if isinstance(entry, str):
+            projects[entry] = config.get('uid')
+        else:
+            projects[entry['project_id']] = entry.get('uid', config.get('uid'))
+    return projects
+
+
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
 class ContentAutoPostAgent:
-    def __init__(self, uid, project_id):
-        self.uid = uid
-        self.project_id = project_id
-        self.project_id = project_id
-        self.db = self._initialize_firebase()
-        self.job_queue = queue.Queue() # Job Queue for Main Thread execution
-        print(f"✅ Agent Initialized for User: {uid} | Project: {project_id}")
+    def __init__(self, uid, project_id, config=None, db=None):
+        self.config = config or {}
+        self.projects = load_projects({**self.config, 'uid': uid, 'project_id': project_id}) # project_id -> uid
+        self.project_id = project_id or next(iter(self.projects)) # Primary project (used outside of any job)
+        self.uid = uid or self.projects[self.project_id]
+        self.db = db or self._initialize_firebase() # Injected db: a stand-in such as bench/fake_firestore.py
+        STARTUP.mark('firebase')
+        self.log_sink = FirestoreLogSink.from_config(self.db, self.config) # Batched, non-blocking log writes
+        self.agent_id = self.config.get('agentId') or socket.gethostname() # Lease owner on claimed jobs
+        self.leases = LeaseManager.from_config(self.db, self.agent_id, self.config)
+        self.journal = JobJournal.from_config(self.config) # Local checkpoints and status outbox (crash-safe)
+        self.executor = JobExecutor.from_config(self, self.config)
+        self.executor.on_slot_free = self._wake_claimer
+
+        # Fleet: PENDING jobs seen by the listener but not claimed yet (claimed only while we have room)
+        fleet_config = self.config.get('fleet', {})
+        self.prefetch = fleet_config.get('prefetch') # Extra queued jobs per lane beyond free slots (None = no limit)
+        self.claim_delay = fleet_config.get('claimDelay', DEFAULT_CLAIM_DELAY)
+        self._candidates = {} # job_id -> job_doc
+        self._candidates_lock = threading.Lock()
+        self._claim_wakeup = threading.Event()
+        self.profiles = ProfileManager.from_config(self.config) # Template clones and cache budgets
+        self.browser_pool = BrowserPool.from_config(self.config) # Warm Chromium contexts (browser lane only)
+        self.browser_pool.prepare_profile = self.profiles.prepare
+        self.browser_pool.watchdog = MemoryWatchdog.from_config(self.config) # Recycles contexts, gates leases under pressure
+        self.network = NetworkManager.from_config(self.config) # Resource blocking and shared asset cache
+        self.quotas = QuotaScheduler.from_config(self.config) # Site rate limits and daily quotas per profile
+        LOCATORS.load(self.config.get('locators', {}).get('path', DEFAULT_WINNERS_PATH)) # Learned selector winners
+        self.recipe_cache = RecipeCache.from_config(self.db, self.config) # Compiled recipes, invalidated by watches
+        self.stitcher = Stitcher.from_config(self.config) # Probe/normalize/concat pipeline (CPU lane)
+        self._register_gauges()
+        STARTUP.mark('agentInit')
+        print(f"✅ Agent Initialized for User: {uid} | Projects: {', '.join(self.projects)}")
         
     def _initialize_firebase(self):
-        """Initializes Firebase Admin SDK."""
+        """Initializes Firebase Admin SDK (or a Firestore emulator client for local fleet tests)."""
+        emulator_host = os.environ.get('FIRESTORE_EMULATOR_HOST')
+        if emulator_host:
+            from google.cloud import firestore as gcloud_firestore
+            project = os.environ.get('GCLOUD_PROJECT', EMULATOR_PROJECT)
+            print(f"🧪 Using Firestore emulator at {emulator_host} (project: {project})")
+            return gcloud_firestore.Client(project=project)
+
         if not firebase_admin._apps:
             if not os.path.exists(SERVICE_ACCOUNT_KEY_PATH):
                 print(f"❌ Error: '{SERVICE_ACCOUNT_KEY_PATH}' not found!")
@@ -32,209 +125,610 @@ class ContentAutoPostAgent:
             firebase_admin.initialize_app(cred)
         return firestore.client()
 
+    @property
+    def current_project(self):
+        """Project of the job being executed in this task/thread, else the primary project."""
+        return _current_project.get() or self.project_id
+
+    @contextlib.contextmanager
+    def _job_scope(self, job_data):
+        """Binds logs and profiles to the job's project for the duration of the job."""
+        token = _current_project.set(job_data.get('projectId') or self.project_id)
+        try:
+            yield
+        finally:
+            _current_project.reset(token)
+
     def log(self, message, status="info", platform="SYSTEM", scenes=0):
-        """Writes a log entry to Firestore."""
+        """Queues a log entry for Firestore (written in batches by the log sink)."""
         try:
-            logs_ref = self.db.collection('users').document(self.uid)\
-                           .collection('projects').document(self.project_id)\
+            project_id = self.current_project
+            logs_ref = self.db.collection('users').document(self.projects.get(project_id, self.uid))\
+                           .collection('projects').document(project_id)\
                            .collection('logs')
             
             log_data = {
-                "timestamp": firestore.SERVER_TIMESTAMP,
+                # Client time keeps entries of one batch in order (a server timestamp would tie them)
+                "timestamp": datetime.now(timezone.utc),
                 "platform": platform,
                 "status": status,
                 "message": message,
                 "scenes": scenes
             }
-            logs_ref.add(log_data)
+            if not self.log_sink.put(logs_ref, log_data):
+                print(f"⚠️ Log queue full, dropped: [{platform}] {message}")
+                return
             print(f"📝 Logged: [{platform}] {message}")
 
         except Exception as e:
             print(f"❌ Failed to write log: {e}")
 
+    def _set_job_fields(self, job_id, fields):
+        """Updates an agent_jobs document (blocking). Journaled first: if Firestore is unreachable it is retried later."""
+        self.journal.enqueue(job_id, fields)
+        if fields.get('status') in FINAL_STATUSES:
+            JOB_STATUS.inc(status=fields['status'])
+        self.journal.flush(self._apply_job_fields, job_id)
+
+    def _apply_job_fields(self, job_id, fields):
+        with firestore_call('job_update'):
+            self.db.collection('agent_jobs').document(job_id).update(fields)
+
+    def flush_outbox(self):
+        """Sends job updates that could not reach Firestore yet (every heartbeat, and at startup)."""
+        try:
+            queued = self.journal.flush(self._apply_job_fields)
+            if queued:
+                print(f"📮 {queued} job update(s) still waiting in the local outbox.")
+        except Exception as e:
+            print(f"⚠️ Outbox flush failed: {e}")
+
+    async def _update_job(self, job_id, fields):
+        """Updates an agent_jobs document without blocking the browser lane."""
+        await asyncio.to_thread(self._set_job_fields, job_id, fields)
+
+    def _profile_path(self, project_id):
+        return self.profiles.path(project_id)
+
+    def shutdown(self):
+        """Closes pooled browsers and stops the executor."""
+        try:
+            self.executor.run(self.browser_pool.close(), timeout=15)
+        except Exception as e:
+            print(f"⚠️ Browser pool shutdown failed: {e}")
+        self.executor.shutdown()
+        LOCATORS.save()
+        self.journal.close()
+        self.recipe_cache.close()
+        METRICS.close()
+        self.log_sink.close()
+
+    def _register_gauges(self):
+        """Point-in-time values read on every /metrics scrape."""
+        METRICS.gauge('agent_jobs_pending', 'Claimed jobs waiting for a slot', lambda: self.executor.stats()['pending'])
+        METRICS.gauge('agent_jobs_running', 'Running jobs per lane', lambda: self.executor.stats()['running'], 'lane')
+        METRICS.gauge('agent_ffmpeg_slots_busy', 'ffmpeg processes running', lambda: self.stitcher.slots.snapshot()['busy'])
+        METRICS.gauge('agent_ffmpeg_slots_waiting', 'ffmpeg runs waiting for a slot', lambda: self.stitcher.slots.snapshot()['waiting'])
+        METRICS.gauge('agent_log_queue', 'Log entries waiting for a batch commit', lambda: self.log_sink.snapshot().get('queued'))
+        watchdog = self.browser_pool.watchdog
+        if watchdog:
+            METRICS.gauge('agent_memory_mb', 'RSS of the agent process tree at the last sample', lambda: {
+                part: watchdog.latest().get(f"{part}MB") for part in ('agent', 'driver', 'browser')
+                if watchdog.latest().get(f"{part}MB") is not None}, 'part')
+            METRICS.gauge('agent_memory_available_mb', 'Free system memory at the last sample', lambda: watchdog.latest().get('availableMB'))
+            METRICS.gauge('agent_memory_pressure', '1 while new browser leases wait for memory', lambda: int(watchdog.pressure))
+
+    def start_metrics(self):
+        """Serves the Prometheus endpoint described by the 'metrics' section of the config."""
+        metrics_config = self.config.get('metrics', {})
+        if metrics_config.get('enabled', True) is False:
+            return
+        METRICS.serve(metrics_config.get('host', DEFAULT_HOST), metrics_config.get('port', DEFAULT_PORT))
+
     def start_heartbeat(self):
         """Send heartbeat to Firestore every 30 seconds to show agent is online."""
-        import threading
-        
         def send_heartbeat():
             try:
-                self.db.collection('agent_status').document(self.project_id).set({
-                    'projectId': self.project_id,
-                    'userId': self.uid,
+                shared = {
                     'status': 'online',
                     'lastSeen': firestore.SERVER_TIMESTAMP,
-                    'version': '2.1'
-                }, merge=True)
-                print(f"💓 Heartbeat sent to agent_status/{self.project_id}")
+                    'version': '2.1',
+                    'agentId': self.agent_id,
+                    'freeSlots': {lane: self.executor.free_slots(lane) for lane in self.executor.lane_limits},
+                    'leases': dict(self.leases.stats),
+                    'executor': self.executor.stats(),
+                    'browserPool': self.browser_pool.snapshot(),
+                    'profiles': self.profiles.snapshot(),
+                    'memory': self.browser_pool.watchdog.snapshot() if self.browser_pool.watchdog else None,
+                    'network': self.network.snapshot(),
+                    'quotas': self.quotas.snapshot(),
+                    'recipeCache': self.recipe_cache.snapshot(),
+                    'stitchCache': self.stitcher.cache.snapshot() if self.stitcher.cache else None,
+                    'ffmpegSlots': self.stitcher.slots.snapshot(),
+                    'logSink': self.log_sink.snapshot(),
+                    'startup': STARTUP.snapshot(),
+                    'journal': self.journal.snapshot(),
+                    'locators': LOCATORS.snapshot(),
+                    'metrics': METRICS.summary()
+                }
+                # One batched write for every project this agent serves
+                for chunk in chunked(self.projects.items(), FIRESTORE_BATCH_LIMIT):
+                    batch = self.db.batch()
+                    for project_id, uid in chunk:
+                        batch.set(self.db.collection('agent_status').document(project_id), {
+                            'projectId': project_id,
+                            'userId': uid,
+                            **shared
+                        }, merge=True)
+                    with firestore_call('heartbeat'):
+                        batch.commit()
+                print(f"💓 Heartbeat sent to agent_status for {len(self.projects)} project(s)")
                 return True
             except Exception as e:
                 print(f"⚠️ Heartbeat failed: {e}")
                 return False
         
-        # Send first heartbeat immediately
-        send_heartbeat()
-        
         def heartbeat_loop():
+            # First heartbeat immediately, but off the startup path
+            if send_heartbeat():
+                STARTUP.mark('heartbeat')
             while True:
-                time.sleep(30)
+                time.sleep(HEARTBEAT_INTERVAL)
+                self.flush_outbox()
                 send_heartbeat()
+                try:
+                    LOCATORS.save()
+                except Exception as e:
+                    print(f"⚠️ Failed to save locator winners: {e}")
+                self.renew_leases()
+                try:
+                    if self.leases.reap_expired(self.projects):
+                        self._wake_claimer()
+                except Exception as e:
+                    print(f"⚠️ Lease reaper failed: {e}")
         
         heartbeat_thread = threading.Thread(target=heartbeat_loop, daemon=True)
         heartbeat_thread.start()
-        print("💓 Heartbeat thread started (every 30s)")
+        print(f"💓 Heartbeat thread started (every {HEARTBEAT_INTERVAL}s)")
+
+    def renew_leases(self):
+        """Extends the lease of every job we hold; drops jobs whose lease another agent took over."""
+        for job_id in self.leases.renew(self.executor.held_job_ids()):
+            where = self.executor.cancel(job_id)
+            print(f"🚫 Lost lease on job {job_id} ({where or 'not cancellable'}). Another agent owns it now.")
 
     def start_listener(self):
-        """Listens for NEW jobs in the 'agent_jobs' collection assigned to this project."""
-        print(f"\n🎧 Waiting for jobs for Project: '{self.project_id}'... (Ctrl+C to stop)")
+        """Listens for NEW jobs in the 'agent_jobs' collection assigned to our projects."""
+        print(f"\n🎧 Waiting for jobs for {len(self.projects)} project(s)... (Ctrl+C to stop)")
         
-        # Start heartbeat
-        self.start_heartbeat()
-        
-        # Query for jobs where projectId == self.project_id
-        # Removed PENDING filter to debug if jobs are coming in with wrong status
+        # One shared watch per chunk of projects ('in' filters are capped by Firestore)
         jobs_ref = self.db.collection('agent_jobs')
-        # FIX: Ensure we only listen to PENDING jobs for THIS project
-        query = jobs_ref.where('projectId', '==', self.project_id).where('status', '==', 'PENDING')
-        
-        self.job_watch = query.on_snapshot(self._on_job_update)
+        self.job_watches = []
+        for chunk in chunked(self.projects, FIRESTORE_IN_LIMIT):
+            query = jobs_ref.where('projectId', 'in', chunk).where('status', '==', 'PENDING')
+            self.job_watches.append(query.on_snapshot(self._on_job_update))
+        # Jobs we hold have left the PENDING watches: their cancellations arrive here
+        held = jobs_ref.where('leaseOwner', '==', self.agent_id)
+        for query in (held.where('cancelRequested', '==', True), held.where('status', '==', 'CANCELLED')):
+            self.job_watches.append(query.on_snapshot(self._on_cancel_request))
+        print(f"🎧 {len(self.job_watches)} listener(s) open.")
+        STARTUP.mark('listener')
+
+        threading.Thread(target=self._claim_loop, name='claimer', daemon=True).start()
+
+        # Start heartbeat (after the listener: jobs can arrive while the first one is in flight)
+        self.start_heartbeat()
+
+    def start_prewarm(self):
+        """Starts Playwright and the primary project's Chromium profile in the background ('startup' config)."""
+        if self.config.get('startup', {}).get('prewarm', True) is False:
+            return
+        asyncio.run_coroutine_threadsafe(self._prewarm_browser(), self.executor.loop)
+
+    async def _prewarm_browser(self):
+        startup_config = self.config.get('startup', {})
+        try:
+            await self.browser_pool.start()
+            STARTUP.mark('playwright')
+            try:
+                await self.browser_pool.prewarm(self._profile_path(self.project_id))
+            except Exception as e:
+                # Fresh machine or Playwright upgrade: fetch Chromium now rather than on the first job
+                if 'playwright install' not in str(e) or startup_config.get('installBrowser', True) is False:
+                    raise
+                print("⬇️ Chromium is missing. Installing it in the background...")
+                process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'playwright', 'install', 'chromium')
+                if await process.wait() != 0:
+                    raise
+                await self.browser_pool.prewarm(self._profile_path(self.project_id))
+            STARTUP.mark('chromium')
+        except Exception as e:
+            print(f"⚠️ Browser pre-warm failed (the first job will launch it): {e}")
+        STARTUP.report_once(lambda message: self.log(message, "info", "AGENT"))
+        await self._seed_profile_template()
+
+    async def _seed_profile_template(self):
+        """First run on this machine: let Chromium initialize the template that new profiles are cloned from."""
+        if not self.profiles.use_template or self.profiles.template_ready():
+            return
+        try:
+            context = await self.browser_pool.launch(self.profiles.template_path)
+            await context.close()
+            await asyncio.to_thread(self.profiles.finish_template)
+            print("🧬 Profile template ready: new profiles are now cloned from it.")
+        except Exception as e:
+            print(f"⚠️ Profile template setup failed (new profiles start empty): {e}")
 
     def _on_job_update(self, doc_snapshot, changes, read_time):
-        """Callback when a new job appears."""
-        pending_jobs = []
+        """Callback when PENDING jobs appear or disappear: keep the claim candidates in sync."""
+        with self._candidates_lock:
+            for change in changes:
+                job_doc = change.document
+                if change.type.name == 'REMOVED':
+                    # Claimed (by us or another agent), cancelled or deleted
+                    self._candidates.pop(job_doc.id, None)
+                elif job_doc.to_dict().get('status') == 'PENDING':
+                    self._candidates[job_doc.id] = job_doc
+        self._wake_claimer()
 
+    def _on_cancel_request(self, doc_snapshot, changes, read_time):
+        """Callback when a job we hold asks to be cancelled: drop it from the queue or stop it."""
         for change in changes:
-            if change.type.name == 'ADDED':
-                job_doc = change.document
-                job_data = job_doc.to_dict()
-                
-                # Double check status
-                if job_data.get('status') == 'PENDING':
-                    # Add to list for handling backlog
-                    pending_jobs.append({
-                        'doc': job_doc,
-                        'data': job_data,
-                        'created_at': job_data.get('createdAt', firestore.SERVER_TIMESTAMP) # Timestamp might be null if serverTimestamp hasn't committed yet, but locally it's fine for rough sorting or just taking the last one
-                    })
-
-        if not pending_jobs:
+            if change.type.name == 'REMOVED':
+                continue
+            job_doc = change.document
+            where = self.executor.cancel(job_doc.id)
+            if where is None:
+                continue # Not ours any more, or already finished
+            print(f"🚫 Job {job_doc.id} cancelled ({where}).")
+            # Running CPU jobs see their cancel event and write CANCELLED themselves
+            if where == 'queued' or job_lane(job_doc.to_dict()) == 'browser':
+                threading.Thread(target=self._finish_cancelled, args=(job_doc.reference,), daemon=True).start()
+
+    def _wake_claimer(self):
+        self._claim_wakeup.set()
+
+    def _has_room(self, lane):
+        if self.prefetch is None:
+            return True
+        return self.executor.free_slots(lane) + self.prefetch > 0
+
+    def _claim_loop(self):
+        """Claims candidate jobs, oldest first, while this agent has free capacity."""
+        while True:
+            self._claim_wakeup.wait(CLAIM_POLL_INTERVAL)
+            self._claim_wakeup.clear()
+
+            with self._candidates_lock:
+                candidates = sorted(self._candidates.values(), key=lambda doc: created_at_seconds(doc.to_dict()))
+            if not candidates:
+                continue
+
+            # Spread work by free capacity: the busier we are, the longer we let idle agents go first
+            if self.prefetch is not None:
+                limits = self.executor.lane_limits
+                free = sum(self.executor.free_slots(lane) for lane in limits)
+                time.sleep(self.claim_delay * (1 - free / sum(limits.values())))
+
+            for job_doc in candidates:
+                if not self._has_room(job_lane(job_doc.to_dict())):
+                    continue
+                with self._candidates_lock:
+                    if self._candidates.pop(job_doc.id, None) is None:
+                        continue # Gone since we sorted
+                job_data = self.leases.claim(job_doc.reference)
+                if job_data is None:
+                    print(f"↪️ Job {job_doc.id} was claimed by another agent.")
+                    continue
+                self._queue_claimed_job(job_doc.id, job_data)
+
+    def _queue_claimed_job(self, job_id, job_data):
+        print(f"⚡ Claimed Job: {job_id}")
+        coalesced_into = self.executor.submit(job_id, job_data)
+        if coalesced_into:
+            print(f"🔗 Job {job_id} is a duplicate of queued job {coalesced_into}. Coalescing.")
+            self._set_job_fields(job_id, {'coalescedInto': coalesced_into})
+
+    def adopt_claimed_jobs(self):
+        """Re-queues jobs this agent held before a restart; jobs that were running resume from their journal."""
+        self.flush_outbox() # Results recorded before the restart go out before anything is re-run
+        adopted = set()
+        for chunk in chunked(self.projects, FIRESTORE_IN_LIMIT):
+            for status in LEASED_STATUSES:
+                query = self.db.collection('agent_jobs')\
+                            .where('projectId', 'in', chunk)\
+                            .where('status', '==', status)\
+                            .where('leaseOwner', '==', self.agent_id)
+                for job_doc in query.stream():
+                    if self.journal.is_finished(job_doc.id):
+                        continue # Done locally; its final status is still in the outbox
+                    self._queue_claimed_job(job_doc.id, job_doc.to_dict())
+                    adopted.add(job_doc.id)
+
+        # Journaled jobs we no longer hold (finished, deleted, or taken over by another agent)
+        for job_id in self.journal.unfinished():
+            if job_id in adopted:
+                continue
+            snapshot = self.db.collection('agent_jobs').document(job_id).get()
+            if not snapshot.exists or (snapshot.to_dict() or {}).get('status') != 'PENDING':
+                self.journal.finish(job_id)
+        self.journal.prune()
+        if adopted:
+            print(f"📥 Re-queued {len(adopted)} job(s) held before restart.")
+        STARTUP.mark('adopt')
+
+    def _mark_running(self, job_id):
+        """Moves a claimed job to RUNNING and refreshes its lease. False if it was cancelled while queued."""
+        try:
+            return self.leases.start(self.db.collection('agent_jobs').document(job_id))
+        except Exception as e:
+            # Offline: run it anyway; its final status waits in the outbox
+            print(f"⚠️ Could not mark job {job_id} RUNNING: {e}")
+            return True
+
+    def settle_duplicates(self, primary_id, duplicate_ids):
+        """Copies the final result of a job onto the duplicates that were coalesced into it."""
+        try:
+            primary = self.db.collection('agent_jobs').document(primary_id).get().to_dict() or {}
+            result = {
+                'status': primary.get('status', 'FAILED'),
+                'coalescedInto': primary_id,
+                'endTime': firestore.SERVER_TIMESTAMP
+            }
+            for field in ('outputPath', 'error'):
+                if primary.get(field) is not None:
+                    result[field] = primary[field]
+
+            batch = self.db.batch()
+            for job_id in duplicate_ids:
+                batch.update(self.db.collection('agent_jobs').document(job_id), result)
+            with firestore_call('settle_duplicates'):
+                batch.commit()
+            print(f"🔗 Settled {len(duplicate_ids)} duplicate(s) of {primary_id}: {result['status']}")
+        except Exception as e:
+            print(f"⚠️ Failed to settle duplicates of {primary_id}: {e}")
+
+    async def execute_job(self, job_id, job_data):
+        """Browser lane entry point: runs the job scoped to its project (routed and traced when configured)."""
+        self._mark_first_job(job_id)
+        await asyncio.to_thread(self._begin_journal, job_id, job_data)
+        with self._job_scope(job_data):
+            network = self.network.for_job(job_data)
+            try:
+                if network is None:
+                    await self._run_traced_browser_job(job_id, job_data)
+                else:
+                    try:
+                        with network.activate():
+                            await self._run_traced_browser_job(job_id, job_data)
+                    finally:
+                        await asyncio.to_thread(self._save_network_report, job_id, network)
+            finally:
+                # Between jobs is when a context that served enough jobs (or grew too large) gets recycled
+                await self.browser_pool.job_finished(self._profile_path(self.current_project))
+        # Not reached if the process dies (or the job is cancelled at shutdown): the job resumes on restart
+        await asyncio.to_thread(self.journal.finish, job_id)
+
+    def _begin_journal(self, job_id, job_data):
+        checkpoints = self.journal.begin(job_id, job_data)
+        if checkpoints:
+            print(f"🔁 Resuming job {job_id} from {len(checkpoints)} checkpoint(s).")
+            self.log(f"Resuming job {job_id} from its last checkpoint", "info", "AGENT")
+
+    async def _checkpoint(self, job_id, key, data=None):
+        await asyncio.to_thread(self.journal.checkpoint, job_id, key, data)
+
+    async def _run_traced_browser_job(self, job_id, job_data):
+        trace = JobTrace.for_job(self.config, job_id, job_data, job_type(job_data))
+        if trace is None:
+            await self._run_browser_job(job_id, job_data)
             return
+        try:
+            with trace.activate():
+                await self._run_browser_job(job_id, job_data)
+        finally:
+            await trace.stop_playwright()
+            await asyncio.to_thread(self._save_trace, job_id, trace)
 
-        # Sort by createdAt (or just take the last one if assuming Firestore order)
-        # However, to be safe against flood, let's process ONLY the most recent one
-        # and mark others as SKIPPED.
-        
-        # Sort logic: Ensure we have a comparable time. If null (latency), treat as newest? 
-        # For simplicity in this context: Just take the last one in the list provided by Firestore which is usually chronological for listeners.
-        
-        target_job = pending_jobs[-1]
-        
-        # 1. Skip older jobs
-        for job in pending_jobs[:-1]:
-            print(f"⚠️ Skipping backlog job: {job['doc'].id}")
-            job['doc'].reference.update({'status': 'SKIPPED', 'note': 'Backlog handling'})
-
-        # 2. Process the latest job
-        latest_doc = target_job['doc']
-        latest_data = target_job['data']
-        
-        print(f"⚡ Processing Job: {latest_doc.id}")
-        
-        # IMMEDIATE LOCK to prevent race conditions
-        latest_doc.reference.update({'status': 'RUNNING', 'startTime': firestore.SERVER_TIMESTAMP})
-        
-        # Push to Queue
-        self.job_queue.put({
-            'job_id': latest_doc.id,
-            'data': latest_data
-        })
+    def _save_network_report(self, job_id, network):
+        """Puts the job's blocked requests, cache hits, bytes saved and page-load times on the job document."""
+        try:
+            report = self.network.finish(network)
+            self._set_job_fields(job_id, {'network': report})
+            print(f"🌐 {job_id}: {report['bytesSaved'] / 1024 ** 2:.1f} MB saved "
+                  f"({sum(report['blocked'].values())} blocked, {report['cacheHits']} from cache)")
+        except Exception as e:
+            print(f"⚠️ Failed to save network report of {job_id}: {e}")
 
-    def execute_job(self, job_id, job_data):
-        """Orchestrates the execution of a recipe."""
+    async def _run_browser_job(self, job_id, job_data):
+        """Orchestrates the execution of a recipe (browser lane)."""
         recipe_id = job_data.get('recipeId')
         variables = job_data.get('variables', {})
         
+        if not await asyncio.to_thread(self._mark_running, job_id):
+            await asyncio.to_thread(self._finish_cancelled, self.db.collection('agent_jobs').document(job_id))
+            return
         self.log(f"Starting Job {job_id} (Recipe: {recipe_id})", "info", "AGENT")
 
         # --- SPECIAL COMMAND: OPEN BROWSER ---
         if recipe_id == 'CMD_OPEN_BROWSER':
-             self.open_browser_session(self.project_id)
-             self.db.collection('agent_jobs').document(job_id).update({'status': 'COMPLETED', 'endTime': firestore.SERVER_TIMESTAMP})
+             await self.open_browser_session(job_data.get('profile') or self.current_project) # Extra accounts log in by profile name
+             await self._update_job(job_id, {'status': 'COMPLETED', 'endTime': firestore.SERVER_TIMESTAMP})
              return
              
         # --- SPECIAL COMMAND: RECORD ---
         if recipe_id == 'CMD_RECORD':
              target_recipe = job_data.get('targetRecipeId')
-             self.start_recording_session(self.project_id, target_recipe)
-             self.db.collection('agent_jobs').document(job_id).update({'status': 'COMPLETED', 'endTime': firestore.SERVER_TIMESTAMP})
+             await self.start_recording_session(self.current_project, target_recipe)
+             await self._update_job(job_id, {'status': 'COMPLETED', 'endTime': firestore.SERVER_TIMESTAMP})
              return
              
         # --- SPECIAL COMMAND: PLAY (NEW) ---
         if recipe_id == 'CMD_PLAY':
-             self.execute_playback_session(job_id, job_data)
+             await self.execute_playback_session(job_id, job_data)
+             return
+
+        # --- SPECIAL COMMAND: RUN BLOCK (scenes fanned out over tabs) ---
+        if recipe_id == 'CMD_RUN_BLOCK':
+             await self.run_block_session(job_id, job_data)
              return
-        
-        # --- SPECIAL COMMAND: STITCH VIDEO (FFmpeg) ---
-        if recipe_id == 'CMD_STITCH_VIDEO':
-            scene_files = job_data.get('sceneFiles', [])
-            output_path = job_data.get('outputPath', 'final.mp4')
-            success = self.stitch_videos(job_id, scene_files, output_path)
-            status = 'COMPLETED' if success else 'FAILED'
-            self.db.collection('agent_jobs').document(job_id).update({
-                'status': status,
-                'outputPath': output_path if success else None,
-                'endTime': firestore.SERVER_TIMESTAMP
-            })
-            return
         # -----------------------------------
         
-        # 1. Fetch Recipe
+        # 1. Fetch Recipe (compiled plan; no Firestore read when cached)
         try:
-            recipe_doc = self.db.collection('automation_recipes').document(recipe_id).get()
-            if not recipe_doc.exists:
-                raise Exception(f"Recipe {recipe_id} not found!")
-            recipe = recipe_doc.to_dict()
+            with span('load_recipe', recipeId=recipe_id):
+                plan = await asyncio.to_thread(self.recipe_cache.get, recipe_id)
+            use_policy(plan.resource_policy)
         except Exception as e:
             self.log(f"Failed to load recipe: {e}", "error", "AGENT")
-            self.db.collection('agent_jobs').document(job_id).update({'status': 'FAILED', 'error': str(e)})
+            await self._update_job(job_id, {'status': 'FAILED', 'error': str(e)})
             return
 
-        # 2. Launch Browser
-        profile_path = os.path.join(os.getcwd(), "profiles", self.project_id)
-        if not os.path.exists(profile_path):
-            os.makedirs(profile_path)
-
+        # 2. Borrow a page from the warm browser pool
         try:
-            with sync_playwright() as p:
-                print(f"🖥️  Launching Chrome Profile: {self.project_id}")
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir=profile_path,
-                    headless=False, # Always visible for demo
-                    args=["--start-maximized", "--disable-blink-features=AutomationControlled"],
-                    viewport=None
-                )
-                
-                page = browser.pages[0] if browser.pages else browser.new_page()
-                
-                # 3. Play Recipe Steps
-                success = self.play_recipe(page, recipe.get('steps', []), variables)
-                
-                # 4. Clean up
-                time.sleep(2)
-                browser.close()
+            async with self.browser_pool.lease(self._profile_path(self.current_project)) as page:
+                # 3. Play Recipe Steps (paced by page readiness, not fixed sleeps)
+                pacer = StepPacer.for_job(self.config, {'pacing': plan.pacing}, job_data)
+                checkpoints = await asyncio.to_thread(self.journal.checkpoints, job_id)
+                start = resume_point(plan.steps, checkpoints, lambda step: step.type == 'GOTO')
+                success = await self.play_recipe(page, plan, variables, pacer, start=start,
+                                                 on_step=lambda index: self._checkpoint(job_id, f"step:{index}"))
                 
+                # 4. Clean up (tab is closed on release, context stays warm)
                 status = 'COMPLETED' if success else 'FAILED'
-                self.db.collection('agent_jobs').document(job_id).update({
+                await self._update_job(job_id, {
                     'status': status, 
+                    'pacing': pacer.report(),
                     'endTime': firestore.SERVER_TIMESTAMP
                 })
-                self.log(f"Job finished: {status}", "success" if success else "error", "AGENT")
+                self.log(f"Job finished: {status} (pacing saved {pacer.report()['savedSeconds']}s)", "success" if success else "error", "AGENT")
 
         except Exception as e:
+            mark_error(e)
             print(f"❌ Critical Error: {e}")
             self.log(f"Critical Error: {e}", "error", "AGENT")
-            self.db.collection('agent_jobs').document(job_id).update({'status': 'FAILED', 'error': str(e)})
+            await self._update_job(job_id, {'status': 'FAILED', 'error': str(e)})
+
+    def execute_cpu_job(self, job_id, job_data, cancel_event=None):
+        """CPU lane entry point: runs the job scoped to its project."""
+        self._mark_first_job(job_id)
+        self._begin_journal(job_id, job_data)
+        with self._job_scope(job_data):
+            trace = JobTrace.for_job(self.config, job_id, job_data, job_type(job_data))
+            if trace is None:
+                self._run_cpu_job(job_id, job_data, cancel_event or threading.Event())
+            else:
+                try:
+                    with trace.activate():
+                        self._run_cpu_job(job_id, job_data, cancel_event or threading.Event())
+                finally:
+                    self._save_trace(job_id, trace)
+        self.journal.finish(job_id)
+
+    def _mark_first_job(self, job_id):
+        if STARTUP.mark('firstJob'):
+            print(f"⏱️ First job {job_id} started {STARTUP.phases['firstJob']}s after launch ({STARTUP.summary()})")
+
+    def _save_trace(self, job_id, trace):
+        """Writes the job's trace artifacts and puts a short summary (slowest steps) on the job document."""
+        try:
+            summary = trace.save()
+            self._set_job_fields(job_id, {'trace': summary})
+            print(f"🔬 Trace of {job_id} saved to {summary['dir']} ({summary['totalSeconds']}s)")
+        except Exception as e:
+            print(f"⚠️ Failed to save trace of {job_id}: {e}")
+
+    def _run_cpu_job(self, job_id, job_data, cancel_event):
+        """Runs a job that needs no browser (CPU lane, worker thread)."""
+        recipe_id = job_data.get('recipeId')
+        job_ref = self.db.collection('agent_jobs').document(job_id)
+        watch = None
+        if recipe_id == 'CMD_STITCH_VIDEO':
+            # Cancel as soon as the job document asks for it (cancelRequested or status CANCELLED).
+            # Watched before RUNNING is written, so a cancel in between is not missed.
+            def on_job_change(doc_snapshots, changes, read_time):
+                for doc in doc_snapshots:
+                    data = doc.to_dict() or {}
+                    if data.get('cancelRequested') or data.get('status') == 'CANCELLED':
+                        cancel_event.set()
+            watch = job_ref.on_snapshot(on_job_change)
+        try:
+            if not self._mark_running(job_id):
+                self._finish_cancelled(job_ref)
+                return
+            self.log(f"Starting Job {job_id} (Recipe: {recipe_id})", "info", "AGENT")
+            self._run_cpu_command(job_id, job_data, job_ref, cancel_event)
+        finally:
+            if watch:
+                watch.unsubscribe()
+
+    def _run_cpu_command(self, job_id, job_data, job_ref, cancel_event):
+        recipe_id = job_data.get('recipeId')
+
+        # --- SPECIAL COMMAND: STITCH VIDEO (FFmpeg) ---
+        if recipe_id == 'CMD_STITCH_VIDEO':
+            scene_files = job_data.get('sceneFiles', [])
+            output_path = job_data.get('outputPath', 'final.mp4')
+            success = self.stitch_videos(
+                job_id, scene_files, output_path,
+                cancel_event=cancel_event,
+                priority=job_data.get('priority', DEFAULT_TYPE_PRIORITIES['CMD_STITCH_VIDEO']),
+                on_progress=self._stitch_progress_writer(job_ref)
+            )
+
+            if cancel_event.is_set():
+                self._finish_cancelled(job_ref)
+                return
+            status = 'COMPLETED' if success else 'FAILED'
+            self._set_job_fields(job_id, {
+                'status': status,
+                'outputPath': output_path if success else None,
+                'endTime': firestore.SERVER_TIMESTAMP
+            })
+            return
+
+        # --- DIAGNOSTIC COMMAND: SLEEP (fleet / capacity testing) ---
+        if recipe_id == 'CMD_SLEEP':
+            time.sleep(float(job_data.get('seconds', 5)))
+            self._set_job_fields(job_id, {
+                'status': 'COMPLETED',
+                'completedBy': self.agent_id,
+                'endTime': firestore.SERVER_TIMESTAMP
+            })
+            return
+
+        self.log(f"Unknown CPU command: {recipe_id}", "error", "AGENT")
+        self._set_job_fields(job_id, {'status': 'FAILED', 'error': f"Unknown command {recipe_id}"})
+
+    def _stitch_progress_writer(self, job_ref):
+        """Progress callback that writes {stage, percent} to the job document, throttled."""
+        last = {'stage': None, 'percent': -100, 'time': 0.0}
+
+        def on_progress(stage, fraction):
+            percent = int(fraction * 100)
+            now = time.monotonic()
+            if stage == last['stage'] and (percent - last['percent'] < 5 or now - last['time'] < STITCH_PROGRESS_INTERVAL):
+                return
+            last.update(stage=stage, percent=percent, time=now)
+            try:
+                with firestore_call('job_progress'):
+                    job_ref.update({'progress': {'stage': stage, 'percent': percent}})
+            except Exception as e:
+                print(f"⚠️ Progress update failed: {e}")
+        return on_progress
 
-    def execute_playback_session(self, job_id, job_data):
+    def _finish_cancelled(self, job_ref):
+        """Marks a user-cancelled job CANCELLED. Lease-loss cancellations leave the job to the fleet."""
+        snapshot = job_ref.get()
+        data = snapshot.to_dict() or {}
+        if not (data.get('cancelRequested') or data.get('status') == 'CANCELLED'):
+            return
+        if data.get('leaseOwner') not in (None, self.agent_id):
+            return
+        self._set_job_fields(job_ref.id, {'status': 'CANCELLED', 'endTime': firestore.SERVER_TIMESTAMP})
+        self.log(f"Job {job_ref.id} cancelled", "info", "AGENT")
+
+    async def execute_playback_session(self, job_id, job_data):
         """Executes a sequence of steps directly from the job payload (CMD_PLAY)."""
         print(f"▶️ Starting Playback for Job: {job_id}")
         self.log(f"Starting Playback Session...", "info", "PLAYER")
@@ -242,155 +736,263 @@ class ContentAutoPostAgent:
         steps = job_data.get('steps', [])
         if not steps:
             print("⚠️ No steps found in playback job.")
-            self.db.collection('agent_jobs').document(job_id).update({'status': 'COMPLETED', 'error': 'No steps provided'})
+            await self._update_job(job_id, {'status': 'COMPLETED', 'error': 'No steps provided'})
             return
 
-        # Launch Browser
-        profile_path = os.path.join(os.getcwd(), "profiles", self.project_id)
-        if not os.path.exists(profile_path):
-            os.makedirs(profile_path)
-
+        # Borrow a page from the warm browser pool
         try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir=profile_path,
-                    headless=False,
-                    args=["--start-maximized", "--disable-blink-features=AutomationControlled"],
-                    viewport=None
-                )
-                
-                page = browser.pages[0] if browser.pages else browser.new_page()
-                
+            async with self.browser_pool.lease(self._profile_path(self.current_project)) as page:
+                pacer = StepPacer.for_job(self.config, job_data=job_data)
+                pacer.attach(page)
+                checkpoints = await asyncio.to_thread(self.journal.checkpoints, job_id)
+                start = resume_point(steps, checkpoints, lambda step: step.get('action') in ('navigate', 'goto'))
+                if start:
+                    print(f"⏩ Resuming playback at step {start + 1} of {len(steps)}")
+
                 # Execute Steps
                 for i, step in enumerate(steps):
+                    if i < start:
+                        continue
                     action = step.get('action')
                     selector = step.get('selector')
                     value = step.get('value', '') # For type/goto
                     
                     print(f"🔹 Step {i+1}: {action} -> {selector}")
+                    step_started = time.monotonic()
                     
-                    try:
-                        if action == 'click':
-                            # Use aggressive click (force=True if needed, but standard first)
-                            # Handle text= selectors that we generated
-                            page.wait_for_selector(selector, timeout=5000)
-                            page.click(selector)
+                    with span('step', action=action, selector=selector, label=value):
+                        try:
+                            if action == 'click':
+                                # Use aggressive click (force=True if needed, but standard first)
+                                # Handle text= selectors that we generated
+                                is_download = step.get('download', 'download' in (selector or '').lower())
+                                selector = await pacer.wait_actionable(page, selector, step.get('timeout'), step.get('candidates'))
+                                if is_download:
+                                    with download_step():
+                                        await page.click(selector)
+                                else:
+                                    await page.click(selector)
                         
-                        elif action == 'type':
-                            page.wait_for_selector(selector, timeout=5000)
-                            page.fill(selector, value)
+                            elif action == 'type':
+                                selector = await pacer.wait_actionable(page, selector, step.get('timeout'), step.get('candidates'))
+                                await page.fill(selector, value)
                             
-                        elif action == 'navigate' or action == 'goto':
-                            # Value here is the URL
-                            url = value if value else selector # Handle ambiguity
-                            page.goto(url)
+                            elif action == 'press':
+                                # Recorded special keys (Enter/Tab/Escape) go to the focused element
+                                await page.keyboard.press(value)
                             
-                        elif action == 'wait':
-                             time.sleep(float(value))
+                            elif action == 'navigate' or action == 'goto':
+                                # Value here is the URL
+                                url = value if value else selector # Handle ambiguity
+                                await page.goto(url)
+                            
+                            elif action == 'wait':
+                                 await asyncio.sleep(float(value))
 
-                        time.sleep(1) # Pace it out
+                            await pacer.after_step(page, 'navigate' if action in ('navigate', 'goto') else action)
+                            await self._checkpoint(job_id, f"step:{i}")
                         
-                    except Exception as step_e:
-                        print(f"❌ Step Failed: {step_e}")
-                        # Continue or break? Usually break on failure.
-                        # self.db.collection('agent_jobs').document(job_id).update({'status': 'FAILED', 'error': str(step_e)})
-                        # return
+                        except Exception as step_e:
+                            STEP_FAILURES.inc(action=action)
+                            mark_error(step_e)
+                            print(f"❌ Step Failed: {step_e}")
+                            # Continue or break? Usually break on failure.
+                            # self.db.collection('agent_jobs').document(job_id).update({'status': 'FAILED', 'error': str(step_e)})
+                            # return
+                        finally:
+                            STEP_SECONDS.observe(time.monotonic() - step_started, action=action)
                 
                 # Success
-                self.db.collection('agent_jobs').document(job_id).update({'status': 'COMPLETED', 'endTime': firestore.SERVER_TIMESTAMP})
+                await self._update_job(job_id, {'status': 'COMPLETED', 'pacing': pacer.report(), 'endTime': firestore.SERVER_TIMESTAMP})
                 print("✅ Playback Finished.")
-                self.log("Playback Finished Successfully.", "success", "PLAYER")
-                
-                time.sleep(2)
-                browser.close()
+                self.log(f"Playback Finished Successfully (pacing saved {pacer.report()['savedSeconds']}s).", "success", "PLAYER")
 
         except Exception as e:
+            mark_error(e)
             print(f"❌ Playback Error: {e}")
             self.log(f"Playback Failed: {e}", "error", "PLAYER")
-            self.db.collection('agent_jobs').document(job_id).update({'status': 'FAILED', 'error': str(e)})
+            await self._update_job(job_id, {'status': 'FAILED', 'error': str(e)})
+
+    def _load_block(self, job_data):
+        """Block definition of a CMD_RUN_BLOCK job: inline 'block', 'blockFile' in blocks/, or 'blockId' in global_recipe_blocks."""
+        if job_data.get('block'):
+            return job_data['block']
+        if job_data.get('blockFile'):
+            return load_block_file(job_data['blockFile'])
+        block_doc = self.db.collection('global_recipe_blocks').document(job_data.get('blockId', '')).get()
+        if not block_doc.exists:
+            raise Exception(f"Block {job_data.get('blockId')} not found!")
+        return block_doc.to_dict()
+
+    async def run_block_session(self, job_id, job_data):
+        """Runs a block file, splitting its scenes over several tabs of the project's browser context (CMD_RUN_BLOCK)."""
+        try:
+            block = await asyncio.to_thread(self._load_block, job_data)
+            use_policy(block.get('resourcePolicy'))
+        except Exception as e:
+            self.log(f"Failed to load block: {e}", "error", "BLOCK")
+            await self._update_job(job_id, {'status': 'FAILED', 'error': str(e)})
+            return
+
+        variables = job_data.get('variables', {})
+        scenes = normalize_scenes(job_data.get('scenes') or variables.get('scenes'))
+        width = job_data.get('parallelTabs', self.config.get('blocks', {}).get('parallelTabs', DEFAULT_PARALLEL_TABS))
+
+        site = job_data.get('site') or block.get('site') or site_of(block.get('startUrl'))
+        profile_paths = [self._profile_path(name) for name in self.quotas.profiles_for(self.current_project, job_data)]
+        downloads_config = self.config.get('downloads', {})
+        downloads_dir = downloads_config.get('dir', os.path.join(os.getcwd(), "downloads"))
+        collector = DownloadCollector(os.path.join(downloads_dir, job_id),
+                                      min_bytes=downloads_config.get('minBytes', 1024),
+                                      timeout=downloads_config.get('timeout', 120000),
+                                      on_saved=lambda index, info: self._checkpoint(job_id, f"scene:{index}", info))
+
+        # Resume: scenes whose file was saved before a restart are not generated again
+        checkpoints = await asyncio.to_thread(self.journal.checkpoints, job_id)
+        resumed = collector.restore({int(key.split(':')[1]): info for key, info in checkpoints.items()
+                                     if key.startswith('scene:')})
+        remaining = [scene for scene in scenes if scene['index'] not in resumed]
+
+        # Quotas: scenes are spread over the project's logged-in profiles by what each may still generate today
+        assignments, over_quota = self.quotas.plan(site, profile_paths, remaining, width)
+        shards = [(profile, shard) for profile, profile_scenes, tabs in assignments
+                  for shard in shard_scenes(profile_scenes, tabs)]
+        if not remaining and not resumed:
+            shards = [(profile_paths[0], [])]
+        used_profiles = list(dict.fromkeys(profile for profile, _ in shards))
+        self.log(f"Running block '{block.get('name', '?')}': {len(remaining)} scene(s) on {len(shards)} tab(s)"
+                 + (f" across {len(used_profiles)} profiles" if len(used_profiles) > 1 else '')
+                 + (f" ({len(resumed)} already downloaded)" if resumed else ''), "info", "BLOCK")
+        on_progress = self._block_progress_writer(self.db.collection('agent_jobs').document(job_id))
+        runners = [BlockRunner(block, StepPacer.for_job(self.config, block, job_data), self._block_log, tab, collector,
+                               on_progress, functools.partial(self.quotas.acquire, site, profile))
+                   for tab, (profile, _) in enumerate(shards)]
+
+        async def run_tab(runner, profile, shard):
+            with span('tab', tab=runner.tab, scenes=len(shard), profile=os.path.basename(profile)):
+                async with self.quotas.slot(site, profile), self.browser_pool.lease(profile) as page:
+                    return await runner.run(page, shard, variables)
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(run_tab(r, p, s) for r, (p, s) in zip(runners, shards)), return_exceptions=True)
+        for profile in used_profiles:
+            if profile != self._profile_path(self.current_project):  # That one is counted by execute_job
+                await self.browser_pool.job_finished(profile)
+
+        scene_report = [{'index': index, 'tab': None, 'seconds': None, 'status': 'COMPLETED', 'resumed': True}
+                        for index in sorted(resumed)]
+        errors = []
+        if over_quota:
+            errors.append(f"{len(over_quota)} scene(s) over today's quota on {site} for every profile")
+            scene_report += [{'index': scene['index'], 'tab': None, 'seconds': None, 'status': 'FAILED',
+                              'error': 'quota'} for scene in over_quota]
+        for tab, ((profile, shard), result) in enumerate(zip(shards, results)):
+            if isinstance(result, BaseException):
+                errors.append(str(result))
+                self.log(f"Block tab {tab} failed: {result}", "error", "BLOCK")
+            for scene in shard:
+                seconds = None if isinstance(result, BaseException) else result.get(scene['index'])
+                scene_report.append({'index': scene['index'], 'tab': tab, 'profile': os.path.basename(profile),
+                                     'seconds': seconds, 'status': 'COMPLETED' if seconds is not None else 'FAILED'})
+
+        scene_report.sort(key=lambda entry: entry['index'])
+
+        # Downloads: done as soon as the last file is saved; ordered by scene, not by arrival
+        update = {}
+        if collector.captured or resumed:
+            try:
+                scene_files = await collector.finish(scenes)
+                update['sceneFiles'] = scene_files
+                if job_data.get('stitch') or job_data.get('outputPath'):
+                    output_path = job_data.get('outputPath') or os.path.join(collector.job_dir, 'final.mp4')
+                    if await self.executor.run_cpu(self.stitch_videos, job_id, scene_files, output_path):
+                        update['outputPath'] = output_path
+                    else:
+                        errors.append("Stitching failed")
+            except DownloadError as e:
+                errors.append(str(e))
+                self.log(str(e), "error", "BLOCK")
+            update['downloads'] = collector.report()
+
+        status = 'FAILED' if errors else 'COMPLETED'
+        update.update({
+            'status': status,
+            'scenes': scene_report,
+            'wallSeconds': round(time.monotonic() - started, 2),
+            'pacing': merge_reports([r.pacer.report() for r in runners]),
+            'endTime': firestore.SERVER_TIMESTAMP
+        })
+        if errors:
+            update['error'] = '; '.join(errors)
+        await self._update_job(job_id, update)
+        self.log(f"Block finished: {status} in {update['wallSeconds']}s", "success" if not errors else "error", "BLOCK")
+
+    def _block_progress_writer(self, job_ref):
+        """Progress callback of a block job's tabs: writes every tab's percentages to the job document, throttled.
+
+        Called on the event loop by the page observer, so the write goes to a
+        thread and is skipped while the previous one is still in flight.
+        """
+        tabs = {}
+        last = {'percent': -100, 'time': 0.0, 'task': None}
+
+        def write(progress):
+            try:
+                with firestore_call('job_progress'):
+                    job_ref.update({'progress': progress})
+            except Exception as e:
+                print(f"⚠️ Progress update failed: {e}")
+
+        def on_progress(tab, values):
+            tabs[str(tab)] = [round(value) for value in values]
+            everything = [value for tab_values in tabs.values() for value in tab_values]
+            percent = int(sum(everything) / len(everything))
+            now = time.monotonic()
+            if last['task'] and not last['task'].done():
+                return
+            if percent - last['percent'] < 5 and now - last['time'] < BLOCK_PROGRESS_INTERVAL:
+                return
+            last.update(percent=percent, time=now)
+            progress = {'stage': 'generate', 'percent': percent, 'tabs': dict(tabs)}
+            last['task'] = asyncio.ensure_future(asyncio.to_thread(write, progress))
+        return on_progress
 
-    def start_recording_session(self, project_id, target_recipe_id):
+    def _block_log(self, message):
+        self.log(message, "info", "BLOCK")
+
+    async def start_recording_session(self, project_id, target_recipe_id):
         """Launches the browser with event listeners to record User Actions."""
         print(f"🎥 Starting Recorder for Recipe: {target_recipe_id}")
         self.log(f"Recording actions for {target_recipe_id}...", "info", "RECORDER")
         
-        recorded_steps = []
-        
-        # DEBUG: Use a temp profile to rule out corruption
-        profile_path = os.path.join(os.getcwd(), "profiles", "TEMP_DEBUG_PROFILE") 
-        if os.path.exists(profile_path):
-             try:
-                 shutil.rmtree(profile_path)
-             except:
-                 pass
-        os.makedirs(profile_path, exist_ok=True)
+        # DEBUG: Use a temp profile to rule out corruption (a template clone, deleted afterwards)
+        profile_path = await asyncio.to_thread(self.profiles.create_temp, 'recorder')
 
         print(f"🐛 DEBUG: Profile Path = {profile_path}")
             
         try:
-            with sync_playwright() as p:
-                print("🐛 DEBUG: Calling launch_persistent_context...")
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir=profile_path,
-                    headless=False,
-                    args=["--start-maximized", "--disable-blink-features=AutomationControlled"],
-                    viewport=None
-                )
-                
-                page = browser.pages[0] if browser.pages else browser.new_page()
+            # Not pooled: the spy script and exposed function must not leak into job contexts
+            print("🐛 DEBUG: Calling launch_persistent_context...")
+            browser = await self.browser_pool.launch(profile_path, headless=False)
+            recorder = None
+            try:
+                page = browser.pages[0] if browser.pages else await browser.new_page()
 
-                # --- 1. DEFINE PYTHON HANDLER ---
-                def py_record_step(payload):
-                    """Callback function executing in Python when JS triggers it."""
-                    print(f"⚡ [RECORDER] Action: {payload.get('action')} on {payload.get('selector')}")
-                    try:
-                        # Update Firestore
-                        self.db.collection('automation_recipes').document(target_recipe_id).update({
-                            'steps': firestore.ArrayUnion([payload]),
-                            'updatedAt': firestore.SERVER_TIMESTAMP
-                        })
-                    except Exception as e:
-                        print(f"🔥 Firestore Error: {e}")
+                # --- 1. PYTHON SIDE BUFFER (merges events, writes ordered steps in batches) ---
+                recorder = RecipeRecorder(self.db, target_recipe_id)
+                await recorder.start()
 
                 # --- 2. EXPOSE TO CONTEXT (Global for all tabs) ---
                 # NOTE: 'browser' here is actually the PersistentContext object
-                browser.expose_function("py_record_step", py_record_step)
-
-                # --- 3. INJECT SCRIPT ON CONTEXT (Runs on every new page/tab) ---
-                js_spy_code = """
-                console.log("%c 🕵️ AGGRESSIVE SPY STARTED ", "background: red; color: white; font-size: 16px");
+                await browser.expose_function("py_record_steps", recorder.on_page_events)
 
-                // Use 'mousedown' in Capture Phase (true) to catch events BEFORE the web app eats them
-                document.addEventListener('mousedown', (e) => {
-                    const target = e.target;
-                    
-                    // Fallback Selector Logic
-                    let selector = target.id ? '#' + target.id : target.tagName.toLowerCase();
-                    
-                    // Try to get ANY identifier
-                    if (target.getAttribute('aria-label')) selector += `[aria-label="${target.getAttribute('aria-label')}"]`;
-                    else if (target.innerText) selector += ` (text="${target.innerText.substring(0,20).replace(/\\n/g, '')}...")`;
-                    else if (target.className) selector += `.${target.className.split(' ')[0]}`;
-
-                    console.log("🖱️ Mousedown detected:", selector);
-
-                    // Send to Python
-                    if (window.py_record_step) {
-                        window.py_record_step({
-                            action: 'click', // We record it as click for the UI
-                            selector: selector,
-                            description: `User clicked ${selector}`,
-                            timestamp: Date.now()
-                        });
-                    }
-                }, true); // <--- TRUE is critical (Capture Phase)
-                """
-                browser.add_init_script(js_spy_code)
+                # --- 3. INJECT SCRIPT ON CONTEXT (Runs on every new page/tab, buffers in the page) ---
+                await browser.add_init_script(RECORDER_JS)
                 print("✅ Recorder is armed and ready on Browser Context.")
                 
                 # Navigate AFTER injection setup
-                page = browser.pages[0] if browser.pages else browser.new_page()
-                page.goto("https://www.google.com")
+                page = browser.pages[0] if browser.pages else await browser.new_page()
+                await page.goto("https://www.google.com")
                 print("✅ Recorder System: READY. Please interact with the browser.")
                 
                 # --- 4. KEEP ALIVE ---
@@ -402,44 +1004,44 @@ class ContentAutoPostAgent:
                                 break
                         except Exception:
                             break
-                        time.sleep(1)
+                        await asyncio.sleep(1)
                 except Exception as e:
                     print(f"👋 Browser wait error: {e}")
 
+            finally:
+                # --- 5. FINAL FLUSH (also when the session dies) ---
+                if recorder:
+                    await recorder.close()
+                    self.log(f"Recorded {recorder.buffer.stats['written']} step(s) for {target_recipe_id}", "success", "RECORDER")
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+                self.profiles.discard(profile_path)
+
         except Exception as e:
             print(f"❌ Recorder Error: {e}")
             self.log(f"Recorder Error: {e}", "error", "RECORDER")
 
-    def open_browser_session(self, project_id):
+    async def open_browser_session(self, project_id):
         """Launches the browser in non-automated mode for manual login/maintenance."""
         print(f"🔓 Opening Session Manager for Project: {project_id}")
         self.log("Opening Browser for Manual Login...", "info", "SESSION_MANAGER")
         
-        profile_path = os.path.join(os.getcwd(), "profiles", project_id)
-        if not os.path.exists(profile_path):
-            os.makedirs(profile_path)
-            
         try:
-            with sync_playwright() as p:
+            # Shares the pooled context: the profile dir can only be open once (relaunched headed if needed)
+            async with self.browser_pool.lease(self._profile_path(project_id), headed=True) as page:
                 print("🖥️  Browser Launched. Please Log In manually now.")
                 print("⏳ Keeping window open for 10 minutes (or until you close it)...")
                 
-                # Launch with NO sandbox, persistent context
-                browser = p.chromium.launch_persistent_context(
-                    user_data_dir=profile_path,
-                    headless=False,
-                    args=["--start-maximized", "--no-sandbox", "--disable-infobars"],
-                    viewport=None
-                )
-                
-                page = browser.pages[0] if browser.pages else browser.new_page()
-                page.goto("https://www.google.com") # Landing page
+                await page.bring_to_front()
+                await page.goto("https://www.google.com") # Landing page
                 
                 # Wait loop
                 start_time = time.time()
                 while time.time() - start_time < 600: # 10 mins
-                    time.sleep(1)
-                    if not browser.pages: # If use closed all pages
+                    await asyncio.sleep(1)
+                    if page.is_closed(): # If user closed the login tab
                         break
                         
                 print("🔒 Session Manager Closed.")
@@ -449,10 +1051,14 @@ class ContentAutoPostAgent:
             print(f"❌ Session Error: {e}")
             self.log(f"Session Error: {e}", "error", "SESSION_MANAGER")
     
-    def stitch_videos(self, job_id: str, scene_files: list, output_path: str) -> bool:
-        """Use FFmpeg to concatenate scene video files into a single video."""
-        import subprocess
-        
+    def stitch_videos(self, job_id: str, scene_files: list, output_path: str,
+                      cancel_event=None, priority=None, on_progress=None) -> bool:
+        """Use FFmpeg to concatenate scene video files into a single video.
+
+        Scenes are probed in parallel and only the ones that do not match the
+        majority layout are re-encoded before the stream-copy concat. Every
+        ffmpeg process waits for a slot in the stitcher's shared pool.
+        """
         if not scene_files:
             self.log("❌ No scene files provided for stitching", "error", "FFMPEG")
             return False
@@ -460,56 +1066,39 @@ class ContentAutoPostAgent:
         self.log(f"🎬 Starting video stitch: {len(scene_files)} scenes → {output_path}", "info", "FFMPEG")
         print(f"🎬 [FFMPEG] Stitching {len(scene_files)} scene files...")
         
-        try:
-            # 1. Validate all files exist
-            for sf in scene_files:
-                if not os.path.exists(sf):
-                    self.log(f"❌ Scene file not found: {sf}", "error", "FFMPEG")
-                    return False
-            
-            # 2. Create concat list file in same directory as first scene
-            list_file = os.path.join(os.path.dirname(scene_files[0]), 'concat_list.txt')
-            with open(list_file, 'w', encoding='utf-8') as f:
-                for sf in scene_files:
-                    # Use forward slashes for FFmpeg compatibility
-                    safe_path = sf.replace('\\', '/')
-                    f.write(f"file '{safe_path}'\n")
-            
-            print(f"📝 Created concat list: {list_file}")
-            
-            # 3. Run FFmpeg concat
-            cmd = [
-                'ffmpeg', '-y',           # Overwrite output
-                '-f', 'concat',           # Concatenation mode
-                '-safe', '0',             # Allow any file paths
-                '-i', list_file,          # Input list
-                '-c', 'copy',             # Copy streams without re-encoding (fast!)
-                output_path
-            ]
-            
-            print(f"🔧 Running: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0:
-                self.log(f"✅ Video stitched successfully: {output_path}", "success", "FFMPEG")
-                print(f"✅ [FFMPEG] Success! Output: {output_path}")
-                
-                # Cleanup temp concat list
-                try:
-                    os.remove(list_file)
-                except:
-                    pass
-                
-                return True
-            else:
-                error_msg = result.stderr[:500] if result.stderr else "Unknown error"
-                self.log(f"❌ FFmpeg Error: {error_msg}", "error", "FFMPEG")
-                print(f"❌ [FFMPEG] Error: {error_msg}")
+        # 1. Validate all files exist
+        for sf in scene_files:
+            if not os.path.exists(sf):
+                self.log(f"❌ Scene file not found: {sf}", "error", "FFMPEG")
                 return False
-                
-        except subprocess.TimeoutExpired:
-            self.log("❌ FFmpeg timed out (5 min limit)", "error", "FFMPEG")
-            print("❌ [FFMPEG] Timeout!")
+
+        reported = {}
+        def progress(stage, fraction):
+            # Log every 10%
+            if int(fraction * 10) > reported.get(stage, 0):
+                reported[stage] = int(fraction * 10)
+                print(f"⏳ [FFMPEG] {stage.capitalize()} {reported[stage] * 10}%")
+            if on_progress:
+                on_progress(stage, fraction)
+
+        try:
+            # 2. Probe → re-encode outliers → stream-copy concat (no fixed timeout, stall detection instead)
+            with span('stitch', scenes=len(scene_files)):
+                summary = self.stitcher.stitch(scene_files, output_path,
+                                               log=lambda msg: self.log(msg, "info", "FFMPEG"),
+                                               on_progress=progress, job_id=job_id, cancel_event=cancel_event,
+                                               priority=priority if priority is not None else DEFAULT_TYPE_PRIORITIES['CMD_STITCH_VIDEO'])
+            self.log(f"✅ Video stitched successfully: {output_path} ({'cached, ' if summary['cached'] else ''}"
+                     f"{summary['reencoded']} re-encoded, {summary['elapsedSeconds']}s)", "success", "FFMPEG")
+            print(f"✅ [FFMPEG] Success! Output: {output_path}")
+            return True
+
+        except StitchCancelled:
+            self.log("🚫 Stitch cancelled", "info", "FFMPEG")
+            return False
+        except StitchError as e:
+            self.log(f"❌ FFmpeg Error: {str(e)[:500]}", "error", "FFMPEG")
+            print(f"❌ [FFMPEG] Error: {e}")
             return False
         except FileNotFoundError:
             self.log("❌ FFmpeg not installed! Please install FFmpeg.", "error", "FFMPEG")
@@ -520,89 +1109,112 @@ class ContentAutoPostAgent:
             print(f"❌ [FFMPEG] Exception: {e}")
             return False
 
-    def play_recipe(self, page, steps, variables):
-        """Iterates through steps and executes them."""
-        # Sort steps by order just in case
-        steps.sort(key=lambda x: x.get('order', 0))
-        
-        for step in steps:
-            step_type = step.get('type')
-            value = step.get('value', '')
-            
-            # Variable Substitution
-            # If value is like "{{prompt}}", replace it
-            if "{{" in value and "}}" in value:
-                for key, val in variables.items():
-                    value = value.replace(f"{{{{{key}}}}}", str(val))
+    async def play_recipe(self, page, plan, variables, pacer=None, start=0, on_step=None):
+        """Iterates through the steps of a compiled recipe plan (from index `start`) and executes them."""
+        pacer = pacer or StepPacer.for_job(self.config, {'pacing': plan.pacing})
+        pacer.attach(page)
+
+        missing = plan.variables - set(variables)
+        if missing:
+            self.log(f"Recipe variables not provided: {', '.join(sorted(missing))}", "warning", "AGENT")
+
+        if start:
+            print(f"⏩ Resuming at step {start + 1} of {len(plan.steps)}")
+
+        # Steps are pre-sorted and their {{var}} templates pre-parsed
+        for index, step in enumerate(plan.steps):
+            if index < start:
+                continue
+            step_type = step.type
+            value = render_template(step.template, variables)
             
             print(f"▶️ Performing: {step_type} -> {value}")
             self.log(f"Step: {step_type}", "info", "AGENT")
+            step_started = time.monotonic()
 
-            try:
-                if step_type == 'GOTO':
-                    page.goto(value)
-                    page.wait_for_load_state("domcontentloaded")
+            with span('step', action=step_type, label=value):
+                try:
+                    if step_type == 'GOTO':
+                        await page.goto(value)
                 
-                elif step_type == 'CLICK_SELECTOR':
-                    page.wait_for_selector(value, timeout=10000)
-                    page.click(value)
+                    elif step_type == 'CLICK_SELECTOR':
+                        is_download = step.raw.get('download', 'download' in value.lower())
+                        value = await pacer.wait_actionable(page, value, candidates=step.raw.get('candidates'))
+                        if is_download:
+                            with download_step():
+                                await page.click(value)
+                        else:
+                            await page.click(value)
                 
-                elif step_type == 'TYPE':
-                    # Using keyboard.type for more natural typing if needed, or fill
-                    # Assuming prev action focused, or we need a selector? 
-                    # For simplicity, let's assume 'value' is just text and we type into active element
-                    # OR if the recipe schema supports 'target' separate from 'value'
-                    # Currently schema is just 'value'. Let's assume TYPE value types into focused element.
-                    page.keyboard.type(value)
+                    elif step_type == 'TYPE':
+                        # Using keyboard.type for more natural typing if needed, or fill
+                        # Assuming prev action focused, or we need a selector? 
+                        # For simplicity, let's assume 'value' is just text and we type into active element
+                        # OR if the recipe schema supports 'target' separate from 'value'
+                        # Currently schema is just 'value'. Let's assume TYPE value types into focused element.
+                        await page.keyboard.type(value, delay=pacer.type_delay)
                 
-                elif step_type == 'SLEEP':
-                    time.sleep(float(value))
+                    elif step_type == 'SLEEP':
+                        await asyncio.sleep(float(value))
                     
-                elif step_type == 'WAIT_UNTIL':
-                    # Value might be "TEXT_VISIBLE:Generating"
-                    # or schema needs refinement. Let's parse value.
-                    # Simple version: Wait for selector
-                    page.wait_for_selector(value, timeout=30000)
+                    elif step_type == 'WAIT_UNTIL':
+                        # Value might be "TEXT_VISIBLE:Generating"
+                        # or schema needs refinement. Let's parse value.
+                        # Simple version: Wait for selector
+                        await pacer.wait_actionable(page, value, 30000, step.raw.get('candidates'))
 
-                time.sleep(1) # Small buffer between steps
+                    # Move on once the page is ready (navigation committed, network quiet, DOM stable)
+                    await pacer.after_step(page, 'navigate' if step_type == 'GOTO' else step_type)
+                    if on_step:
+                        await on_step(index)
                 
-            except Exception as e:
-                print(f"❌ Step Failed ({step_type}): {e}")
-                self.log(f"Step Failed: {e}", "error", "AGENT")
-                return False
+                except Exception as e:
+                    STEP_FAILURES.inc(action=step_type)
+                    mark_error(e)
+                    print(f"❌ Step Failed ({step_type}): {e}")
+                    self.log(f"Step Failed: {e}", "error", "AGENT")
+                    return False
+                finally:
+                    STEP_SECONDS.observe(time.monotonic() - step_started, action=step_type)
                 
         return True
 
 if __name__ == "__main__":
-    CONFIG_FILE = "agent_config.json"
+    import argparse
     import json
+
+    parser = argparse.ArgumentParser(description="Content Auto Post desktop agent")
+    parser.add_argument('--config', default="agent_config.json", help="Path to the agent config file")
+    parser.add_argument('--agent-id', help="Lease owner id (needed when several agents run on one machine)")
+    args = parser.parse_args()
+    CONFIG_FILE = args.config
     
     if os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, 'r') as f:
             config = json.load(f)
+        if args.agent_id:
+            config['agentId'] = args.agent_id
             
-        print(f"✅ Agent Initialized for User: {config.get('uid')} | Project: {config.get('project_id')}")
+        agent = ContentAutoPostAgent(config.get('uid'), config.get('project_id'), config)
         
-        agent = ContentAutoPostAgent(config.get('uid'), config.get('project_id'))
+        # Start Executor (browser lane thread + CPU pool)
+        agent.executor.start()
+        STARTUP.mark('executor')
         
-        # Start Listener (Background Thread)
+        # Listener (Background Thread) first, then warm Chromium while we pick up jobs claimed before a restart
         agent.start_listener()
+        agent.start_prewarm()
+        agent.adopt_claimed_jobs()
+        agent.start_metrics()
         
         # --- MAIN THREAD LOOP ---
-        # Crucial for Playwright on Windows: GUI operations must run on Main Thread
+        # The listener claims jobs and feeds the executor; the main thread only waits for Ctrl+C
         print("🎧 Waiting for jobs... (Press Ctrl+C to stop)")
         try:
             while True:
-                try:
-                    # Check for new jobs every 1s
-                    job_data = agent.job_queue.get(timeout=1)
-                    agent.execute_job(job_data['job_id'], job_data['data'])
-                    agent.job_queue.task_done()
-                except queue.Empty:
-                    pass
-                except KeyboardInterrupt:
-                    raise
+                time.sleep(1)
         except KeyboardInterrupt:
+            agent.shutdown()
             print("\n🛑 Agent stopped.")
             
     else:
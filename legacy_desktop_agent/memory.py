@@ -0,0 +1,207 @@
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+from stitcher import available_memory_mb
+
+# --- CONFIGURATION ---
+DEFAULT_SAMPLE_INTERVAL = 15   # Seconds between memory samples
+DEFAULT_TIMELINE = 240         # Samples kept in memory and in the timeline file (an hour at the default interval)
+DEFAULT_TIMELINE_PATH = os.path.join(os.getcwd(), "state", "memory.json")
+DEFAULT_MAX_TOTAL_MB = 6000    # Agent + driver + browsers RSS that counts as memory pressure (0 = off)
+DEFAULT_MIN_AVAILABLE_MB = 1000  # Free system memory below this counts as memory pressure (0 = off)
+DEFAULT_CONTEXT_MB = 1500      # A context whose process tree grows past this is recycled after its job (0 = off)
+DEFAULT_RECYCLE_AFTER_JOBS = 50  # Jobs a context serves before it is recycled (0 = never)
+RECOVER_RATIO = 0.85           # Pressure ends once usage is back under this share of the limit
+DEFAULT_MAX_LEASE_WAIT = 600   # Seconds a browser lease waits out memory pressure before its job fails
+DRIVER_NAMES = ('node', 'playwright')  # The Playwright driver process; every other child is Chromium
+MB = 1024 ** 2
+
+
+def _psutil():
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        return None
+
+
+def _user_data_dir(cmdline):
+    for arg in cmdline:
+        if arg.startswith('--user-data-dir='):
+            return os.path.normcase(os.path.abspath(arg.split('=', 1)[1]))
+    return None
+
+
+def measure(profiles=()):
+    """RSS in MB of the agent, the Playwright driver, all Chromium processes and each profile's process tree.
+
+    Returns None without psutil. RSS counts pages shared between Chromium
+    processes more than once, so totals are an upper bound; what matters for
+    tuning is how they grow.
+    """
+    psutil = _psutil()
+    if psutil is None:
+        return None
+    agent = psutil.Process()
+    rss = {}
+    names = {}
+    children = agent.children(recursive=True)
+    for proc in children:
+        try:
+            rss[proc.pid] = proc.memory_info().rss
+            names[proc.pid] = proc.name().lower()
+        except psutil.Error:
+            pass
+
+    driver = sum(size for pid, size in rss.items() if any(n in names[pid] for n in DRIVER_NAMES))
+    wanted = {os.path.normcase(os.path.abspath(path)): path for path in profiles}
+    contexts = {}
+    for proc in children:
+        if proc.pid not in rss or any(n in names[proc.pid] for n in DRIVER_NAMES):
+            continue
+        try:
+            profile = wanted.get(_user_data_dir(proc.cmdline()))
+            if profile is None or profile in contexts:
+                continue  # Renderers and helpers are counted under their browser process
+            tree = rss[proc.pid] + sum(rss.get(child.pid, 0) for child in proc.children(recursive=True))
+        except psutil.Error:
+            continue
+        contexts[profile] = round(tree / MB)
+
+    return {
+        'agentMB': round(agent.memory_info().rss / MB),
+        'driverMB': round(driver / MB),
+        'browserMB': round((sum(rss.values()) - driver) / MB),
+        'contexts': contexts,
+    }
+
+
+class MemoryPressureError(Exception):
+    """A browser lease waited `maxLeaseWait` seconds and memory did not recover."""
+
+
+class MemoryWatchdog:
+    """Samples the memory of the agent, its driver and its browsers, and decides when to intervene.
+
+    The browser pool runs the sampling loop (see BrowserPool._watch_memory)
+    and acts on the verdicts: while `pressure` is set it refuses new leases,
+    and it recycles contexts that `oversized()` names once their job is
+    done. Samples form a timeline (heartbeat, /metrics, the timeline file)
+    for tuning the limits.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, timeline=DEFAULT_TIMELINE, path=DEFAULT_TIMELINE_PATH,
+                 max_total_mb=DEFAULT_MAX_TOTAL_MB, min_available_mb=DEFAULT_MIN_AVAILABLE_MB,
+                 context_mb=DEFAULT_CONTEXT_MB, recycle_after_jobs=DEFAULT_RECYCLE_AFTER_JOBS,
+                 max_lease_wait=DEFAULT_MAX_LEASE_WAIT):
+        self.interval = interval
+        self.path = path
+        self.max_total_mb = max_total_mb
+        self.min_available_mb = min_available_mb
+        self.context_mb = context_mb
+        self.recycle_after_jobs = recycle_after_jobs
+        self.max_lease_wait = max_lease_wait
+        self.timeline = collections.deque(maxlen=timeline)
+        self.pressure = False
+        self.stats = {'samples': 0, 'pressureEvents': 0, 'peakTotalMB': 0, 'leasesRefused': 0}
+        self._lock = threading.Lock()
+        if _psutil() is None:
+            print("⚠️ psutil is not installed (see requirements.txt): the memory watchdog only sees free "
+                  "system memory, and nothing at all on Windows.")
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a watchdog from the 'memory' section of agent_config.json (None if disabled)."""
+        memory_config = config.get('memory', {})
+        if memory_config.get('enabled', True) is False:
+            return None
+        return cls(
+            interval=memory_config.get('sampleInterval', DEFAULT_SAMPLE_INTERVAL),
+            timeline=memory_config.get('timeline', DEFAULT_TIMELINE),
+            path=memory_config.get('timelinePath', DEFAULT_TIMELINE_PATH),
+            max_total_mb=memory_config.get('maxTotalMB', DEFAULT_MAX_TOTAL_MB),
+            min_available_mb=memory_config.get('minAvailableMB', DEFAULT_MIN_AVAILABLE_MB),
+            context_mb=memory_config.get('contextMB', DEFAULT_CONTEXT_MB),
+            recycle_after_jobs=memory_config.get('recycleAfterJobs', DEFAULT_RECYCLE_AFTER_JOBS),
+            max_lease_wait=memory_config.get('maxLeaseWait', DEFAULT_MAX_LEASE_WAIT),
+        )
+
+    def sample(self, profiles=()):
+        """Takes one sample (blocking: run it off the event loop), updates `pressure` and the timeline."""
+        usage = measure(profiles) or {}
+        available = available_memory_mb()
+        sample = {'time': round(time.time()), **usage,
+                  'availableMB': round(available) if available is not None else None}
+        if usage:
+            sample['totalMB'] = usage['agentMB'] + usage['driverMB'] + usage['browserMB']
+
+        total = sample.get('totalMB')
+        over = ((self.max_total_mb and total is not None and total >= self.max_total_mb)
+                or (self.min_available_mb and available is not None and available < self.min_available_mb))
+        recovered = ((not self.max_total_mb or total is None or total < self.max_total_mb * RECOVER_RATIO)
+                     and (not self.min_available_mb or available is None
+                          or available * RECOVER_RATIO > self.min_available_mb))
+        with self._lock:
+            if over and not self.pressure:
+                self.pressure = True
+                self.stats['pressureEvents'] += 1
+                print(f"🧠 Memory pressure (agent tree {total} MB, {sample['availableMB']} MB free): "
+                      "new browser leases wait, contexts are recycled.")
+            elif self.pressure and recovered:
+                self.pressure = False
+                print(f"🧠 Memory recovered (agent tree {total} MB, {sample['availableMB']} MB free).")
+            sample['pressure'] = self.pressure
+            self.stats['samples'] += 1
+            self.stats['peakTotalMB'] = max(self.stats['peakTotalMB'], total or 0)
+            self.timeline.append(sample)
+            timeline = list(self.timeline)
+        self._save(timeline)
+        return sample
+
+    def _save(self, timeline):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            partial = self.path + '.partial'
+            with open(partial, 'w', encoding='utf-8') as f:
+                json.dump(timeline, f)
+            os.replace(partial, self.path)
+        except OSError as e:
+            print(f"⚠️ Failed to save memory timeline: {e}")
+
+    def oversized(self, sample):
+        """Profiles whose context has outgrown `context_mb`."""
+        if not self.context_mb:
+            return []
+        return [profile for profile, mb in sample.get('contexts', {}).items() if mb > self.context_mb]
+
+    def latest(self):
+        with self._lock:
+            return self.timeline[-1] if self.timeline else {}
+
+    def snapshot(self):
+        """Latest sample and counters for the heartbeat document."""
+        latest = dict(self.latest())
+        latest['contexts'] = len(latest.get('contexts', {}))
+        with self._lock:
+            return {**latest, **self.stats, 'pressure': self.pressure}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the memory timeline written by the running agent")
+    parser.add_argument('--file', default=DEFAULT_TIMELINE_PATH)
+    parser.add_argument('--last', type=int, default=40, help="Samples to show")
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        samples = json.load(f)[-args.last:]
+    print(f"{'time':<9} {'agent':>7} {'driver':>7} {'browser':>8} {'total':>7} {'free':>7}  contexts")
+    for s in samples:
+        contexts = ', '.join(f"{os.path.basename(p)} {mb}" for p, mb in s.get('contexts', {}).items())
+        print(f"{time.strftime('%H:%M:%S', time.localtime(s['time'])):<9} {s.get('agentMB', '-'):>7} "
+              f"{s.get('driverMB', '-'):>7} {s.get('browserMB', '-'):>8} {s.get('totalMB', '-'):>7} "
+              f"{s.get('availableMB') or '-':>7}  {contexts}{'  PRESSURE' if s.get('pressure') else ''}")
@@ -0,0 +1,252 @@
+import bisect
+import collections
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURATION ---
+DEFAULT_PORT = 9464            # Prometheus exporter convention for "other" exporters
+DEFAULT_HOST = '127.0.0.1'     # Local only; the agent runs on a desktop
+THROUGHPUT_WINDOW = 300        # Seconds of finished jobs used for jobs/min in the heartbeat
+# Latency buckets (seconds) from a Firestore write up to a long ffmpeg run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] += amount
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block (also around awaits)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self):
+        """count, avg and bucket-estimated p95 over all label sets."""
+        with self._lock:
+            counts = [0] * (len(self.buckets) + 1)
+            total = 0.0
+            for series in self._series.values():
+                counts = [a + b for a, b in zip(counts, series['counts'])]
+                total += series['sum']
+        count = sum(counts)
+        if not count:
+            return {'count': 0}
+        seen, p95 = 0, None
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            seen += bucket_count
+            if seen >= 0.95 * count:
+                p95 = bound if bound != float('inf') else self.buckets[-1]
+                break
+        return {'count': count, 'avg': round(total / count, 3), 'p95': p95}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), series['counts']):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [le])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time from a callback returning a number or {label value: number}."""
+
+    def __init__(self, name, help_text, callback, labelname=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for label, number in sorted(value.items()):
+                lines.append(f'{self.name}{{{self.labelname}="{label}"}} {number:g}')
+        elif value is not None:
+            lines.append(f"{self.name} {value:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process counters, histograms and gauges with a Prometheus text endpoint.
+
+    Modules import the shared METRICS registry and record into it; the agent
+    serves it over HTTP and attaches `summary()` to every heartbeat.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._finished = collections.deque()  # Completion times for the throughput window
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, callback, labelname=None):
+        """(Re)binds a gauge callback; later calls replace the earlier one."""
+        gauge = Gauge(name, help_text, callback, labelname)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def job_finished(self):
+        now = time.monotonic()
+        with self._lock:
+            self._finished.append(now)
+            while self._finished and now - self._finished[0] > THROUGHPUT_WINDOW:
+                self._finished.popleft()
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Compact numbers for the heartbeat document."""
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._finished if now - t <= THROUGHPUT_WINDOW)
+            metrics = dict(self._metrics)
+        summary = {'jobsPerMinute': round(recent * 60 / THROUGHPUT_WINDOW, 2)}
+        for name, metric in metrics.items():
+            short = name.replace('agent_', '', 1)
+            if isinstance(metric, Histogram):
+                summary[short] = metric.summary()
+            elif isinstance(metric, Counter):
+                summary[short] = metric.total()
+        return summary
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Starts the /metrics HTTP endpoint on a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would flood the console
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"⚠️ Metrics endpoint not started on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"📈 Metrics on http://{host}:{port}/metrics")
+        return self._server
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+
+
+METRICS = MetricsRegistry()
+
+# Shared instruments (recorded from several modules)
+JOBS_FINISHED = METRICS.counter('agent_jobs_finished_total', 'Jobs that left the executor', ('type', 'outcome'))
+JOB_STATUS = METRICS.counter('agent_job_status_total', 'Final job statuses written to agent_jobs', ('status',))
+JOB_SECONDS = METRICS.histogram('agent_job_seconds', 'Job run time', ('type', 'lane'))
+JOB_QUEUE_SECONDS = METRICS.histogram('agent_job_queue_seconds', 'Time from queued to started', ('lane',))
+STEP_SECONDS = METRICS.histogram('agent_step_seconds', 'Recipe/block step time including pacing', ('action',))
+STEP_FAILURES = METRICS.counter('agent_step_failures_total', 'Failed recipe/block steps', ('action',))
+BROWSER_LAUNCH_SECONDS = METRICS.histogram('agent_browser_launch_seconds', 'Chromium persistent context launch time')
+FIRESTORE_SECONDS = METRICS.histogram('agent_firestore_seconds', 'Firestore call latency', ('op',))
+FIRESTORE_ERRORS = METRICS.counter('agent_firestore_errors_total', 'Failed Firestore calls', ('op',))
+FFMPEG_SECONDS = METRICS.histogram('agent_ffmpeg_seconds', 'ffmpeg/ffprobe process run time', ('kind',))
+FFMPEG_FAILURES = METRICS.counter('agent_ffmpeg_failures_total', 'ffmpeg runs that failed, stalled or were cancelled', ('kind',))
+
+
+@contextlib.contextmanager
+def firestore_call(op):
+    """Times a Firestore call under `op` and counts it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        FIRESTORE_ERRORS.inc(op=op)
+        raise
+    finally:
+        FIRESTORE_SECONDS.observe(time.perf_counter() - started, op=op)
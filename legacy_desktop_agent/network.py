@@ -0,0 +1,357 @@
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# --- CONFIGURATION ---
+DEFAULT_CACHE_DIR = os.path.join(os.getcwd(), "cache", "http")
+DEFAULT_CACHE_MB = 500         # Shared asset cache size; least recently used entries are evicted
+MAX_CACHED_BYTES = 20 * 1024 ** 2  # Larger responses are never cached
+DEFAULT_BLOCK = ('media', 'font')  # Resource types blocked when routing is on (unless the recipe says otherwise)
+DEFAULT_BLOCK_URLS = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'hotjar.com')
+CACHEABLE_TYPES = ('script', 'stylesheet', 'font', 'image')
+# Used for "bytes saved" on blocked requests until a request of that type has been fetched once
+ESTIMATED_BYTES = {'media': 1024 ** 2, 'image': 40 * 1024, 'font': 50 * 1024, 'script': 60 * 1024}
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')  # Body is stored decoded
+PRIVATE_HEADERS = ('set-cookie', 'set-cookie2')  # Belong to the profile that fetched the asset, never replayed to others
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+ROUTE_GONE_ERRORS = ('has been closed', 'already handled')  # Playwright errors after which a route needs nothing more
+
+# Network policy of the job running in the current task (None = routing off)
+_current_network = contextvars.ContextVar('job_network', default=None)
+
+
+def _freshness(headers):
+    """Seconds a response may be served from the shared cache (0 = not cacheable)."""
+    cache_control = headers.get('cache-control', '').lower()
+    if any(word in cache_control for word in ('no-store', 'no-cache', 'private')):
+        return 0
+    if headers.get('vary', '').lower() not in ('', 'accept-encoding', 'origin'):
+        return 0
+    match = MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else 0
+
+
+class HttpCache:
+    """On-disk cache of static assets (scripts, styles, fonts, images) shared by every profile.
+
+    Chromium's own HTTP cache is per profile, and Playwright turns it off for
+    routed pages, so routed jobs read assets from here instead. Only GET 200
+    responses with a max-age are stored, keyed by URL; entries expire with
+    their max-age and the least recently used are evicted past `max_bytes`.
+    Blocking; call from a worker thread.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 ** 2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._size = None  # Bytes on disk, computed on first store
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        directory = os.path.join(self.root, key[:2])
+        return directory, os.path.join(directory, key + '.json'), os.path.join(directory, key + '.body')
+
+    def get(self, url):
+        """Returns (status, headers, body) for a fresh entry, else None."""
+        _, meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['url'] != url or meta['expires'] < time.time():
+                raise FileNotFoundError(meta_path)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+            os.utime(meta_path)  # LRU order for eviction
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        headers = {k: v for k, v in meta['headers'].items() if k.lower() not in PRIVATE_HEADERS}
+        return meta['status'], headers, body
+
+    def put(self, url, status, headers, body):
+        """Stores a response if its headers allow it. Returns True if stored."""
+        max_age = _freshness(headers)
+        if status != 200 or max_age <= 0 or len(body) > MAX_CACHED_BYTES:
+            return False
+        directory, meta_path, body_path = self._paths(url)
+        os.makedirs(directory, exist_ok=True)
+        meta = {'url': url, 'status': status, 'expires': time.time() + max_age,
+                'headers': {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS + PRIVATE_HEADERS}}
+        # Body first, then the metadata that makes it visible (both atomic)
+        for path, data, mode in ((body_path, body, 'wb'), (meta_path, json.dumps(meta).encode(), 'wb')):
+            partial = f"{path}.{threading.get_ident()}.partial"
+            with open(partial, mode) as f:
+                f.write(data)
+            os.replace(partial, path)
+        with self._lock:
+            self.stats['stores'] += 1
+            if self._size is None:
+                self._size = self._disk_size()
+            else:
+                self._size += len(body)
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+        return True
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.json'):
+                    meta_path = os.path.join(dirpath, name)
+                    body_path = meta_path[:-5] + '.body'
+                    try:
+                        yield os.stat(meta_path).st_mtime, os.path.getsize(body_path), meta_path, body_path
+                    except OSError:
+                        pass
+
+    def _disk_size(self):
+        return sum(size for _, size, _, _ in self._entries())
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is 10% under its budget."""
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, body_size, meta_path, body_path in entries:
+            if size <= target:
+                break
+            for path in (meta_path, body_path):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            size -= body_size
+            evicted += 1
+        with self._lock:
+            self._size = size
+            self.stats['evictions'] += evicted
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'sizeMB': round((self._size or 0) / 1024 ** 2, 1)}
+
+
+class ResourcePolicy:
+    """Which requests a job's pages may make.
+
+    `block` lists Playwright resource types (image, media, font, stylesheet,
+    script, ...) and `blockUrls` URL substrings. Set per recipe or block with
+    a `resourcePolicy` field, else taken from the 'network' config section.
+    With `allowOnDownload`, nothing is blocked while a download step runs.
+    """
+
+    def __init__(self, block=DEFAULT_BLOCK, block_urls=DEFAULT_BLOCK_URLS, allow_on_download=True):
+        self.block = frozenset(block)
+        self.block_urls = tuple(block_urls)
+        self.allow_on_download = allow_on_download
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """Policy from a `resourcePolicy` dict; unset keys come from `base`."""
+        base = base or cls()
+        data = data or {}
+        return cls(
+            block=data.get('block', base.block),
+            block_urls=data.get('blockUrls', base.block_urls),
+            allow_on_download=data.get('allowOnDownload', base.allow_on_download),
+        )
+
+    def blocks(self, resource_type, url):
+        return resource_type in self.block or any(pattern in url for pattern in self.block_urls)
+
+
+class JobNetwork:
+    """Routes the requests of one job's pages through its policy and the shared cache, and counts the savings."""
+
+    def __init__(self, base_policy, job_policy, cache, type_sizes):
+        self._base_policy = base_policy
+        self._job_policy = job_policy if isinstance(job_policy, dict) else {}
+        self.policy = ResourcePolicy.from_dict(self._job_policy, base_policy)
+        self.cache = cache
+        self._type_sizes = type_sizes  # Shared running averages: resource type -> [bytes, count]
+        self._relaxed = 0
+        self.stats = {'requests': 0, 'blocked': {}, 'cacheHits': 0, 'cachedBytes': 0,
+                      'fetchedBytes': 0, 'blockedBytesEstimate': 0}
+        self.load_ms = []
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Makes this the network policy of pages leased in the current task and its children."""
+        token = _current_network.set(self)
+        try:
+            yield self
+        finally:
+            _current_network.reset(token)
+
+    def apply(self, resource_policy):
+        """Layers a recipe's or block's policy between the config default and the job's own fields."""
+        self.policy = ResourcePolicy.from_dict(self._job_policy, ResourcePolicy.from_dict(resource_policy, self._base_policy))
+
+    @contextlib.contextmanager
+    def relaxed(self):
+        """Lets every request through while the block is open (download steps)."""
+        self._relaxed += 1
+        try:
+            yield
+        finally:
+            self._relaxed -= 1
+
+    async def attach(self, page):
+        await page.route('**/*', self._handle)
+        page.on('load', lambda loaded: asyncio.ensure_future(self._record_load(loaded)))
+
+    async def _record_load(self, page):
+        with contextlib.suppress(Exception):
+            load_ms = await page.evaluate(
+                "() => { const nav = performance.getEntriesByType('navigation')[0];"
+                " return nav ? nav.loadEventStart : null; }")
+            if load_ms:
+                self.load_ms.append(round(load_ms))
+
+    def _estimate(self, resource_type):
+        total, count = self._type_sizes.get(resource_type, (0, 0))
+        return total // count if count else ESTIMATED_BYTES.get(resource_type, 0)
+
+    def _observe(self, resource_type, size):
+        total, count = self._type_sizes.get(resource_type, (0, 0))
+        self._type_sizes[resource_type] = (total + size, count + 1)
+        self.stats['fetchedBytes'] += size
+
+    async def _handle(self, route):
+        request = route.request
+        resource_type = request.resource_type
+        self.stats['requests'] += 1
+        handled = False
+        try:
+            if not (self._relaxed and self.policy.allow_on_download) and self.policy.blocks(resource_type, request.url):
+                self.stats['blocked'][resource_type] = self.stats['blocked'].get(resource_type, 0) + 1
+                self.stats['blockedBytesEstimate'] += self._estimate(resource_type)
+                await route.abort('blockedbyclient')
+                return
+
+            if request.method != 'GET' or resource_type not in CACHEABLE_TYPES or self.cache is None:
+                await route.continue_()
+                return
+
+            cached = await asyncio.to_thread(self.cache.get, request.url)
+            if cached:
+                status, headers, body = cached
+                self.stats['cacheHits'] += 1
+                self.stats['cachedBytes'] += len(body)
+                await route.fulfill(status=status, headers=headers, body=body)
+                return
+
+            response = await route.fetch()
+            body = await response.body()
+            self._observe(resource_type, len(body))
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS}
+            await route.fulfill(response=response, headers=headers, body=body)
+            handled = True
+            await asyncio.to_thread(self.cache.put, request.url, response.status, response.headers, body)
+        except Exception as e:
+            if handled or any(gone in str(e) for gone in ROUTE_GONE_ERRORS):
+                return  # Page closed mid-request or the route was already answered: nothing left to route
+            # Fetch/fulfill failed: hand the request back to Chromium so it doesn't hang (and stall pacing)
+            try:
+                await route.continue_()
+            except Exception:
+                with contextlib.suppress(Exception):
+                    await route.abort()
+
+    def report(self):
+        """Per-job network summary for the job document."""
+        report = {**self.stats, 'blocked': dict(self.stats['blocked']),
+                  'bytesSaved': self.stats['cachedBytes'] + self.stats['blockedBytesEstimate']}
+        if self.load_ms:
+            report['pageLoadMs'] = {'count': len(self.load_ms), 'avg': round(sum(self.load_ms) / len(self.load_ms)),
+                                    'max': max(self.load_ms)}
+        return report
+
+
+class NetworkManager:
+    """Builds each job's JobNetwork from the 'network' config section; owns the shared HttpCache.
+
+    Routing is on by default only in headless mode (`browserPool.headless`);
+    `network.route` turns it on or off explicitly.
+    """
+
+    def __init__(self, enabled=False, policy=None, cache=None):
+        self.enabled = enabled
+        self.policy = policy or ResourcePolicy()
+        self.cache = cache
+        self._type_sizes = {}
+        self.totals = {'jobs': 0, 'bytesSaved': 0, 'blockedRequests': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        network_config = config.get('network', {})
+        headless = config.get('browserPool', {}).get('headless', False)
+        cache = None
+        if network_config.get('cache', True) is not False:
+            cache = HttpCache(network_config.get('cacheDir', DEFAULT_CACHE_DIR),
+                              int(network_config.get('cacheMB', DEFAULT_CACHE_MB) * 1024 ** 2))
+        return cls(
+            enabled=network_config.get('route', headless),
+            policy=ResourcePolicy.from_dict(network_config),
+            cache=cache,
+        )
+
+    def for_job(self, job_data):
+        """The job's network, or None when routing is off (job field `resourcePolicy: false` opts out)."""
+        job_policy = job_data.get('resourcePolicy')
+        if not self.enabled or job_policy is False:
+            return None
+        return JobNetwork(self.policy, job_policy, self.cache, self._type_sizes)
+
+    def finish(self, network):
+        """Adds a finished job's savings to the agent totals. Returns its report."""
+        report = network.report()
+        with self._lock:
+            self.totals['jobs'] += 1
+            self.totals['bytesSaved'] += report['bytesSaved']
+            self.totals['blockedRequests'] += sum(report['blocked'].values())
+        return report
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {**self.totals, 'enabled': self.enabled}
+        if self.cache:
+            snapshot['cache'] = self.cache.snapshot()
+        return snapshot
+
+
+def use_policy(resource_policy):
+    """Applies a recipe's or block's `resourcePolicy` to the current job (job fields still win)."""
+    network = _current_network.get()
+    if network is not None and resource_policy:
+        network.apply(resource_policy)
+
+
+async def attach_page(page):
+    """Routes a freshly leased page through the current job's policy, if routing is on."""
+    network = _current_network.get()
+    if network is not None:
+        await network.attach(page)
+
+
+@contextlib.contextmanager
+def download_step():
+    """Lets blocked resource types through for the duration of a download step."""
+    network = _current_network.get()
+    if network is None:
+        yield
+        return
+    with network.relaxed():
+        yield
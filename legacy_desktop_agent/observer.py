@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import itertools
+
+# --- CONFIGURATION ---
+THROTTLE_MS = 150              # Mutations are coalesced: watched elements are re-read at most this often
+EVENT_FUNCTION = 'py_observer_event'
+
+# Injected into every document of an observed page. One MutationObserver
+# serves all watches on the page; a watch re-reads its elements only after
+# mutations and pushes an event to Python only when what it reads changed.
+OBSERVER_JS = """
+(() => {
+    if (window.__agentObserver) return;
+    const PERCENT = /(\\d+(?:\\.\\d+)?)\\s*%/;
+    const watches = new Map();
+    let timer = null;
+
+    const read = (el) => {
+        const match = PERCENT.exec(el.innerText || el.textContent || '');
+        if (match) return parseFloat(match[1]);
+        const now = el.getAttribute('aria-valuenow');
+        return now === null ? null : parseFloat(now);
+    };
+
+    const evaluate = () => {
+        timer = null;
+        for (const [id, watch] of watches) {
+            const elements = document.querySelectorAll(watch.selector);
+            const values = [...elements].map(read).filter(v => v !== null && !isNaN(v));
+            const key = elements.length + ':' + values.join(',');
+            if (key === watch.last) continue;
+            watch.last = key;
+            window.__EVENT_FUNCTION__({ id, values, count: elements.length });
+        }
+    };
+    const schedule = () => { if (!timer) timer = setTimeout(evaluate, __THROTTLE_MS__); };
+
+    window.__agentObserver = {
+        watch(id, selector) {
+            try { document.querySelector(selector); } catch (e) { return false; } // Not plain CSS
+            watches.set(id, { selector, last: null });
+            schedule();
+            return true;
+        },
+        unwatch(id) { watches.delete(id); },
+    };
+    const start = () => new MutationObserver(schedule).observe(document.documentElement,
+        { subtree: true, childList: true, characterData: true, attributes: true });
+    if (document.documentElement) start(); else document.addEventListener('DOMContentLoaded', start);
+})();
+""".replace('__EVENT_FUNCTION__', EVENT_FUNCTION).replace('__THROTTLE_MS__', str(THROTTLE_MS))
+
+
+class ProgressWatch:
+    """Completion rule of wait_for_progress: every element reads >= target, or they disappear after showing up."""
+
+    def __init__(self, selector, target, on_progress=None):
+        self.selector = selector
+        self.target = target
+        self.on_progress = on_progress
+        self.done = asyncio.get_running_loop().create_future()
+        self.seen = False
+        self.lowest = None
+
+    def update(self, values, count):
+        if self.done.done():
+            return
+        if values:
+            self.seen = True
+            lowest = min(values)
+            if lowest != self.lowest:
+                self.lowest = lowest
+                if self.on_progress:
+                    self.on_progress(values)
+            if lowest >= self.target:
+                self.done.set_result(values)
+        elif self.seen and count == 0:
+            self.done.set_result([])  # Progress indicators are removed once generation finishes
+
+
+class PageObserver:
+    """Pushes changes of watched elements from a page to Python instead of polling for them.
+
+    Like the recorder, the script is added with `add_init_script` (so it
+    survives navigations) and reports through an exposed function. Watches
+    are re-armed on every new document. Any number of watches share the
+    page's single observer, so a tab watching ten scenes' progress bars
+    costs the same as one.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self._watches = {}
+        self._ids = itertools.count(1)
+        self._started = False
+
+    async def start(self):
+        if self._started:
+            return
+        self._started = True
+        await self.page.expose_function(EVENT_FUNCTION, self._on_event)
+        await self.page.add_init_script(OBSERVER_JS)
+        await self.page.evaluate(OBSERVER_JS)  # The document that is already loaded
+        self.page.on('domcontentloaded', lambda _: asyncio.ensure_future(self._rearm()))
+
+    def _on_event(self, event):
+        watch = self._watches.get(event.get('id'))
+        if watch:
+            watch.update(event.get('values') or [], event.get('count', 0))
+
+    async def _arm(self, watch_id, selector):
+        return await self.page.evaluate("([id, selector]) => window.__agentObserver.watch(id, selector)",
+                                        [watch_id, selector])
+
+    async def _rearm(self):
+        for watch_id, watch in list(self._watches.items()):
+            with contextlib.suppress(Exception):
+                await self._arm(watch_id, watch.selector)
+
+    async def wait_for_progress(self, selector, target, timeout_ms, on_progress=None):
+        """Resolves once the progress elements matching `selector` reach `target`%.
+
+        Returns False without waiting if `selector` is not plain CSS (the
+        caller then falls back to polling Playwright selectors).
+        """
+        await self.start()
+        watch_id = next(self._ids)
+        watch = ProgressWatch(selector, target, on_progress)
+        self._watches[watch_id] = watch
+        try:
+            if not await self._arm(watch_id, selector):
+                return False
+            await asyncio.wait_for(asyncio.shield(watch.done), timeout_ms / 1000)
+            return True
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Progress did not reach {target:.0f}% within {timeout_ms / 1000:.0f}s") from None
+        finally:
+            del self._watches[watch_id]
+            with contextlib.suppress(Exception):
+                await self.page.evaluate("(id) => window.__agentObserver.unwatch(id)", watch_id)
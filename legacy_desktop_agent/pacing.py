@@ -0,0 +1,213 @@
+import asyncio
+import random
+import time
+from locators import candidate_list, resolve, MAX_REPORTED, SLOW_FALLBACK_MS
+from tracing import span
+
+# --- CONFIGURATION ---
+LEGACY_STEP_DELAY = 1.0        # Seconds the old players slept after every step
+DEFAULT_STEP_TIMEOUT = 10000   # ms to wait for a selector to become actionable
+NAVIGATION_TIMEOUT = 30000     # ms to wait for a navigation to commit
+
+# Per-recipe pacing profiles. Readiness waits end as soon as the page is quiet;
+# `settleMax` caps how long a busy page can hold up the next step.
+PROFILES = {
+    # Next step as soon as the page is ready
+    'fast': {'readiness': True, 'quietMs': 150, 'settleMax': 3000, 'jitter': (0, 0), 'typeDelay': 0},
+    # Ready, then a randomized human-like pause and per-key typing delay
+    'human': {'readiness': True, 'quietMs': 300, 'settleMax': 5000, 'jitter': (0.4, 1.4), 'typeDelay': (40, 120)},
+    # Old behaviour: fixed sleep after every step, no readiness checks
+    'legacy': {'readiness': False, 'quietMs': 0, 'settleMax': 0, 'jitter': (0, 0), 'typeDelay': 0},
+}
+DEFAULT_PROFILE = 'fast'
+
+# Resolves with the elapsed ms once the DOM has had no mutations for quietMs (or after maxMs)
+DOM_STABLE_JS = """
+([quietMs, maxMs]) => new Promise(resolve => {
+    const start = performance.now();
+    let timer = null;
+    let observer = null;
+    const done = () => {
+        if (observer) observer.disconnect();
+        resolve(performance.now() - start);
+    };
+    observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(done, quietMs);
+    });
+    observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    timer = setTimeout(done, quietMs);
+    setTimeout(done, maxMs);
+})
+"""
+
+
+class NetworkTracker:
+    """Counts in-flight requests of a page so the pacer can wait for network quiet."""
+
+    def __init__(self, page):
+        self.page = page
+        self.inflight = set()
+        self.last_change = time.monotonic()
+        page.on('request', self._started)
+        page.on('requestfinished', self._finished)
+        page.on('requestfailed', self._finished)
+
+    def _started(self, request):
+        self.inflight.add(request)
+        self.last_change = time.monotonic()
+
+    def _finished(self, request):
+        self.inflight.discard(request)
+        self.last_change = time.monotonic()
+
+    async def wait_quiet(self, quiet_ms, max_ms):
+        deadline = time.monotonic() + max_ms / 1000
+        while time.monotonic() < deadline:
+            if not self.inflight and (time.monotonic() - self.last_change) * 1000 >= quiet_ms:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+
+class StepPacer:
+    """Decides how long to wait between recipe steps.
+
+    Instead of sleeping a fixed second after every step, the pacer waits for
+    the page to be ready (navigation committed, network quiet, DOM stable)
+    and tracks how much time that saved versus the legacy fixed delays.
+    """
+
+    def __init__(self, profile=DEFAULT_PROFILE, step_timeout=DEFAULT_STEP_TIMEOUT, overrides=None):
+        if profile not in PROFILES:
+            print(f"⚠️ Unknown pacing profile '{profile}', using '{DEFAULT_PROFILE}'")
+            profile = DEFAULT_PROFILE
+        self.profile = profile
+        self.settings = {**PROFILES[profile], **(overrides or {})}
+        self.step_timeout = step_timeout
+        self.stats = {'steps': 0, 'waited': 0.0, 'legacy': 0.0, 'unsettled': 0}
+        self.locators = {'raced': 0, 'fallbacks': 0, 'misses': 0, 'slow': []}
+        self._trackers = {}
+
+    @classmethod
+    def for_job(cls, config, recipe=None, job_data=None):
+        """Builds a pacer from config 'pacing', overridden by the recipe's and then the job's 'pacing' field.
+
+        A 'pacing' value may be a profile name or a dict with 'profile',
+        'stepTimeout' and any profile setting to override.
+        """
+        merged = {}
+        for source in (config.get('pacing'), (recipe or {}).get('pacing'), (job_data or {}).get('pacing')):
+            if isinstance(source, str):
+                merged['profile'] = source
+            elif isinstance(source, dict):
+                merged.update(source)
+        profile = merged.pop('profile', DEFAULT_PROFILE)
+        step_timeout = merged.pop('stepTimeout', DEFAULT_STEP_TIMEOUT)
+        return cls(profile, step_timeout=step_timeout, overrides=merged)
+
+    @property
+    def type_delay(self):
+        """Per-key delay (ms) for keyboard typing."""
+        delay = self.settings['typeDelay']
+        return random.randint(*delay) if isinstance(delay, (list, tuple)) else delay
+
+    def attach(self, page):
+        """Starts tracking the page's network activity. Call before the first step."""
+        if self.settings['readiness'] and id(page) not in self._trackers:
+            self._trackers[id(page)] = NetworkTracker(page)
+
+    async def wait_actionable(self, page, selector, timeout=None, candidates=None):
+        """Waits until the step's element is visible and returns the selector that found it.
+
+        `candidates` are the recorded alternatives for `selector`; all of them
+        are raced (see locators.resolve). Playwright's click/fill re-check
+        actionability on the returned selector.
+        """
+        options = candidate_list(selector, candidates)
+        with span('wait', selector=selector):
+            try:
+                winner, info = await resolve(page, options, timeout or self.step_timeout)
+            except Exception:
+                if len(options) > 1:
+                    self._note_locator('misses', {'recorded': options[0], 'candidates': len(options)})
+                raise
+        if info:
+            self.locators['raced'] += 1
+            if info['rank'] and info['ms'] >= SLOW_FALLBACK_MS:
+                self._note_locator('fallbacks', info)
+            elif info['rank']:
+                self.locators['fallbacks'] += 1
+        return winner
+
+    def _note_locator(self, kind, entry):
+        self.locators[kind] += 1
+        if len(self.locators['slow']) < MAX_REPORTED:
+            self.locators['slow'].append({'kind': 'miss' if kind == 'misses' else 'fallback', **entry})
+
+    async def after_step(self, page, action, legacy_delay=LEGACY_STEP_DELAY):
+        """Waits until the page is ready for the next step.
+
+        `action` is 'navigate' for steps that load a URL; `legacy_delay` is
+        what the old players would have slept here (seconds).
+        """
+        started = time.monotonic()
+        self.stats['steps'] += 1
+        self.stats['legacy'] += legacy_delay
+
+        with span('settle', action=action):
+            if not self.settings['readiness']:
+                await asyncio.sleep(legacy_delay)
+            else:
+                if action == 'navigate':
+                    await page.wait_for_load_state('domcontentloaded', timeout=NAVIGATION_TIMEOUT)
+                settled = await self._settle(page)
+                if not settled:
+                    self.stats['unsettled'] += 1
+                low, high = self.settings['jitter']
+                if high:
+                    await asyncio.sleep(random.uniform(low, high))
+
+        self.stats['waited'] += time.monotonic() - started
+
+    async def _settle(self, page):
+        quiet_ms, max_ms = self.settings['quietMs'], self.settings['settleMax']
+        started = time.monotonic()
+        tracker = self._trackers.get(id(page))
+        network_quiet = await tracker.wait_quiet(quiet_ms, max_ms) if tracker else True
+
+        remaining = max_ms - (time.monotonic() - started) * 1000
+        if remaining <= 0:
+            return False
+        try:
+            elapsed = await page.evaluate(DOM_STABLE_JS, [quiet_ms, remaining])
+        except Exception:
+            # The step navigated while we were watching: wait for the new document instead
+            try:
+                await page.wait_for_load_state('domcontentloaded', timeout=NAVIGATION_TIMEOUT)
+            except Exception:
+                return False
+            return network_quiet
+        return network_quiet and elapsed < remaining
+
+    def report(self):
+        """Per-job summary (seconds) for the job document and logs."""
+        return {
+            'profile': self.profile,
+            'steps': self.stats['steps'],
+            'waitedSeconds': round(self.stats['waited'], 2),
+            'legacySeconds': round(self.stats['legacy'], 2),
+            'savedSeconds': round(self.stats['legacy'] - self.stats['waited'], 2),
+            'unsettledSteps': self.stats['unsettled'],
+            'locators': {**self.locators, 'slow': list(self.locators['slow'])},
+        }
+
+
+def merge_reports(reports):
+    """Sums the pacing reports of several tabs of one job."""
+    merged = {'profile': reports[0]['profile'] if reports else DEFAULT_PROFILE}
+    for key in ('steps', 'waitedSeconds', 'legacySeconds', 'savedSeconds', 'unsettledSteps'):
+        merged[key] = round(sum(report[key] for report in reports), 2)
+    merged['locators'] = {key: sum(report['locators'][key] for report in reports) for key in ('raced', 'fallbacks', 'misses')}
+    merged['locators']['slow'] = [entry for report in reports for entry in report['locators']['slow']][:MAX_REPORTED]
+    return merged
@@ -0,0 +1,271 @@
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+# --- CONFIGURATION ---
+DEFAULT_PROFILES_DIR = os.path.join(os.getcwd(), "profiles")
+TEMPLATE_NAME = '_template'
+TEMP_DIR_NAME = '_tmp'
+DEFAULT_BUDGET_MB = 300        # Per-profile size above which regenerable caches are pruned
+# Caches Chromium rebuilds on demand. Pruning them never touches logins (relative to the user data dir)
+REGENERABLE_CACHES = (
+    'ShaderCache', 'GrShaderCache', 'GraphiteDawnCache', 'Crashpad', 'component_crx_cache',
+    'Default/Cache', 'Default/Code Cache', 'Default/GPUCache', 'Default/DawnCache',
+    'Default/DawnGraphiteCache', 'Default/DawnWebGPUCache', 'Default/Service Worker/CacheStorage',
+    'Default/Service Worker/ScriptCache',
+)
+# Login and site state: never copied into the template from a real profile
+LOGIN_STATE = (
+    'Default/Cookies', 'Default/Cookies-journal', 'Default/Network', 'Default/Login Data',
+    'Default/Login Data-journal', 'Default/Login Data For Account', 'Default/Web Data',
+    'Default/Local Storage', 'Default/Session Storage', 'Default/Sessions', 'Default/IndexedDB',
+    'Default/Service Worker', 'Default/Storage', 'Default/History', 'Default/History-journal',
+)
+# Component-updater data: installed once per version directory and never rewritten in place,
+# so clones may share these files through hardlinks when reflinks are unavailable
+IMMUTABLE_DIRS = (
+    'WidevineCdm', 'hyphen-data', 'ZxcvbnData', 'OnDeviceHeadSuggestModel', 'optimization_guide_model_store',
+    'Safe Browsing', 'FileTypePolicies', 'CertificateRevocation', 'TrustTokenKeyCommitments', 'MEIPreload',
+    'SSLErrorAssistant', 'OriginTrials', 'Subresource Filter', 'PKIMetadata', 'AutofillStates',
+    'FirstPartySetsPreloaded', 'ClientSidePhishing', 'PrivacySandboxAttestationsPreloaded', 'screen_ai',
+)
+FICLONE = 0x40049409           # Linux ioctl: share the source file's extents (btrfs, XFS, bcachefs)
+
+
+def _clonefile(src, dst):
+    """Clones a whole directory tree in one call on APFS (macOS). Returns False elsewhere."""
+    if sys.platform != 'darwin':
+        return False
+    try:
+        import ctypes
+        libc = ctypes.CDLL('libc.dylib', use_errno=True)
+        return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def _reflink(src, dst):
+    """Copy-on-write copy of one file (Linux). Raises OSError if the filesystem can't."""
+    import fcntl
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def _under(rel_path, prefixes):
+    rel_path = rel_path.replace(os.sep, '/')
+    return any(rel_path == p or rel_path.startswith(p + '/') for p in prefixes)
+
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def clone_tree(src, dst, skip=(), stats=None):
+    """Copies `src` to `dst` as cheaply as the filesystem allows.
+
+    Whole-tree clonefile (macOS), else per-file reflinks (Linux), else
+    hardlinks for IMMUTABLE_DIRS and plain copies for everything else.
+    Hardlinks are never used for files Chromium rewrites in place (its
+    SQLite databases), or a clone would write through to the template.
+    Paths under `skip` (relative to `src`) are left out.
+    """
+    stats = stats if stats is not None else {}
+    if not skip and _clonefile(src, dst):
+        stats['cloned'] = stats.get('cloned', 0) + 1
+        return stats
+
+    use_reflink = sys.platform.startswith('linux')
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel_dir = os.path.relpath(dirpath, src)
+        rel_dir = '' if rel_dir == '.' else rel_dir
+        dirnames[:] = [d for d in dirnames if not _under(os.path.join(rel_dir, d), skip)]
+        os.makedirs(os.path.join(dst, rel_dir), exist_ok=True)
+        for name in filenames:
+            rel_path = os.path.join(rel_dir, name)
+            if _under(rel_path, skip):
+                continue
+            source, target = os.path.join(src, rel_path), os.path.join(dst, rel_path)
+            if use_reflink:
+                try:
+                    _reflink(source, target)
+                    stats['reflinked'] = stats.get('reflinked', 0) + 1
+                    continue
+                except OSError:
+                    use_reflink = False  # Not supported on this filesystem: stop trying for this tree
+            if _under(rel_path, IMMUTABLE_DIRS):
+                try:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    os.link(source, target)
+                    stats['hardlinked'] = stats.get('hardlinked', 0) + 1
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(source, target)
+            stats['copied'] = stats.get('copied', 0) + 1
+    return stats
+
+
+class ProfileManager:
+    """Creates Chromium profiles by cloning a template and keeps their caches within a budget.
+
+    `<root>/_template` is a profile that has been through Chromium's first
+    run (and, if seeded from a real profile, its downloaded components) but
+    holds no login state. New and temporary profiles are clones of it, so
+    they start in milliseconds instead of a first-run launch. Before each
+    launch, `prepare()` prunes regenerable caches (shader, GPU, code, HTTP
+    caches, crash dumps) once the profile exceeds `budget_bytes`; cookies,
+    local storage and other login state are never touched.
+    """
+
+    def __init__(self, root=DEFAULT_PROFILES_DIR, budget_bytes=DEFAULT_BUDGET_MB * 1024 ** 2, use_template=True):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.use_template = use_template
+        self.stats = {'clones': 0, 'lastCloneMs': None, 'reflinked': 0, 'hardlinked': 0, 'copied': 0,
+                      'prunes': 0, 'prunedMB': 0.0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a manager from 'profilesDir' and the 'profiles' section of agent_config.json."""
+        profiles_config = config.get('profiles', {})
+        return cls(
+            root=config.get('profilesDir', DEFAULT_PROFILES_DIR),
+            budget_bytes=int(profiles_config.get('budgetMB', DEFAULT_BUDGET_MB) * 1024 ** 2),
+            use_template=profiles_config.get('template', True),
+        )
+
+    @property
+    def template_path(self):
+        return os.path.join(self.root, TEMPLATE_NAME)
+
+    def template_ready(self):
+        return os.path.exists(os.path.join(self.template_path, 'Local State'))
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def _clone(self, target):
+        """Clones the template to `target` atomically (a crash never leaves a half profile)."""
+        started = time.monotonic()
+        partial = f"{target}.partial-{uuid.uuid4().hex[:8]}"
+        clone_stats = clone_tree(self.template_path, partial)
+        try:
+            os.rename(partial, target)
+        except OSError:
+            shutil.rmtree(partial, ignore_errors=True)  # Someone else created it first
+            return
+        with self._lock:
+            self.stats['clones'] += 1
+            self.stats['lastCloneMs'] = round((time.monotonic() - started) * 1000, 1)
+            for key in ('reflinked', 'hardlinked', 'copied'):
+                self.stats[key] += clone_stats.get(key, 0)
+
+    def ensure(self, profile_path):
+        """Creates the profile from the template if it does not exist yet."""
+        if os.path.exists(profile_path):
+            return profile_path
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        if self.use_template and self.template_ready():
+            self._clone(profile_path)
+        os.makedirs(profile_path, exist_ok=True)
+        return profile_path
+
+    def prepare(self, profile_path):
+        """Called before a profile is launched: create it if needed, else prune it to the budget."""
+        if not os.path.exists(profile_path):
+            return self.ensure(profile_path)
+        self.prune(profile_path)
+        return profile_path
+
+    def create_temp(self, prefix='temp'):
+        """A fresh throwaway profile (clone of the template). Pass it to `discard()` when done."""
+        return self.ensure(os.path.join(self.root, TEMP_DIR_NAME, f"{prefix}-{uuid.uuid4().hex[:8]}"))
+
+    def discard(self, profile_path):
+        """Deletes a temporary profile in the background (Chromium may still hold files for a moment)."""
+        def remove():
+            for _ in range(5):
+                shutil.rmtree(profile_path, ignore_errors=True)
+                if not os.path.exists(profile_path):
+                    return
+                time.sleep(1)
+        threading.Thread(target=remove, name='profile-discard', daemon=True).start()
+
+    def prune(self, profile_path, budget_bytes=None):
+        """Deletes regenerable caches, largest first, until the profile fits the budget. Returns bytes freed."""
+        budget = self.budget_bytes if budget_bytes is None else budget_bytes
+        total = dir_size(profile_path)
+        if total <= budget:
+            return 0
+        caches = []
+        for rel_path in REGENERABLE_CACHES:
+            path = os.path.join(profile_path, *rel_path.split('/'))
+            if os.path.isdir(path):
+                caches.append((dir_size(path), path))
+        freed = 0
+        for size, path in sorted(caches, reverse=True):
+            if total - freed <= budget:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size - (dir_size(path) if os.path.exists(path) else 0)
+        if freed:
+            with self._lock:
+                self.stats['prunes'] += 1
+                self.stats['prunedMB'] = round(self.stats['prunedMB'] + freed / 1024 ** 2, 1)
+            print(f"🧹 Pruned {freed / 1024 ** 2:.0f} MB of caches from {os.path.basename(profile_path)}")
+        return freed
+
+    def seed_template(self, source_profile):
+        """Builds the template from an existing (closed) profile, minus its login state and caches."""
+        partial = f"{self.template_path}.partial-{uuid.uuid4().hex[:8]}"
+        clone_tree(source_profile, partial, skip=LOGIN_STATE + REGENERABLE_CACHES)
+        shutil.rmtree(self.template_path, ignore_errors=True)
+        os.rename(partial, self.template_path)
+
+    def finish_template(self):
+        """Prunes every cache from a template that Chromium has just initialized."""
+        self.prune(self.template_path, budget_bytes=0)
+
+    def profiles(self):
+        """Project profiles under the root (not the template or temporary profiles)."""
+        if not os.path.isdir(self.root):
+            return []
+        return [os.path.join(self.root, name) for name in sorted(os.listdir(self.root))
+                if not name.startswith('_') and '.partial-' not in name
+                and os.path.isdir(os.path.join(self.root, name))]
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'template': self.template_ready()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile template and cache budget tools (run with the agent stopped)")
+    parser.add_argument('--dir', default=DEFAULT_PROFILES_DIR, help="Profiles directory")
+    parser.add_argument('--budget-mb', type=float, default=DEFAULT_BUDGET_MB)
+    parser.add_argument('--prune', action='store_true', help="Prune every project profile to the budget")
+    parser.add_argument('--seed-from', help="Profile to build the template from (login state is left out)")
+    args = parser.parse_args()
+
+    manager = ProfileManager(args.dir, int(args.budget_mb * 1024 ** 2))
+    if args.seed_from:
+        manager.seed_template(args.seed_from)
+        print(f"🧬 Template seeded from {args.seed_from} ({dir_size(manager.template_path) / 1024 ** 2:.1f} MB)")
+    if args.prune:
+        for profile in manager.profiles():
+            before = dir_size(profile)
+            manager.prune(profile)
+            print(f"{os.path.basename(profile)}: {before / 1024 ** 2:.1f} MB → {dir_size(profile) / 1024 ** 2:.1f} MB")
@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# --- CONFIGURATION ---
+DEFAULT_QUOTAS_PATH = os.path.join(os.getcwd(), "state", "quotas.json")
+
+
+class QuotaExceeded(Exception):
+    """A profile has used up its daily generations on a site."""
+
+
+def site_of(url):
+    """Host of a URL without 'www.' ('' if there is none)."""
+    host = urlparse(url or '').hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class TokenBucket:
+    """`rate` tokens per minute, at most `burst` saved up. State is plain data so it can be persisted."""
+
+    def __init__(self, rate, burst, tokens=None, updated=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst if tokens is None else min(tokens, burst)
+        self.updated = updated or time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) * 60 / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def state(self):
+        return {'tokens': round(self.tokens, 3), 'updated': self.updated}
+
+
+class QuotaScheduler:
+    """Rate limits and daily quotas of generation sites, per site and per logged-in profile.
+
+    Each site in the 'quotas' config can limit generations per minute
+    (token buckets for the whole site and for each profile), per profile and
+    day, and the number of tabs generating at once per profile. Bucket levels
+    and daily counters are saved to `path`, so a restart neither resets a
+    quota nor allows a fresh burst. `plan()` spreads a job's scenes over the
+    project's profiles by their remaining capacity; `acquire()` is taken
+    before each scene and waits for both buckets.
+    """
+
+    def __init__(self, sites=None, profiles=None, path=DEFAULT_QUOTAS_PATH):
+        self.sites = sites or {}        # site -> limits
+        self.profiles = profiles or {}  # project id -> extra profile names (accounts)
+        self.path = path
+        self._buckets = {}
+        self._daily = {}                # "site|profile" -> {'day', 'used'}
+        self._saved_buckets = {}        # Bucket states from the last run, applied when a bucket is first used
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = {'acquired': 0, 'throttled': 0, 'throttledSeconds': 0.0, 'exhausted': 0}
+        self._load()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the scheduler from the 'quotas' section of agent_config.json."""
+        quota_config = config.get('quotas', {})
+        return cls(
+            sites=quota_config.get('sites', {}),
+            profiles=quota_config.get('profiles', {}),
+            path=quota_config.get('path', DEFAULT_QUOTAS_PATH),
+        )
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._daily = state.get('daily', {})
+        self._saved_buckets = state.get('buckets', {})
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            state = {'daily': dict(self._daily), 'buckets': {key: b.state() for key, b in self._buckets.items()}}
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        partial = self.path + '.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(partial, self.path)
+
+    def limits(self, site):
+        """Limits of `site`, also when configured under a parent domain ('google.com' covers 'labs.google.com')."""
+        for name, limits in self.sites.items():
+            if site == name or site.endswith('.' + name):
+                return name, limits
+        return site, None
+
+    def _bucket(self, key, rate, burst):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            saved = self._saved_buckets.get(key, {})
+            bucket = self._buckets[key] = TokenBucket(rate, burst or 1, saved.get('tokens'), saved.get('updated'))
+        return bucket
+
+    def _usage(self, key):
+        """Today's counter for "site|profile" (reset at local midnight)."""
+        today = time.strftime('%Y-%m-%d')
+        usage = self._daily.get(key)
+        if not usage or usage['day'] != today:
+            usage = self._daily[key] = {'day': today, 'used': 0}
+        return usage
+
+    def remaining(self, site, profile):
+        """Generations `profile` may still start on `site` today (None = unlimited)."""
+        name, limits = self.limits(site)
+        if not limits or not limits.get('dailyPerProfile'):
+            return None
+        with self._lock:
+            return max(0, limits['dailyPerProfile'] - self._usage(f"{name}|{os.path.basename(profile)}")['used'])
+
+    def profiles_for(self, project_id, job_data=None):
+        """Profile names a project's scenes may use: its own, then its extra accounts (a job's `profiles` wins)."""
+        names = (job_data or {}).get('profiles') or [project_id, *self.profiles.get(project_id, [])]
+        return list(dict.fromkeys(names))
+
+    def plan(self, site, profiles, scenes, width):
+        """Spreads `scenes` over `profiles`. Returns ([(profile, scenes, tabs)], scenes over today's quota).
+
+        Scenes go to the profile with the fewest so far among those with
+        quota left, so the job's throughput is bounded by the capacity of all
+        accounts together. At most `width` profiles get scenes and their tabs
+        add up to at most `width`. Each profile's scenes stay contiguous; tabs
+        are split evenly and capped by the site's `concurrentPerProfile`.
+        """
+        _, limits = self.limits(site)
+        width = max(1, width)
+        capacity = {profile: self.remaining(site, profile) for profile in profiles}
+        counts = dict.fromkeys(profiles, 0)
+        planned = 0
+        for _ in scenes:
+            open_profiles = [p for p in profiles if capacity[p] is None or counts[p] < capacity[p]]
+            if sum(1 for p in profiles if counts[p]) >= width:
+                open_profiles = [p for p in open_profiles if counts[p]]  # Every tab is taken: no new profiles
+            if not open_profiles:
+                break
+            counts[min(open_profiles, key=lambda p: counts[p])] += 1
+            planned += 1
+
+        used = [p for p in profiles if counts[p]]
+        per_profile, extra = divmod(width, max(1, len(used)))
+        concurrent = (limits or {}).get('concurrentPerProfile') or width
+        assignments, start = [], 0
+        for rank, profile in enumerate(used):
+            tabs = min(per_profile + (rank < extra), concurrent)
+            assignments.append((profile, scenes[start:start + counts[profile]], tabs))
+            start += counts[profile]
+        return assignments, scenes[planned:]
+
+    async def acquire(self, site, profile):
+        """Waits for the site's and the profile's rate limits, then counts one generation.
+
+        Raises QuotaExceeded once the profile's daily quota on the site is used up.
+        """
+        name, limits = self.limits(site)
+        if not limits:
+            return
+        key = f"{name}|{os.path.basename(profile)}"
+        waited = 0.0
+        while True:
+            with self._lock:
+                usage = self._usage(key)
+                if limits.get('dailyPerProfile') and usage['used'] >= limits['dailyPerProfile']:
+                    self.stats['exhausted'] += 1
+                    raise QuotaExceeded(f"{os.path.basename(profile)} used its {limits['dailyPerProfile']} "
+                                        f"generations on {name} today")
+                buckets = []
+                if limits.get('perMinute'):
+                    buckets.append(self._bucket(name, limits['perMinute'], limits.get('burst', limits['perMinute'])))
+                if limits.get('perProfilePerMinute'):
+                    buckets.append(self._bucket(key, limits['perProfilePerMinute'],
+                                                limits.get('perProfileBurst', limits['perProfilePerMinute'])))
+                now = time.time()
+                wait = max([bucket.wait_time(now) for bucket in buckets], default=0)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.take()
+                    usage['used'] += 1
+                    self.stats['acquired'] += 1
+                    if waited:
+                        self.stats['throttled'] += 1
+                        self.stats['throttledSeconds'] += waited
+                    self._dirty = True
+                    break
+            waited += wait
+            await asyncio.sleep(wait)
+        await asyncio.to_thread(self.save)  # A crash must not hand the quota back
+
+    @contextlib.asynccontextmanager
+    async def slot(self, site, profile):
+        """Holds one of the profile's `concurrentPerProfile` generation tabs on the site (shared by all jobs)."""
+        name, limits = self.limits(site)
+        if not limits or not limits.get('concurrentPerProfile'):
+            yield
+            return
+        key = f"{name}|{os.path.basename(profile)}"
+        semaphore = self._slots.get(key)
+        if semaphore is None:
+            semaphore = self._slots[key] = asyncio.Semaphore(limits['concurrentPerProfile'])
+        async with semaphore:
+            yield
+
+    def snapshot(self):
+        """Today's usage per site and profile, and throttling counters, for the heartbeat document."""
+        today = time.strftime('%Y-%m-%d')
+        with self._lock:
+            used = {key: usage['used'] for key, usage in self._daily.items() if usage['day'] == today and usage['used']}
+            return {**self.stats, 'throttledSeconds': round(self.stats['throttledSeconds'], 1), 'usedToday': used}
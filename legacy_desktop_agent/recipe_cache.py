@@ -0,0 +1,228 @@
+import collections
+import re
+import threading
+
+# --- CONFIGURATION ---
+DEFAULT_MAX_ENTRIES = 64       # Compiled recipes kept in memory (each also holds one document watch)
+SELECTOR_STEPS = ('CLICK_SELECTOR', 'WAIT_UNTIL')
+KNOWN_STEPS = ('GOTO', 'CLICK_SELECTOR', 'TYPE', 'SLEEP', 'WAIT_UNTIL')
+SLOT_RE = re.compile(r'\{\{([^{}]+)\}\}')
+BRACKET_PAIRS = {')': '(', ']': '[', '}': '{'}
+
+# One template part is either a literal string or a Slot (variable name)
+Slot = collections.namedtuple('Slot', 'name')
+CompiledStep = collections.namedtuple('CompiledStep', 'order type template raw')
+RecipePlan = collections.namedtuple('RecipePlan', 'recipe_id version name steps variables pacing resource_policy warnings')
+
+
+class RecipeCompileError(ValueError):
+    """The recipe cannot be played (e.g. a step with an invalid selector)."""
+
+
+def parse_template(value):
+    """Splits "a {{x}} b" into ('a ', Slot('x'), ' b'). Done once per step at compile time."""
+    value = str(value or '')
+    parts = []
+    pos = 0
+    for match in SLOT_RE.finditer(value):
+        if match.start() > pos:
+            parts.append(value[pos:match.start()])
+        parts.append(Slot(match.group(1)))
+        pos = match.end()
+    if pos < len(value):
+        parts.append(value[pos:])
+    return tuple(parts)
+
+
+def render_template(template, variables):
+    """Fills the slots. Unknown variables stay as {{name}}, like the old str.replace loop."""
+    if len(template) == 1 and not isinstance(template[0], Slot):
+        return template[0]
+    out = []
+    for part in template:
+        if isinstance(part, Slot):
+            out.append(str(variables[part.name]) if part.name in variables else '{{' + part.name + '}}')
+        else:
+            out.append(part)
+    return ''.join(out)
+
+
+def selector_problem(selector):
+    """Returns why a CSS/Playwright selector cannot work, or None. Catches the usual recorder/typo breakage.
+
+    Quotes only delimit strings inside brackets (`[title="a"]`,
+    `:has-text("Save")`); elsewhere they are text, as in `text=Don't ask again`.
+    """
+    if not selector.strip():
+        return "empty selector"
+    stack = []
+    quote = None
+    for char in selector:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'") and stack:
+            quote = char
+        elif char in '([{':
+            stack.append(char)
+        elif char in BRACKET_PAIRS:
+            if not stack or stack.pop() != BRACKET_PAIRS[char]:
+                return f"unbalanced '{char}'"
+    if quote:
+        return f"unterminated {quote} quote"
+    if stack:
+        return f"unclosed '{stack[-1]}'"
+    return None
+
+
+def recipe_version(doc):
+    """Cache version of a recipe snapshot: its updatedAt, else the document's update time."""
+    return (doc.to_dict() or {}).get('updatedAt') or doc.update_time
+
+
+def compile_recipe(recipe_id, recipe, version=None):
+    """Compiles a recipe document into an immutable RecipePlan (steps sorted, templates parsed)."""
+    steps = []
+    slots = set()
+    warnings = []
+    ordered = sorted(enumerate(recipe.get('steps', [])), key=lambda item: (item[1].get('order', 0), item[0]))
+    for index, step in ordered:
+        step_type = step.get('type')
+        template = parse_template(step.get('value', ''))
+        slots.update(part.name for part in template if isinstance(part, Slot))
+
+        if step_type not in KNOWN_STEPS:
+            warnings.append(f"Step {index + 1}: unknown type {step_type!r} (skipped at play time)")
+        elif step_type in SELECTOR_STEPS and not any(isinstance(part, Slot) for part in template):
+            problem = selector_problem(template[0] if template else '')
+            if problem:
+                raise RecipeCompileError(f"Recipe {recipe_id} step {index + 1} ({step_type}): {problem}")
+
+        steps.append(CompiledStep(step.get('order', 0), step_type, template, dict(step)))
+
+    return RecipePlan(
+        recipe_id=recipe_id,
+        version=version if version is not None else recipe.get('updatedAt'),
+        name=recipe.get('name', recipe_id),
+        steps=tuple(steps),
+        variables=frozenset(slots),
+        pacing=recipe.get('pacing'),
+        resource_policy=recipe.get('resourcePolicy'),
+        warnings=tuple(warnings),
+    )
+
+
+class RecipeCache:
+    """LRU of compiled recipes, kept fresh by Firestore document watches.
+
+    A cached plan is served without any Firestore read. Each cached recipe
+    has an `on_snapshot` watch; when the document's `updatedAt` changes the
+    plan is recompiled from the snapshot, and a deleted recipe is dropped.
+    """
+
+    def __init__(self, db, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db = db
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+        self._plans = collections.OrderedDict()  # recipe_id -> RecipePlan (LRU order)
+        self._watches = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, db, config):
+        """Builds a cache from the 'recipeCache' section of agent_config.json."""
+        cache_config = config.get('recipeCache', {})
+        return cls(db, max_entries=cache_config.get('maxEntries', DEFAULT_MAX_ENTRIES))
+
+    def _ref(self, recipe_id):
+        return self.db.collection('automation_recipes').document(recipe_id)
+
+    def get(self, recipe_id):
+        """Returns the compiled plan, reading Firestore only on a miss. Blocking; call off the event loop."""
+        with self._lock:
+            plan = self._plans.get(recipe_id)
+            if plan is not None:
+                self._plans.move_to_end(recipe_id)
+                self.stats['hits'] += 1
+                return plan
+            self.stats['misses'] += 1
+
+        recipe_doc = self._ref(recipe_id).get()
+        if not recipe_doc.exists:
+            raise Exception(f"Recipe {recipe_id} not found!")
+        plan = compile_recipe(recipe_id, recipe_doc.to_dict(), recipe_version(recipe_doc))
+        for warning in plan.warnings:
+            print(f"⚠️ {warning}")
+
+        with self._lock:
+            self._store(plan)
+            watch_needed = recipe_id not in self._watches
+            if watch_needed:
+                self._watches[recipe_id] = None  # Reserved; set below outside the lock
+        if watch_needed:
+            self._watch(recipe_id)
+        return plan
+
+    def _store(self, plan):
+        self._plans[plan.recipe_id] = plan
+        self._plans.move_to_end(plan.recipe_id)
+        while len(self._plans) > self.max_entries:
+            evicted, _ = self._plans.popitem(last=False)
+            self.stats['evictions'] += 1
+            self._unwatch(evicted)
+
+    def _watch(self, recipe_id):
+        def on_snapshot(doc_snapshots, changes, read_time):
+            for doc in doc_snapshots:
+                self._on_recipe_change(recipe_id, doc)
+
+        try:
+            watch = self._ref(recipe_id).on_snapshot(on_snapshot)
+        except Exception as e:
+            # Without a watch we cannot trust the cached plan: do not keep it
+            print(f"⚠️ Recipe watch failed for {recipe_id}: {e}")
+            with self._lock:
+                self._watches.pop(recipe_id, None)
+                self._plans.pop(recipe_id, None)
+            return
+        with self._lock:
+            if recipe_id in self._watches:
+                self._watches[recipe_id] = watch
+                return
+        watch.unsubscribe()  # Evicted while we were subscribing
+
+    def _unwatch(self, recipe_id):
+        watch = self._watches.pop(recipe_id, None)
+        if watch is not None:
+            threading.Thread(target=watch.unsubscribe, daemon=True).start()
+
+    def _on_recipe_change(self, recipe_id, doc):
+        with self._lock:
+            cached = self._plans.get(recipe_id)
+            if cached is None:
+                return
+            if not doc.exists:
+                self._plans.pop(recipe_id, None)
+                self._unwatch(recipe_id)
+                self.stats['invalidations'] += 1
+                return
+            version = recipe_version(doc)
+            if version == cached.version:
+                return  # Initial snapshot of the watch
+            self.stats['invalidations'] += 1
+            try:
+                self._plans[recipe_id] = compile_recipe(recipe_id, doc.to_dict(), version)
+            except RecipeCompileError as e:
+                print(f"⚠️ {e}")
+                self._plans.pop(recipe_id, None)  # Next run reads it again and reports the error
+
+    def snapshot(self):
+        """Counters plus current size, for the heartbeat document."""
+        with self._lock:
+            return {**self.stats, 'cached': len(self._plans)}
+
+    def close(self):
+        with self._lock:
+            for recipe_id in list(self._watches):
+                self._unwatch(recipe_id)
+            self._plans.clear()
@@ -0,0 +1,242 @@
+import asyncio
+import time
+import uuid
+from firebase_admin import firestore
+
+# --- CONFIGURATION ---
+PAGE_FLUSH_MS = 250          # How often the page script hands its buffer to Python
+WRITE_INTERVAL = 2.0         # Seconds between Firestore writes of sealed steps
+CLICK_DEBOUNCE_MS = 300      # Repeated clicks on the same target within this window collapse into one
+TYPE_MERGE_MS = 1500         # Typing pauses shorter than this stay in the same 'type' step
+MAX_CANDIDATES = 6           # Alternative locators recorded per step (raced at playback)
+
+# Injected on every page of the recording context. Events are buffered in the
+# page and handed to Python in batches, so fast clicking never waits on a
+# Python round trip per event.
+RECORDER_JS = """
+(() => {
+    if (window.__recorderInstalled) return;
+    window.__recorderInstalled = true;
+    console.log("%c 🕵️ RECORDER STARTED ", "background: red; color: white; font-size: 16px");
+
+    const buffer = [];
+    let seq = 0;
+
+    const quote = (text) => JSON.stringify(text);
+    const IMPLICIT_ROLES = { BUTTON: 'button', A: 'link', TEXTAREA: 'textbox', SELECT: 'combobox', SUMMARY: 'button' };
+    const INPUT_ROLES = { checkbox: 'checkbox', radio: 'radio', button: 'button', submit: 'button', range: 'slider' };
+    const roleOf = (el) => el.getAttribute('role')
+        || (el.tagName === 'INPUT' ? (INPUT_ROLES[el.type] || 'textbox') : IMPLICIT_ROLES[el.tagName]);
+    const nameOf = (el) => (el.getAttribute('aria-label') || el.innerText || el.getAttribute('title')
+        || el.getAttribute('placeholder') || '').trim().replace(/\\s+/g, ' ');
+
+    const cssPath = (el) => {
+        const parts = [];
+        while (el && el.nodeType === 1 && el !== document.body) {
+            if (el.id && !/\\d{3,}/.test(el.id)) { parts.unshift('#' + CSS.escape(el.id)); break; }
+            let part = el.tagName.toLowerCase();
+            const twins = el.parentElement ? [...el.parentElement.children].filter(s => s.tagName === el.tagName) : [];
+            if (twins.length > 1) part += `:nth-of-type(${twins.indexOf(el) + 1})`;
+            parts.unshift(part);
+            el = el.parentElement;
+        }
+        return parts.join(' > ');
+    };
+
+    // Several locators per element, most robust first: players race them and remember the winner
+    const locate = (target) => {
+        // Clicks often land on an icon or span inside the real control
+        const el = target.closest('button, a, input, textarea, select, [role], [aria-label], [contenteditable="true"]') || target;
+        const tag = el.tagName.toLowerCase();
+        const candidates = [];
+        const add = (selector) => { if (selector && !candidates.includes(selector)) candidates.push(selector); };
+
+        if (el.id && !/\\d{3,}/.test(el.id)) add('#' + CSS.escape(el.id)); // Skip generated ids
+        const testId = el.getAttribute('data-testid');
+        if (testId) add(`[data-testid=${quote(testId)}]`);
+        const label = el.getAttribute('aria-label');
+        if (label) add(`${tag}[aria-label=${quote(label)}]`);
+        const role = roleOf(el);
+        const name = nameOf(el);
+        if (role && name && name.length <= 60) add(`role=${role}[name=${quote(name)}]`);
+        const placeholder = el.getAttribute('placeholder');
+        if (placeholder) add(`${tag}[placeholder=${quote(placeholder)}]`);
+        const text = (el.innerText || '').trim();
+        if (text && text.length <= 40 && !text.includes('\\n')) add(`text=${quote(text)}`);
+        add(cssPath(el));
+
+        const kept = candidates.slice(0, __MAX_CANDIDATES__);
+        return { selector: kept[0], candidates: kept };
+    };
+
+    const push = (event) => {
+        event.seq = seq++;
+        event.timestamp = Date.now();
+        event.url = location.href;
+        const last = buffer[buffer.length - 1];
+        // Merge keystrokes in the page already: keep only the latest value per field
+        if (last && last.action === 'type' && event.action === 'type' && last.selector === event.selector) {
+            buffer[buffer.length - 1] = event;
+        } else {
+            buffer.push(event);
+        }
+    };
+
+    const flush = () => {
+        if (!buffer.length || !window.py_record_steps) return;
+        window.py_record_steps(buffer.splice(0, buffer.length));
+    };
+
+    // Use 'mousedown' in Capture Phase (true) to catch events BEFORE the web app eats them
+    document.addEventListener('mousedown', (e) => {
+        push({ action: 'click', ...locate(e.target) });
+    }, true);
+
+    document.addEventListener('input', (e) => {
+        const target = e.target;
+        const value = target.isContentEditable ? target.innerText : target.value;
+        push({ action: 'type', ...locate(target), value: value || '' });
+    }, true);
+
+    document.addEventListener('keydown', (e) => {
+        if (e.key === 'Enter' || e.key === 'Tab' || e.key === 'Escape') {
+            push({ action: 'press', ...locate(e.target), value: e.key });
+        }
+    }, true);
+
+    setInterval(flush, __FLUSH_MS__);
+    window.addEventListener('pagehide', flush);
+    document.addEventListener('visibilitychange', flush);
+})();
+""".replace('__FLUSH_MS__', str(PAGE_FLUSH_MS)).replace('__MAX_CANDIDATES__', str(MAX_CANDIDATES))
+
+
+class RecordingBuffer:
+    """Merges raw page events into ordered recipe steps.
+
+    The last step stays "open" while it can still absorb events (more typing
+    in the same field, a repeated click); every earlier step is sealed and
+    ready to be written.
+    """
+
+    def __init__(self, first_order=1):
+        self._next_order = first_order
+        self._sealed = []
+        self._open = None
+        self.stats = {'events': 0, 'merged': 0, 'steps': 0, 'written': 0, 'writes': 0}
+
+    def add(self, events):
+        for event in sorted(events, key=lambda e: (e.get('timestamp', 0), e.get('seq', 0))):
+            self.stats['events'] += 1
+            if self._merge(event):
+                self.stats['merged'] += 1
+                continue
+            self._seal_open()
+            self._open = event
+
+    def _merge(self, event):
+        last = self._open
+        if not last or last.get('selector') != event.get('selector') or last.get('action') != event.get('action'):
+            return False
+        gap = event.get('timestamp', 0) - last.get('timestamp', 0)
+        if event['action'] == 'type' and gap <= TYPE_MERGE_MS:
+            self._open = {**last, 'value': event.get('value', ''), 'timestamp': event.get('timestamp')}
+            return True
+        if event['action'] == 'click' and gap <= CLICK_DEBOUNCE_MS:
+            return True
+        return False
+
+    def _seal_open(self):
+        if self._open is None:
+            return
+        event = self._open
+        self._open = None
+        step = {
+            'id': uuid.uuid4().hex[:12],
+            'order': self._next_order,
+            'action': event['action'],
+            'selector': event.get('selector', ''),
+            'timestamp': event.get('timestamp'),
+        }
+        if len(event.get('candidates') or []) > 1:
+            step['candidates'] = event['candidates']
+        if event['action'] == 'click':
+            step['description'] = f"User clicked {step['selector']}"
+        else:
+            step['value'] = event.get('value', '')
+            step['description'] = f"User {'typed into' if event['action'] == 'type' else 'pressed ' + step['value'] + ' in'} {step['selector']}"
+        self._next_order += 1
+        self._sealed.append(step)
+        self.stats['steps'] += 1
+
+    def take(self, final=False):
+        """Returns sealed steps not yet handed out (all steps when `final`)."""
+        if final or (self._open and time.time() * 1000 - self._open.get('timestamp', 0) > TYPE_MERGE_MS):
+            self._seal_open()
+        steps, self._sealed = self._sealed, []
+        return steps
+
+    def requeue(self, steps):
+        """Puts steps whose write failed back in front of the sealed list."""
+        self._sealed[:0] = steps
+
+
+class RecipeRecorder:
+    """Buffers recorder events and writes ordered steps to automation_recipes in batches."""
+
+    def __init__(self, db, recipe_id):
+        self.db = db
+        self.recipe_id = recipe_id
+        self.buffer = None
+        self._writer = None
+        self._stopping = None
+
+    def _recipe_ref(self):
+        return self.db.collection('automation_recipes').document(self.recipe_id)
+
+    async def start(self):
+        """Continues numbering after the recipe's existing steps and starts the periodic writer."""
+        snapshot = await asyncio.to_thread(self._recipe_ref().get)
+        existing = (snapshot.to_dict() or {}).get('steps', []) if snapshot.exists else []
+        first_order = max((s.get('order', 0) for s in existing), default=0) + 1
+        self.buffer = RecordingBuffer(first_order)
+        self._stopping = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def on_page_events(self, events):
+        """Exposed to the page as py_record_steps. Never blocks: only buffers."""
+        self.buffer.add(events)
+        for event in events:
+            print(f"⚡ [RECORDER] Action: {event.get('action')} on {event.get('selector')}")
+
+    async def _write_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), WRITE_INTERVAL)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def flush(self, final=False):
+        steps = self.buffer.take(final=final)
+        if not steps:
+            return
+        try:
+            # Every step carries a unique id/order, so ArrayUnion can never drop a repeat action
+            await asyncio.to_thread(self._recipe_ref().update, {
+                'steps': firestore.ArrayUnion(steps),
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            self.buffer.stats['written'] += len(steps)
+            self.buffer.stats['writes'] += 1
+        except Exception as e:
+            print(f"🔥 Firestore Error: {e}")
+            self.buffer.requeue(steps) # Retry with the next flush
+
+    async def close(self):
+        """Stops the writer (letting an in-flight write finish) and flushes every remaining step."""
+        if self._writer:
+            self._stopping.set()
+            await self._writer
+        await self.flush(final=True)
+        print(f"💾 Recorder saved {self.buffer.stats['written']} step(s) "
+              f"from {self.buffer.stats['events']} event(s) in {self.buffer.stats['writes']} write(s)")
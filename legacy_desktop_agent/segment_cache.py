@@ -0,0 +1,186 @@
+import collections
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# --- CONFIGURATION ---
+DEFAULT_CACHE_DIR = os.path.join(os.getcwd(), "cache", "stitch")
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3   # Disk budget for normalized segments + finished outputs
+HASH_CHUNK = 1024 * 1024
+KINDS = ('segments', 'outputs')
+STALE_WORK_SECONDS = 24 * 3600
+
+
+def cache_key(*parts):
+    """Stable key from JSON-serializable parts (file hashes, encode parameters, versions)."""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SegmentCache:
+    """Content-addressed files on local disk with a size budget and LRU eviction.
+
+    Entries live in `<root>/<kind>/<key><ext>`. The file's mtime is its last
+    use, so the LRU order survives restarts; the index is rebuilt by
+    scanning the directory. Entries a running job still reads are pinned
+    (`get`/`put` with `pin=True`, then `unpin`) and never evicted meanwhile.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evictions': 0, 'hashed': 0}
+        self._lock = threading.Lock()
+        self._entries = {}   # (kind, key) -> {'path', 'size', 'last_used'}
+        self._digests = {}   # (path, size, mtime) -> sha256
+        self._pins = collections.Counter()  # (kind, key) -> jobs still using the entry
+        self._size = 0
+        for kind in KINDS:
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+        os.makedirs(self.work_root, exist_ok=True)
+        # A large cache on a cold disk takes a while to list: don't hold up agent startup for it
+        self._scanned = threading.Event()
+        threading.Thread(target=self._scan_in_background, name='stitch-cache-scan', daemon=True).start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a cache from the 'stitchCache' section of agent_config.json (None if disabled)."""
+        cache_config = config.get('stitchCache', {})
+        if cache_config.get('enabled', True) is False:
+            return None
+        return cls(
+            root=cache_config.get('dir', DEFAULT_CACHE_DIR),
+            max_bytes=int(cache_config.get('maxGB', DEFAULT_MAX_BYTES / 1024 ** 3) * 1024 ** 3),
+        )
+
+    @property
+    def work_root(self):
+        """Per-job scratch directories (manifests, encodes in progress) live here."""
+        return os.path.join(self.root, 'work')
+
+    def _scan_in_background(self):
+        try:
+            self._scan()
+        except OSError as e:
+            print(f"⚠️ Stitch cache scan failed: {e}")
+        finally:
+            self._scanned.set()
+
+    def _scan(self):
+        for kind in KINDS:
+            directory = os.path.join(self.root, kind)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if not os.path.isfile(path) or name.endswith('.part'):
+                    continue
+                stat = os.stat(path)
+                key = os.path.splitext(name)[0]
+                with self._lock:
+                    self._entries[(kind, key)] = {'path': path, 'size': stat.st_size, 'last_used': stat.st_mtime}
+                    self._size += stat.st_size
+        # Scratch left behind by a crashed run (old enough not to belong to another agent's live job)
+        for name in os.listdir(self.work_root):
+            path = os.path.join(self.work_root, name)
+            if time.time() - os.path.getmtime(path) > STALE_WORK_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def file_digest(self, path):
+        """sha256 of a file, memoized on (path, size, mtime) so unchanged scenes are hashed once."""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+        if digest:
+            return digest
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._digests[memo_key] = digest
+            self.stats['hashed'] += 1
+        return digest
+
+    def get(self, kind, key, pin=False):
+        """Path of a cached entry (marked as just used, and pinned if `pin`), or None."""
+        self._scanned.wait()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None or not os.path.exists(entry['path']):
+                if entry is not None:
+                    self._forget(kind, key)
+                self.stats['misses'] += 1
+                return None
+            entry['last_used'] = time.time()
+            self.stats['hits'] += 1
+            if pin:
+                self._pins[(kind, key)] += 1
+        try:
+            os.utime(entry['path'])
+        except OSError:
+            pass
+        return entry['path']
+
+    def put(self, kind, key, source, move=False, pin=False):
+        """Adds `source` under key (moved if `move`, else copied; pinned if `pin`). Returns the cached path."""
+        self._scanned.wait()
+        extension = os.path.splitext(source)[1] or '.mp4'
+        path = os.path.join(self.root, kind, key + extension)
+        tmp_path = path + '.part'
+        if move:
+            shutil.move(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)  # Readers never see a half-written entry
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if (kind, key) in self._entries:
+                self._size -= self._entries[(kind, key)]['size']
+            self._entries[(kind, key)] = {'path': path, 'size': size, 'last_used': time.time()}
+            self._size += size
+            self.stats['stored'] += 1
+            if pin:
+                self._pins[(kind, key)] += 1
+            self._evict(keep=(kind, key))
+        return path
+
+    def unpin(self, kind, keys):
+        """Releases pins taken by `get`/`put`; the entries become evictable again once no job holds them."""
+        with self._lock:
+            for key in keys:
+                self._pins[(kind, key)] -= 1
+                if self._pins[(kind, key)] <= 0:
+                    del self._pins[(kind, key)]
+
+    def _forget(self, kind, key):
+        entry = self._entries.pop((kind, key), None)
+        if entry:
+            self._size -= entry['size']
+        return entry
+
+    def _evict(self, keep):
+        """Drops least recently used entries until the cache fits its budget."""
+        if self._size <= self.max_bytes:
+            return
+        for entry_id in sorted(self._entries, key=lambda e: self._entries[e]['last_used']):
+            if self._size <= self.max_bytes:
+                break
+            if entry_id == keep or entry_id in self._pins:
+                continue
+            entry = self._forget(*entry_id)
+            try:
+                os.remove(entry['path'])
+            except OSError:
+                pass  # In use on Windows: forget it now, the next scan picks it up again
+            self.stats['evictions'] += 1
+
+    def snapshot(self):
+        """Counters plus current disk usage, for the heartbeat document."""
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries), 'sizeMB': round(self._size / 1024 ** 2, 1),
+                    'scanning': not self._scanned.is_set()}
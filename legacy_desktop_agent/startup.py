@@ -0,0 +1,53 @@
+import threading
+import time
+
+# --- CONFIGURATION ---
+# Order in which phases are printed (others follow in the order they were reached)
+PHASES = ('imports', 'firebase', 'agentInit', 'executor', 'listener', 'heartbeat', 'adopt',
+          'playwright', 'chromium', 'firstJob')
+
+
+def _process_start():
+    """Wall-clock time the Python process started (psutil is optional; else this module's import)."""
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except Exception:
+        return time.time()
+
+
+class StartupTimer:
+    """Seconds from process start to each startup phase, reported once and on every heartbeat."""
+
+    def __init__(self):
+        self.origin = _process_start()
+        self.phases = {}
+        self._lock = threading.Lock()
+        self._reported = False
+
+    def mark(self, phase):
+        """Records `phase` as reached now (only the first time). Returns True if it was new."""
+        with self._lock:
+            if phase in self.phases:
+                return False
+            self.phases[phase] = round(time.time() - self.origin, 2)
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            order = [p for p in PHASES if p in self.phases] + [p for p in self.phases if p not in PHASES]
+            return {phase: self.phases[phase] for phase in order}
+
+    def summary(self):
+        return ', '.join(f"{phase} {seconds}s" for phase, seconds in self.snapshot().items())
+
+    def report_once(self, log=print):
+        """Logs the phase timings the first time it is called."""
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+        log(f"⏱️ Startup: {self.summary()}")
+
+
+STARTUP = StartupTimer()
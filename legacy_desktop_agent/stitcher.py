@@ -0,0 +1,384 @@
+import collections
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from metrics import FFMPEG_FAILURES, FFMPEG_SECONDS
+from segment_cache import SegmentCache, cache_key
+from tracing import span
+
+# --- CONFIGURATION ---
+DEFAULT_STALL_TIMEOUT = 120    # Seconds without ffmpeg progress before the run is killed
+PROBE_TIMEOUT = 60             # ffprobe only reads headers
+STDERR_TAIL_LINES = 40         # ffmpeg stderr kept for error messages
+# Encoder used to bring a segment to the reference codec; other codecs fall back to H.264
+ENCODERS = {'h264': 'libx264', 'hevc': 'libx265', 'vp9': 'libvpx-vp9'}
+AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame', 'opus': 'libopus'}
+FALLBACK_CODEC = 'h264'
+FALLBACK_AUDIO_CODEC = 'aac'
+PIPELINE_VERSION = 1           # Bump when normalize/concat parameters change (invalidates cached files)
+DEFAULT_MEMORY_PER_ENCODE_MB = 1024  # Rough peak RSS of one 1080p x264 encode
+DEFAULT_PRIORITY = 5
+
+
+class StitchError(Exception):
+    """Probing, normalizing or concatenating the scene files failed."""
+
+
+class StitchCancelled(StitchError):
+    """The job was cancelled; its ffmpeg processes have been killed."""
+
+
+def available_memory_mb():
+    """Free physical memory in MB, or None if it cannot be determined (psutil is optional)."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_slot_count(memory_per_encode_mb=DEFAULT_MEMORY_PER_ENCODE_MB):
+    """Concurrent ffmpeg processes this machine can take: bounded by cores and free memory."""
+    slots = os.cpu_count() or 2
+    memory = available_memory_mb()
+    if memory:
+        slots = min(slots, int(memory // memory_per_encode_mb))
+    return max(1, slots)
+
+
+class FfmpegSlots:
+    """Process-wide cap on running ffmpeg processes, shared by all stitch jobs.
+
+    Waiters are served by job priority (lower first), then arrival, so a
+    burst of low-priority stitches cannot starve an urgent one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.busy = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self, priority=DEFAULT_PRIORITY, cancel_event=None):
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            while self.busy >= self.size or self._waiters[0] != ticket:
+                if cancel_event and cancel_event.is_set():
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    raise StitchCancelled("Cancelled while waiting for an ffmpeg slot")
+                self._cond.wait(0.5)
+            heapq.heappop(self._waiters)
+            self.busy += 1
+            self._cond.notify_all()  # The next waiter may fit too
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.busy -= 1
+                self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {'size': self.size, 'busy': self.busy, 'waiting': len(self._waiters)}
+
+
+def _fraction(value):
+    try:
+        return Fraction(value) if value and value != '0/0' else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def probe(path, ffprobe='ffprobe'):
+    """Stream layout of a media file: the fields that must match for a stream-copy concat."""
+    with FFMPEG_SECONDS.time(kind='probe'):
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', path],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT
+        )
+    if result.returncode != 0:
+        FFMPEG_FAILURES.inc(kind='probe')
+        raise StitchError(f"ffprobe failed for {os.path.basename(path)}: {result.stderr.strip()[-300:]}")
+    info = json.loads(result.stdout or '{}')
+    video = next((s for s in info.get('streams', []) if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in info.get('streams', []) if s.get('codec_type') == 'audio'), None)
+    if video is None:
+        raise StitchError(f"{os.path.basename(path)} has no video stream")
+    return {
+        'path': path,
+        'duration': float(info.get('format', {}).get('duration') or 0),
+        'video': (video.get('codec_name'), video.get('width'), video.get('height'), video.get('pix_fmt'),
+                  _fraction(video.get('r_frame_rate')), _fraction(video.get('time_base'))),
+        'audio': (audio.get('codec_name'), int(audio.get('sample_rate') or 0), audio.get('channels'))
+                 if audio else None,
+    }
+
+
+def reference_layout(probes):
+    """The layout most scenes already have; only the others get re-encoded."""
+    counts = collections.Counter((p['video'], p['audio']) for p in probes)
+    video, audio = counts.most_common(1)[0][0]
+    if video[0] not in ENCODERS:
+        video = (FALLBACK_CODEC,) + video[1:]
+    if audio and audio[0] not in AUDIO_ENCODERS:
+        audio = (FALLBACK_AUDIO_CODEC,) + audio[1:]
+    return video, audio
+
+
+def run_ffmpeg(cmd, duration=0, on_progress=None, stall_timeout=DEFAULT_STALL_TIMEOUT, cancel_event=None,
+               kind='ffmpeg'):
+    """Runs ffmpeg with `-progress pipe:1`, killing it only if progress stalls or the job is cancelled.
+
+    `on_progress(fraction)` gets 0..1 when `duration` (seconds of output) is
+    known. Only the last STDERR_TAIL_LINES of stderr are kept. `kind` labels
+    the run in the metrics ('normalize', 'concat').
+    """
+    started = time.monotonic()
+    try:
+        _run_ffmpeg(cmd, duration, on_progress, stall_timeout, cancel_event)
+    except StitchError:
+        FFMPEG_FAILURES.inc(kind=kind)
+        raise
+    finally:
+        FFMPEG_SECONDS.observe(time.monotonic() - started, kind=kind)
+
+
+def _run_ffmpeg(cmd, duration, on_progress, stall_timeout, cancel_event):
+    cmd = cmd[:1] + ['-hide_banner', '-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            encoding='utf-8', errors='replace')
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    last_progress = [time.monotonic()]
+    stalled = threading.Event()
+
+    def drain_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line.rstrip())
+
+    def watchdog():
+        while proc.poll() is None:
+            if cancel_event and cancel_event.is_set():
+                proc.kill()
+                return
+            if time.monotonic() - last_progress[0] > stall_timeout:
+                stalled.set()
+                proc.kill()
+                return
+            time.sleep(0.5)
+
+    threading.Thread(target=drain_stderr, daemon=True).start()
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    for line in proc.stdout:
+        key, _, value = line.strip().partition('=')
+        if key in ('out_time_us', 'out_time_ms', 'progress'):
+            last_progress[0] = time.monotonic()
+        # out_time_ms is in microseconds too (long-standing ffmpeg quirk)
+        if key in ('out_time_us', 'out_time_ms') and duration and on_progress and value.isdigit():
+            on_progress(min(1.0, int(value) / 1e6 / duration))
+    proc.wait()
+
+    if cancel_event and cancel_event.is_set():
+        raise StitchCancelled("Cancelled")
+    if stalled.is_set():
+        raise StitchError(f"ffmpeg made no progress for {stall_timeout}s: {' | '.join(list(stderr_tail)[-3:])}")
+    if proc.returncode != 0:
+        raise StitchError(f"ffmpeg exited with {proc.returncode}: {' | '.join(list(stderr_tail)[-5:])}")
+
+
+class Stitcher:
+    """Probe → normalize → concat pipeline behind `stitch_videos`.
+
+    Scenes are probed in parallel; scenes whose stream layout differs from
+    the majority are re-encoded to it in parallel, and then everything is
+    joined with the fast `-c copy` concat demuxer. Every ffmpeg process of
+    every job holds one of the shared `slots`, sized by cores and memory.
+
+    With a SegmentCache, normalized segments and finished outputs are reused
+    by content hash: a stitch of inputs seen before is a file copy.
+    """
+
+    def __init__(self, workers=None, stall_timeout=DEFAULT_STALL_TIMEOUT, ffmpeg='ffmpeg', ffprobe='ffprobe',
+                 cache=None, memory_per_encode_mb=DEFAULT_MEMORY_PER_ENCODE_MB):
+        self.workers = workers or default_slot_count(memory_per_encode_mb)
+        self.slots = FfmpegSlots(self.workers)
+        self.stall_timeout = stall_timeout
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.cache = cache
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a stitcher from the 'ffmpeg' section of agent_config.json."""
+        ffmpeg_config = config.get('ffmpeg', {})
+        return cls(
+            workers=ffmpeg_config.get('workers'),
+            stall_timeout=ffmpeg_config.get('stallTimeout', DEFAULT_STALL_TIMEOUT),
+            ffmpeg=ffmpeg_config.get('ffmpegPath', 'ffmpeg'),
+            ffprobe=ffmpeg_config.get('ffprobePath', 'ffprobe'),
+            cache=SegmentCache.from_config(config),
+            memory_per_encode_mb=ffmpeg_config.get('memoryPerEncodeMB', DEFAULT_MEMORY_PER_ENCODE_MB),
+        )
+
+    def probe_all(self, paths):
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+            return list(pool.map(lambda p: probe(p, self.ffprobe), paths))
+
+    def normalize_cmd(self, source, target, output_path, threads):
+        """ffmpeg command that re-encodes `source` (a probe) to the `target` layout."""
+        (codec, width, height, pix_fmt, fps, time_base), audio = target
+        filters = [f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+                   f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2", "setsar=1"]
+        if fps:
+            filters.append(f"fps={fps.numerator}/{fps.denominator}")
+        cmd = [self.ffmpeg, '-y', '-i', source['path']]
+        if audio and source['audio'] is None:
+            # The concat needs the same streams everywhere: give silent scenes a silent track
+            cmd += ['-f', 'lavfi', '-i', f"anullsrc=r={audio[1]}:cl={'mono' if audio[2] == 1 else 'stereo'}",
+                    '-shortest']
+        cmd += ['-map', '0:v:0']
+        if audio:
+            cmd += ['-map', '1:a:0' if source['audio'] is None else '0:a:0',
+                    '-c:a', AUDIO_ENCODERS[audio[0]], '-ar', str(audio[1]), '-ac', str(audio[2])]
+        else:
+            cmd += ['-an']
+        cmd += ['-vf', ','.join(filters), '-c:v', ENCODERS[codec], '-threads', str(threads)]
+        if pix_fmt:
+            cmd += ['-pix_fmt', pix_fmt]
+        if time_base:
+            cmd += ['-video_track_timescale', str(time_base.denominator)]
+        return cmd + [output_path]
+
+    def normalize(self, probes, target, work_dir, log, digests=None, job=None):
+        """Re-encodes the non-conforming scenes. Returns (files to concatenate in order, encodes run)."""
+        job = job or {}
+        outliers = [i for i, p in enumerate(probes) if (p['video'], p['audio']) != target]
+        files = [p['path'] for p in probes]
+
+        segment_keys = {}
+        pinned = job.setdefault('pinned', [])  # Segments concat will read: unpinned by stitch() afterwards
+        if self.cache and digests:
+            for index in list(outliers):
+                segment_keys[index] = cache_key('segment', PIPELINE_VERSION, digests[index], target)
+                cached = self.cache.get('segments', segment_keys[index], pin=True)
+                if cached:
+                    pinned.append(segment_keys[index])
+                    files[index] = cached
+                    outliers.remove(index)
+        if not outliers:
+            return files, 0
+
+        parallel = min(self.workers, len(outliers))
+        threads = max(1, (os.cpu_count() or 2) // self.slots.size)
+        log(f"🔄 Re-encoding {len(outliers)}/{len(probes)} non-conforming scene(s) (up to {parallel} at a time)")
+
+        done = {index: 0.0 for index in outliers}
+        def encode_progress(index):
+            def report(fraction):
+                done[index] = fraction
+                if job.get('on_progress'):
+                    job['on_progress']('normalize', sum(done.values()) / len(done))
+            return report
+
+        def encode(index):
+            output_path = os.path.join(work_dir, f"norm_{index:03d}.mp4")
+            with self.slots.slot(job.get('priority', DEFAULT_PRIORITY), job.get('cancel_event')):
+                run_ffmpeg(self.normalize_cmd(probes[index], target, output_path, threads),
+                           probes[index]['duration'], encode_progress(index), self.stall_timeout,
+                           job.get('cancel_event'), kind='normalize')
+            if index in segment_keys:
+                output_path = self.cache.put('segments', segment_keys[index], output_path, move=True, pin=True)
+                pinned.append(segment_keys[index])
+            return index, output_path
+
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            for index, output_path in pool.map(encode, outliers):
+                files[index] = output_path
+        return files, len(outliers)
+
+    def concat(self, files, output_path, duration, list_file, job=None):
+        """Stream-copy concat. `list_file` is the job's own manifest path, never shared."""
+        job = job or {}
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for path in files:
+                # Forward slashes and escaped quotes keep the concat demuxer happy on Windows
+                safe_path = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+                f.write(f"file '{safe_path}'\n")
+        on_progress = job.get('on_progress')
+        with self.slots.slot(job.get('priority', DEFAULT_PRIORITY), job.get('cancel_event')):
+            run_ffmpeg([self.ffmpeg, '-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', output_path],
+                       duration, on_progress and (lambda fraction: on_progress('concat', fraction)),
+                       self.stall_timeout, job.get('cancel_event'), kind='concat')
+
+    def digest_all(self, paths):
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+            return list(pool.map(self.cache.file_digest, paths))
+
+    def stitch(self, scene_files, output_path, log=print, on_progress=None, job_id=None,
+               priority=DEFAULT_PRIORITY, cancel_event=None):
+        """Full pipeline. Returns a summary dict; raises StitchError (StitchCancelled) on failure.
+
+        `on_progress(stage, fraction)` is called with stage 'normalize' or 'concat'.
+        """
+        started = time.monotonic()
+        job = {'on_progress': on_progress, 'priority': priority, 'cancel_event': cancel_event}
+        summary = {'scenes': len(scene_files), 'reencoded': 0, 'cached': False}
+
+        digests = output_key = None
+        if self.cache:
+            digests = self.digest_all(scene_files)
+            output_key = cache_key('output', PIPELINE_VERSION, digests)
+            cached = self.cache.get('outputs', output_key)
+            if cached:
+                log("♻️ Same scenes as an earlier stitch: reusing cached output")
+                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+                shutil.copyfile(cached, output_path)
+                return {**summary, 'cached': True, 'elapsedSeconds': round(time.monotonic() - started, 2)}
+
+        with span('probe', files=len(scene_files)):
+            probes = self.probe_all(scene_files)
+        if cancel_event and cancel_event.is_set():
+            raise StitchCancelled("Cancelled")
+        target = reference_layout(probes)
+        duration = sum(p['duration'] for p in probes)
+
+        # Each job gets its own scratch dir, so concurrent jobs never share a manifest
+        scratch_root = self.cache.work_root if self.cache else os.path.dirname(os.path.abspath(output_path))
+        work_dir = tempfile.mkdtemp(prefix=f"{job_id or 'stitch'}-", dir=scratch_root)
+        try:
+            with span('normalize') as normalize_span:
+                files, summary['reencoded'] = self.normalize(probes, target, work_dir, log, digests, job)
+                if normalize_span:
+                    normalize_span.attrs['reencoded'] = summary['reencoded']
+            with span('concat', files=len(files)):
+                self.concat(files, output_path, duration, os.path.join(work_dir, 'concat.txt'), job)
+        finally:
+            if self.cache:
+                self.cache.unpin('segments', job.get('pinned', []))
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if self.cache:
+            self.cache.put('outputs', output_key, output_path)
+        summary.update({
+            'durationSeconds': round(duration, 2),
+            'elapsedSeconds': round(time.monotonic() - started, 2),
+        })
+        return summary
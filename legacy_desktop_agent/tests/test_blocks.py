@@ -0,0 +1,92 @@
+import asyncio
+
+from blocks import BlockRunner, load_block_file, normalize_scenes, shard_scenes
+from pacing import StepPacer
+
+
+class FakeLocator:
+    def __init__(self, texts):
+        self.texts = texts
+
+    async def all_inner_texts(self):
+        return self.texts
+
+
+class FakeKeyboard:
+    async def press(self, key):
+        pass
+
+
+class FakePage:
+    """Just enough of a Playwright page for a block to run: every element exists, progress is done."""
+
+    def __init__(self):
+        self.clicks = []
+        self.keyboard = FakeKeyboard()
+
+    def on(self, event, handler):
+        pass
+
+    async def goto(self, url):
+        pass
+
+    async def wait_for_load_state(self, state, timeout=None):
+        pass
+
+    async def wait_for_selector(self, selector, state=None, timeout=None):
+        pass
+
+    async def click(self, selector):
+        self.clicks.append(selector)
+
+    async def fill(self, selector, value):
+        pass
+
+    async def expose_function(self, name, fn):
+        pass
+
+    async def add_init_script(self, script):
+        pass
+
+    async def evaluate(self, script, arg=None):
+        return False if 'watch(' in script else 0  # No page observer: progress falls back to polling
+
+    def locator(self, selector):
+        return FakeLocator(['100%'])
+
+
+def run_block(block, scenes, before_scene=None):
+    page = FakePage()
+    pacer = StepPacer('fast', overrides={'quietMs': 0})
+    runner = BlockRunner(block, pacer, log=lambda message: None, before_scene=before_scene)
+    done = asyncio.run(runner.run(page, normalize_scenes(scenes), {}))
+    return page, done
+
+
+def test_parallel_video_block_charges_one_quota_unit_per_scene():
+    charged = []
+
+    async def before_scene():
+        charged.append(1)
+
+    page, done = run_block(load_block_file('PARALLEL_VIDEO_GEN'), ['a', 'b', 'c'], before_scene)
+
+    assert sorted(done) == [0, 1, 2]
+    assert len(charged) == 3  # Not again for the download loop over the same scenes
+    assert page.clicks.count("button:has-text('Download')") == 3
+
+
+def test_loop_without_value_iterates_the_tab_scenes():
+    block = {'steps': [{'action': 'loop_items', 'selector': '.card',
+                        'loopSteps': [{'action': 'click', 'selector': '{{scene.videoElement}}'}]}]}
+    page, done = run_block(block, ['a', 'b'])
+
+    assert page.clicks == ['.card >> nth=0', '.card >> nth=1']
+    assert sorted(done) == [0, 1]
+
+
+def test_shard_scenes_splits_into_contiguous_near_equal_shards():
+    assert shard_scenes(list(range(10)), 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert shard_scenes(list(range(2)), 4) == [[0], [1]]
+    assert shard_scenes(list(range(3)), 0) == [[0, 1, 2]]
+    assert shard_scenes([], 4) == []
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from browser_pool import BrowserPool
+from memory import MemoryPressureError, MemoryWatchdog
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    def on(self, event, handler):
+        pass
+
+    async def cookies(self, url):
+        return []
+
+    async def close(self):
+        await asyncio.sleep(0.05)  # Chromium takes a while to let go of the profile directory
+        self.closed = True
+
+
+class FakeChromium:
+    def __init__(self, slow=()):
+        self.slow = slow
+        self.launches = []
+        self.contexts = {}
+
+    async def launch_persistent_context(self, user_data_dir, **options):
+        self.launches.append(user_data_dir)
+        if user_data_dir in self.slow:
+            await asyncio.sleep(0.3)
+        if any(not context.closed for context in self.contexts.get(user_data_dir, [])):
+            raise RuntimeError(f"{user_data_dir} is already in use by another browser")
+        context = FakeContext()
+        self.contexts.setdefault(user_data_dir, []).append(context)
+        return context
+
+
+def started_pool(chromium, **options):
+    pool = BrowserPool(**options)
+    pool._playwright = type('Playwright', (), {'chromium': chromium})()
+    pool._cond = asyncio.Condition()
+    return pool
+
+
+def test_cold_start_does_not_block_warm_leases(tmp_path):
+    warm, cold = str(tmp_path / 'warm'), str(tmp_path / 'cold')
+
+    async def scenario():
+        pool = started_pool(FakeChromium(slow={cold}))
+        await pool._release(await pool._acquire(warm))
+        launching = asyncio.create_task(pool._acquire(cold))
+        await asyncio.sleep(0.05)  # The cold profile is now launching
+
+        entry = await asyncio.wait_for(pool._acquire(warm), 0.1)
+        await asyncio.wait_for(pool._release(entry), 0.1)
+        assert not launching.done()
+        await pool._release(await launching)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_leases_share_one_launch(tmp_path):
+    profile = str(tmp_path / 'p')
+
+    async def scenario():
+        chromium = FakeChromium(slow={profile})
+        pool = started_pool(chromium)
+        entries = await asyncio.gather(*(pool._acquire(profile) for _ in range(3)))
+        assert chromium.launches == [profile]
+        assert all(entry is entries[0] for entry in entries) and entries[0]['leases'] == 3
+
+    asyncio.run(scenario())
+
+
+def test_failed_launch_lets_the_next_caller_retry(tmp_path):
+    profile = str(tmp_path / 'p')
+
+    class FlakyChromium(FakeChromium):
+        async def launch_persistent_context(self, user_data_dir, **options):
+            self.launches.append(user_data_dir)
+            if len(self.launches) == 1:
+                raise RuntimeError('profile locked')
+            return FakeContext()
+
+    async def scenario():
+        pool = started_pool(FlakyChromium())
+        first, second = await asyncio.gather(pool._acquire(profile), pool._acquire(profile), return_exceptions=True)
+        assert isinstance(first, RuntimeError) and second['leases'] == 1
+        assert pool.snapshot()['open'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_lru_idle_context_is_evicted_when_full(tmp_path):
+    a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+
+    async def scenario():
+        pool = started_pool(FakeChromium(), max_contexts=1)
+        entry = await pool._acquire(a)
+        await pool._release(entry)
+        await pool._release(await pool._acquire(b))
+        assert entry['context'].closed and list(pool._entries) == [b]
+
+    asyncio.run(scenario())
+
+
+def test_flagged_context_with_an_active_lease_is_not_reused(tmp_path):
+    profile = str(tmp_path / 'p')
+
+    async def scenario():
+        chromium = FakeChromium()
+        pool = started_pool(chromium)
+        busy = await pool._acquire(profile)
+        async with pool._cond:
+            assert pool._recycle(profile, 'served 50 jobs') is None  # Leased: closes when it comes back
+
+        waiting = asyncio.create_task(pool._acquire(profile))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()  # No new lease on the flagged context
+
+        await pool._release(busy)
+        fresh = await asyncio.wait_for(waiting, 1)
+        assert fresh is not busy
+        assert busy['context'].closed
+        assert chromium.launches == [profile, profile]
+        await pool._release(fresh)
+
+    asyncio.run(scenario())
+
+
+def test_lease_under_memory_pressure_gives_up_after_max_lease_wait(tmp_path):
+    watchdog = MemoryWatchdog(path=None, max_lease_wait=0.1)
+    watchdog.pressure = True
+
+    async def scenario():
+        pool = started_pool(FakeChromium())
+        pool.watchdog = watchdog
+        with pytest.raises(MemoryPressureError, match='waiting 0.1s for memory'):
+            await asyncio.wait_for(pool._acquire(str(tmp_path / 'p')), 1)
+        assert not pool._entries
+
+    asyncio.run(scenario())
+    assert watchdog.stats['leasesRefused'] == 1
+
+
+def test_lease_proceeds_once_memory_recovers(tmp_path):
+    watchdog = MemoryWatchdog(path=None, max_lease_wait=5)
+    watchdog.pressure = True
+
+    async def scenario():
+        pool = started_pool(FakeChromium())
+        pool.watchdog = watchdog
+        waiting = asyncio.create_task(pool._acquire(str(tmp_path / 'p')))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        watchdog.pressure = False
+        async with pool._cond:
+            pool._cond.notify_all()  # As after a memory sample
+        await pool._release(await asyncio.wait_for(waiting, 1))
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+from job_queue import JobQueue, dedupe_key
+
+
+def job(job_id, job_type='RECIPE', lane='browser', **data):
+    return {'job_id': job_id, 'type': job_type, 'lane': lane, 'data': {'projectId': 'p', **data}}
+
+
+def test_identical_jobs_are_coalesced_into_the_first():
+    queue = JobQueue()
+    assert queue.push(job('a', recipeId='r', variables={'x': 1})) is None
+    assert queue.push(job('b', recipeId='r', variables={'x': 1})) == 'a'
+    assert queue.push(job('c', recipeId='r', variables={'x': 2})) is None
+
+    assert len(queue) == 2
+    assert queue.job_ids() == ['a', 'b', 'c']
+    assert queue.pop_ready(lambda j: True)['duplicates'] == ['b']
+
+
+def test_explicit_dedupe_key_wins_over_payload():
+    assert dedupe_key({'dedupeKey': 'k', 'recipeId': 'r1'}) == dedupe_key({'dedupeKey': 'k', 'recipeId': 'r2'})
+    assert dedupe_key({'recipeId': 'r', 'projectId': 'p1'}) != dedupe_key({'recipeId': 'r', 'projectId': 'p2'})
+
+
+def test_same_job_id_is_queued_once():
+    queue = JobQueue()
+    queue.push(job('a', recipeId='r'))
+    assert queue.push(job('a', recipeId='r')) is None
+    assert len(queue) == 1
+
+
+def test_jobs_pop_by_type_priority_then_created_at():
+    queue = JobQueue()
+    queue.push(job('recipe', recipeId='r', createdAt='2024-01-01T00:00:00Z'))
+    queue.push(job('late-record', 'CMD_RECORD', recipeId='x', createdAt='2024-01-01T00:02:00Z'))
+    queue.push(job('early-record', 'CMD_RECORD', recipeId='y', createdAt='2024-01-01T00:01:00Z'))
+    queue.push(job('urgent', recipeId='z', priority=-1))
+
+    order = [queue.pop_ready(lambda j: True)['job_id'] for _ in range(4)]
+    assert order == ['urgent', 'early-record', 'late-record', 'recipe']
+
+
+def test_a_popped_job_no_longer_absorbs_duplicates():
+    queue = JobQueue()
+    queue.push(job('a', recipeId='r'))
+    queue.pop_ready(lambda j: True)
+    assert queue.push(job('b', recipeId='r')) is None
+
+
+def test_pop_ready_skips_jobs_that_cannot_start():
+    queue = JobQueue()
+    queue.push(job('stitch', 'CMD_STITCH_VIDEO', lane='cpu', outputPath='o.mp4'))
+    queue.push(job('recipe', recipeId='r'))
+
+    assert queue.lane_depth('cpu') == 1
+    assert queue.pop_ready(lambda j: j['lane'] == 'browser')['job_id'] == 'recipe'
+    assert queue.remove('stitch')['job_id'] == 'stitch'
+    assert len(queue) == 0
+
+
+def test_block_jobs_with_different_payloads_do_not_coalesce():
+    queue = JobQueue()
+    scenes = [{'index': 1, 'prompt': 'a cat'}]
+    assert queue.push(job('a', 'CMD_RUN_BLOCK', blockFile='PARALLEL_VIDEO_GEN', scenes=scenes)) is None
+    assert queue.push(job('b', 'CMD_RUN_BLOCK', blockFile='OTHER_BLOCK', scenes=scenes)) is None
+    assert queue.push(job('c', 'CMD_RUN_BLOCK', blockFile='PARALLEL_VIDEO_GEN', scenes=scenes,
+                          parallelTabs=2)) is None
+    assert queue.push(job('d', 'CMD_OPEN_BROWSER', profile='p-flow2')) is None
+    assert queue.push(job('e', 'CMD_OPEN_BROWSER', profile='p-flow3')) is None
+    assert len(queue) == 5
+
+
+def test_lease_and_timestamp_fields_do_not_split_duplicates():
+    first = {'projectId': 'p', 'recipeId': 'r', 'status': 'CLAIMED', 'leaseOwner': 'a', 'attempts': 0,
+             'createdAt': '2024-01-01T00:00:00Z'}
+    second = {'projectId': 'p', 'recipeId': 'r', 'status': 'CLAIMED', 'leaseOwner': 'a', 'attempts': 2,
+              'createdAt': '2024-01-01T00:05:00Z', 'lastLeaseOwner': 'b'}
+    assert dedupe_key(first) == dedupe_key(second)
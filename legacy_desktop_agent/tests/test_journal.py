@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+
+from journal import JobJournal
+
+
+class NotFound(Exception):
+    pass
+
+
+def test_update_that_keeps_failing_is_dropped_after_max_attempts():
+    journal = JobJournal(':memory:', max_attempts=3)
+    journal.enqueue('job', {'status': 'RUNNING'})
+    journal.enqueue('job', {'status': 'COMPLETED'})
+    sent = []
+
+    def apply(job_id, fields):
+        if fields['status'] == 'RUNNING':
+            raise ValueError('rejected')
+        sent.append(fields['status'])
+
+    assert journal.flush(apply) == 2
+    assert journal.flush(apply) == 2
+    assert sent == []  # Later updates wait behind the failing one
+    assert journal.flush(apply) == 0
+    assert sent == ['COMPLETED']
+    assert journal.snapshot()['dropped'] == 1
+
+
+def test_update_for_deleted_job_is_dropped_at_once():
+    journal = JobJournal(':memory:')
+    journal.enqueue('gone', {'status': 'RUNNING'})
+
+    def apply(job_id, fields):
+        raise NotFound('no document')
+
+    assert journal.flush(apply) == 0
+    assert journal.snapshot()['dropped'] == 1
+
+
+def test_queued_updates_survive_a_restart_in_order(tmp_path):
+    path = str(tmp_path / 'journal.db')
+    journal = JobJournal(path)
+    ended = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    journal.enqueue('job', {'status': 'RUNNING'})
+    journal.enqueue('job', {'status': 'COMPLETED', 'endTime': ended})
+    journal.close()
+
+    sent = []
+    assert JobJournal(path).flush(lambda job_id, fields: sent.append((job_id, fields))) == 0
+    assert sent == [('job', {'status': 'RUNNING'}), ('job', {'status': 'COMPLETED', 'endTime': ended})]
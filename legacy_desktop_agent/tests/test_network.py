@@ -0,0 +1,65 @@
+import asyncio
+
+from network import HttpCache, JobNetwork, ResourcePolicy
+
+
+class FakeRequest:
+    def __init__(self, url, resource_type='script', method='GET'):
+        self.url = url
+        self.resource_type = resource_type
+        self.method = method
+
+
+class FakeRoute:
+    def __init__(self, request, fetch_error=None, continue_error=None):
+        self.request = request
+        self.fetch_error = fetch_error
+        self.continue_error = continue_error
+        self.calls = []
+
+    async def fetch(self):
+        self.calls.append('fetch')
+        raise self.fetch_error
+
+    async def continue_(self):
+        self.calls.append('continue')
+        if self.continue_error:
+            raise self.continue_error
+
+    async def abort(self, reason=None):
+        self.calls.append('abort')
+
+
+def job_network(tmp_path):
+    return JobNetwork(ResourcePolicy(block=(), block_urls=()), None, HttpCache(str(tmp_path)), {})
+
+
+def test_failed_fetch_hands_the_request_back_to_chromium(tmp_path):
+    route = FakeRoute(FakeRequest('https://cdn.example/app.js'), fetch_error=TimeoutError('net::ERR_TIMED_OUT'))
+    asyncio.run(job_network(tmp_path)._handle(route))
+    assert route.calls == ['fetch', 'continue']
+
+
+def test_request_is_aborted_when_it_cannot_be_continued(tmp_path):
+    route = FakeRoute(FakeRequest('https://cdn.example/app.js'), fetch_error=OSError('reset'),
+                      continue_error=RuntimeError('navigation aborted'))
+    asyncio.run(job_network(tmp_path)._handle(route))
+    assert route.calls == ['fetch', 'continue', 'abort']
+
+
+def test_closed_page_is_left_alone(tmp_path):
+    route = FakeRoute(FakeRequest('https://cdn.example/app.js'),
+                      fetch_error=RuntimeError('Target page, context or browser has been closed'))
+    asyncio.run(job_network(tmp_path)._handle(route))
+    assert route.calls == ['fetch']
+
+
+def test_cookies_are_not_shared_through_the_cache(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    headers = {'cache-control': 'public, max-age=3600', 'content-type': 'text/javascript',
+               'set-cookie': '__cf_bm=abc; path=/', 'Set-Cookie2': 'old=1'}
+    assert cache.put('https://cdn.example/app.js', 200, headers, b'console.log(1)')
+
+    status, cached_headers, body = cache.get('https://cdn.example/app.js')
+    assert (status, body) == (200, b'console.log(1)')
+    assert cached_headers == {'cache-control': 'public, max-age=3600', 'content-type': 'text/javascript'}
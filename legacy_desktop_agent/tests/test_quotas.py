@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from quotas import QuotaExceeded, QuotaScheduler
+
+
+def test_plan_never_opens_more_tabs_than_width():
+    scheduler = QuotaScheduler(path=None)
+    assignments, over_quota = scheduler.plan('example.com', ['a', 'b', 'c', 'd', 'e'], list(range(10)), 3)
+
+    assert [profile for profile, _, _ in assignments] == ['a', 'b', 'c']
+    assert sum(tabs for _, _, tabs in assignments) == 3
+    assert sum(len(scenes) for _, scenes, _ in assignments) == 10
+    assert over_quota == []
+
+
+def test_plan_splits_width_over_profiles():
+    scheduler = QuotaScheduler(path=None)
+    assignments, _ = scheduler.plan('example.com', ['a', 'b'], list(range(10)), 5)
+
+    assert [(profile, len(scenes), tabs) for profile, scenes, tabs in assignments] == [('a', 5, 3), ('b', 5, 2)]
+
+
+def test_plan_spreads_scenes_by_remaining_daily_quota(tmp_path):
+    scheduler = QuotaScheduler(sites={'example.com': {'dailyPerProfile': 3}}, path=str(tmp_path / 'quotas.json'))
+    assignments, over_quota = scheduler.plan('www.example.com', ['a', 'b'], list(range(8)), 4)
+
+    assert [(profile, scenes) for profile, scenes, _ in assignments] == [('a', [0, 1, 2]), ('b', [3, 4, 5])]
+    assert over_quota == [6, 7]
+
+
+def test_acquire_counts_generations_until_the_daily_quota_is_used(tmp_path):
+    path = str(tmp_path / 'quotas.json')
+    scheduler = QuotaScheduler(sites={'example.com': {'dailyPerProfile': 2}}, path=path)
+
+    async def scenario():
+        await scheduler.acquire('example.com', 'profiles/a')
+        await scheduler.acquire('example.com', 'profiles/a')
+        with pytest.raises(QuotaExceeded):
+            await scheduler.acquire('example.com', 'profiles/a')
+        await scheduler.acquire('example.com', 'profiles/b')
+
+    asyncio.run(scenario())
+    assert scheduler.remaining('example.com', 'a') == 0
+    assert scheduler.stats['exhausted'] == 1
+
+    restarted = QuotaScheduler(sites={'example.com': {'dailyPerProfile': 2}}, path=path)
+    assert restarted.remaining('example.com', 'a') == 0  # A restart does not hand the quota back
+    assert restarted.remaining('example.com', 'b') == 1
+
+
+def test_acquire_waits_for_the_rate_limit():
+    scheduler = QuotaScheduler(sites={'example.com': {'perMinute': 600, 'burst': 1}}, path=None)
+
+    async def scenario():
+        started = time.monotonic()
+        await scheduler.acquire('example.com', 'a')
+        await scheduler.acquire('example.com', 'a')  # The burst is spent: one token refills in 0.1 s
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+    assert scheduler.stats['throttled'] == 1
+
+
+def test_sites_without_limits_are_not_metered():
+    scheduler = QuotaScheduler(path=None)
+    asyncio.run(scheduler.acquire('example.com', 'a'))
+
+    assert scheduler.stats['acquired'] == 0
+    assert scheduler.remaining('example.com', 'a') is None
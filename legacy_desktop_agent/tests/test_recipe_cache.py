@@ -0,0 +1,24 @@
+import pytest
+
+from recipe_cache import selector_problem
+
+
+@pytest.mark.parametrize('selector', [
+    "text=Don't ask again",
+    "button:has-text(\"Don't ask again\")",
+    '[aria-label="Close (Esc)"]',
+    "input[placeholder='What\"s new?']",
+    '#submit >> nth=0',
+])
+def test_valid_selectors_pass(selector):
+    assert selector_problem(selector) is None
+
+
+@pytest.mark.parametrize('selector, problem', [
+    ('   ', "empty selector"),
+    ('button:has-text("Save)', 'unterminated " quote'),
+    ('a[href="/x"', "unclosed '['"),
+    ('div > span)', "unbalanced ')'"),
+])
+def test_broken_selectors_are_flagged(selector, problem):
+    assert selector_problem(selector) == problem
@@ -0,0 +1,51 @@
+import os
+
+from segment_cache import SegmentCache, cache_key
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_least_recently_used_entries_are_evicted_past_the_budget(tmp_path):
+    cache = SegmentCache(str(tmp_path / 'cache'), max_bytes=250)
+    a = cache.put('segments', 'a', write(tmp_path / 'a.mp4', 100))
+    cache.put('segments', 'b', write(tmp_path / 'b.mp4', 100))
+    assert cache.get('segments', 'a') == a  # Now b is the least recently used
+
+    cache.put('segments', 'c', write(tmp_path / 'c.mp4', 100))
+
+    assert cache.get('segments', 'b') is None and not os.path.exists(str(tmp_path / 'cache' / 'segments' / 'b.mp4'))
+    assert cache.get('segments', 'a') and cache.get('segments', 'c')
+    assert cache.snapshot()['evictions'] == 1
+
+
+def test_pinned_segments_survive_eviction_until_unpinned(tmp_path):
+    cache = SegmentCache(str(tmp_path / 'cache'), max_bytes=250)
+    # One stitch moves its normalized segments in and still has to concatenate them
+    first = cache.put('segments', 'a', write(tmp_path / 'a.mp4', 100), move=True, pin=True)
+    second = cache.put('segments', 'b', write(tmp_path / 'b.mp4', 100), move=True, pin=True)
+    cache.put('segments', 'c', write(tmp_path / 'c.mp4', 100))  # Another job's segment pushes the cache over budget
+
+    assert os.path.exists(first) and os.path.exists(second)
+
+    cache.unpin('segments', ['a', 'b'])
+    cache.put('segments', 'd', write(tmp_path / 'd.mp4', 100))
+    assert not os.path.exists(first)
+
+
+def test_pins_are_counted_per_job(tmp_path):
+    cache = SegmentCache(str(tmp_path / 'cache'), max_bytes=150)
+    path = cache.put('segments', 'a', write(tmp_path / 'a.mp4', 100), pin=True)
+    assert cache.get('segments', 'a', pin=True) == path  # A second stitch reuses the segment
+
+    cache.unpin('segments', ['a'])
+    cache.put('segments', 'b', write(tmp_path / 'b.mp4', 100))
+    assert os.path.exists(path)  # Still pinned by the second stitch
+
+
+def test_cache_key_is_stable_and_order_sensitive():
+    assert cache_key('segment', 1, 'abc') == cache_key('segment', 1, 'abc')
+    assert cache_key('segment', 1, 'abc') != cache_key('segment', 'abc', 1)
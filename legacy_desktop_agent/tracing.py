@@ -0,0 +1,259 @@
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import shutil
+import time
+
+# --- CONFIGURATION ---
+DEFAULT_ARTIFACTS_DIR = os.path.join(os.getcwd(), "artifacts", "traces")
+DEFAULT_KEEP = 50              # Traced jobs kept on disk; older ones are deleted
+DEFAULT_TOP = 20               # Rows in the slowest-steps report
+TRACE_FILE = 'trace.json'
+PLAYWRIGHT_TRACE_FILE = 'playwright-trace.zip'
+
+# Innermost open span of the job running in the current task/thread (None = not traced)
+_current_span = contextvars.ContextVar('trace_span', default=None)
+_current_trace = contextvars.ContextVar('job_trace', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'error', 'children')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.monotonic()
+        self.end = None
+        self.error = None
+        self.children = []
+
+    @property
+    def seconds(self):
+        return (self.end or time.monotonic()) - self.start
+
+    def to_dict(self, origin):
+        node = {'name': self.name, 'start': round(self.start - origin, 3), 'seconds': round(self.seconds, 3)}
+        if self.attrs:
+            node['attrs'] = self.attrs
+        if self.error:
+            node['error'] = self.error
+        if self.children:
+            node['children'] = [child.to_dict(origin) for child in self.children]
+        return node
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Records a child span of the current one. A no-op outside a traced job.
+
+    Works across awaits: asyncio tasks and `to_thread` calls inherit the
+    span that was current when they were created.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, {k: v for k, v in attrs.items() if v not in (None, '')})
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = child.error or f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        child.end = time.monotonic()
+        _current_span.reset(token)
+
+
+def mark_error(error):
+    """Flags the current span as failed (for errors that are caught and handled)."""
+    current = _current_span.get()
+    if current is not None and current.error is None:
+        current.error = f"{type(error).__name__}: {error}"
+
+
+async def attach_context(context):
+    """Starts a Playwright trace on `context` if the current job asked for one."""
+    trace = _current_trace.get()
+    if trace is not None:
+        await trace.start_playwright(context)
+
+
+class JobTrace:
+    """Span tree (and optionally a Playwright trace) of one job, saved to `<dir>/<job_id>/`.
+
+    Opt-in per job with `trace: true` or `trace: {"playwright": true}` on the
+    agent_jobs document. Code records spans through the module-level `span()`,
+    so nothing has to pass the trace around.
+    """
+
+    def __init__(self, job_id, job_type, root_dir=DEFAULT_ARTIFACTS_DIR, playwright=False, keep=DEFAULT_KEEP):
+        self.job_id = job_id
+        self.root = Span('job', {'jobId': job_id, 'type': job_type})
+        self.dir = os.path.join(root_dir, job_id)
+        self.root_dir = root_dir
+        self.playwright = playwright
+        self.keep = keep
+        self.warnings = []
+        self._traced_context = None
+
+    @classmethod
+    def for_job(cls, config, job_id, job_data, job_type=None):
+        """A trace for the job if its document asks for one, else None ('tracing' config section)."""
+        requested = job_data.get('trace')
+        if not requested:
+            return None
+        options = requested if isinstance(requested, dict) else {}
+        tracing_config = config.get('tracing', {})
+        return cls(
+            job_id,
+            job_type or job_data.get('recipeId'),
+            root_dir=tracing_config.get('dir', DEFAULT_ARTIFACTS_DIR),
+            playwright=options.get('playwright', tracing_config.get('playwright', False)),
+            keep=tracing_config.get('keep', DEFAULT_KEEP),
+        )
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Makes this the trace of the current task/thread; the root span covers the with-block."""
+        span_token = _current_span.set(self.root)
+        trace_token = _current_trace.set(self)
+        try:
+            yield self
+        except BaseException as e:
+            self.root.error = self.root.error or f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.root.end = time.monotonic()
+            _current_trace.reset(trace_token)
+            _current_span.reset(span_token)
+
+    async def start_playwright(self, context):
+        if not self.playwright or self._traced_context is not None:
+            return
+        try:
+            await context.tracing.start(screenshots=True, snapshots=True)
+            self._traced_context = context
+        except Exception as e:
+            # Only one trace per browser context: another traced job may hold it
+            self.playwright = False
+            self.warnings.append(f"Playwright trace not started: {e}")
+
+    async def stop_playwright(self):
+        if self._traced_context is None:
+            return
+        context, self._traced_context = self._traced_context, None
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            await context.tracing.stop(path=os.path.join(self.dir, PLAYWRIGHT_TRACE_FILE))
+        except Exception as e:
+            self.warnings.append(f"Playwright trace not saved: {e}")
+
+    def steps(self):
+        """Flat list of the job's step spans."""
+        return [step_row(s) for s in self.root.walk() if s.name == 'step']
+
+    def save(self, top=5):
+        """Writes trace.json and prunes old traces. Returns a short summary for the job document."""
+        os.makedirs(self.dir, exist_ok=True)
+        document = {
+            'jobId': self.job_id,
+            'savedAt': time.time(),
+            'totalSeconds': round(self.root.seconds, 3),
+            'warnings': self.warnings,
+            'spans': self.root.to_dict(self.root.start),
+        }
+        with open(os.path.join(self.dir, TRACE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=1, default=str)
+        prune_traces(self.root_dir, self.keep)
+
+        slowest = sorted(self.steps(), key=lambda row: row['seconds'], reverse=True)[:top]
+        summary = {'dir': self.dir, 'totalSeconds': document['totalSeconds'], 'slowestSteps': slowest}
+        if os.path.exists(os.path.join(self.dir, PLAYWRIGHT_TRACE_FILE)):
+            summary['playwrightTrace'] = os.path.join(self.dir, PLAYWRIGHT_TRACE_FILE)
+        if self.warnings:
+            summary['warnings'] = self.warnings
+        return summary
+
+
+def step_row(step):
+    attrs = step.attrs
+    return {
+        'action': attrs.get('action'),
+        'target': attrs.get('selector') or attrs.get('url') or attrs.get('label'),
+        'seconds': round(step.seconds, 3),
+        'error': step.error,
+    }
+
+
+def _trace_dirs(root_dir):
+    if not os.path.isdir(root_dir):
+        return []
+    dirs = [os.path.join(root_dir, name) for name in os.listdir(root_dir)]
+    dirs = [d for d in dirs if os.path.isfile(os.path.join(d, TRACE_FILE))]
+    return sorted(dirs, key=lambda d: os.path.getmtime(os.path.join(d, TRACE_FILE)))
+
+
+def prune_traces(root_dir, keep=DEFAULT_KEEP):
+    dirs = _trace_dirs(root_dir)
+    for old in dirs[:max(0, len(dirs) - keep)]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _iter_steps(node, job_id):
+    if node.get('name') == 'step':
+        attrs = node.get('attrs', {})
+        yield job_id, attrs.get('action'), attrs.get('selector') or attrs.get('url') or attrs.get('label'), \
+            node['seconds'], bool(node.get('error'))
+    for child in node.get('children', []):
+        yield from _iter_steps(child, job_id)
+
+
+def slowest_steps(root_dir=DEFAULT_ARTIFACTS_DIR, top=DEFAULT_TOP, recent=DEFAULT_KEEP):
+    """Steps (action + selector/URL) that cost the most wall-clock time over the `recent` traced jobs."""
+    totals = {}
+    for trace_dir in _trace_dirs(root_dir)[-recent:]:
+        try:
+            with open(os.path.join(trace_dir, TRACE_FILE), encoding='utf-8') as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for job_id, action, target, seconds, failed in _iter_steps(document.get('spans', {}), document.get('jobId')):
+            row = totals.setdefault((action, target), {'action': action, 'target': target, 'count': 0,
+                                                       'totalSeconds': 0.0, 'maxSeconds': 0.0,
+                                                       'failures': 0, 'jobs': set()})
+            row['count'] += 1
+            row['totalSeconds'] += seconds
+            row['maxSeconds'] = max(row['maxSeconds'], seconds)
+            row['failures'] += failed
+            row['jobs'].add(job_id)
+
+    rows = sorted(totals.values(), key=lambda r: r['totalSeconds'], reverse=True)[:top]
+    for row in rows:
+        row['avgSeconds'] = round(row['totalSeconds'] / row['count'], 3)
+        row['totalSeconds'] = round(row['totalSeconds'], 3)
+        row['jobs'] = len(row['jobs'])
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slowest steps across recently traced jobs")
+    parser.add_argument('--dir', default=DEFAULT_ARTIFACTS_DIR, help="Trace artifacts directory")
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help="Rows to show")
+    parser.add_argument('--recent', type=int, default=DEFAULT_KEEP, help="Most recent traced jobs to include")
+    args = parser.parse_args()
+
+    rows = slowest_steps(args.dir, args.top, args.recent)
+    if not rows:
+        print(f"No traces in {args.dir}")
+    for row in rows:
+        print(f"{row['totalSeconds']:>9.1f}s total {row['avgSeconds']:>7.2f}s avg {row['maxSeconds']:>7.2f}s max "
+              f"x{row['count']:<4} fail {row['failures']:<3} {row['action']} {row['target']}")